@@ -0,0 +1,141 @@
+'''Moves old purchased grocery lists out of the hot tables into compressed month archives.
+
+archive_grocery_lists() takes every purchased list dated before a cutoff, writes it, its items
+and their ingredient names as one JSON line into the gzipped payload of the user's
+grocery_archives row for that month, and deletes it from grocery_list (its items go with it by
+cascade). Each month moves in its own transaction, so an interrupted run loses nothing and can
+simply be run again. grocery_list and grocery_ingredients then only hold recent history, and
+their indexes and cache footprint stay the same size however long people use the app.
+
+Archived lists read like live ones: ArchivedList has the attributes the list templates use.
+The history page lists archived months from their small summary columns and only decompresses
+a month when it is opened.
+
+Run it from cron, e.g. monthly: `python archive.py --months 6`.
+'''
+
+import argparse
+import gzip
+import json
+from collections import namedtuple
+from datetime import date
+from sqlalchemy import select, insert
+from model import db, GroceryList, GroceryIngredient, GroceryArchive, Ingredient
+import bulk_delete
+
+ARCHIVE_AFTER_MONTHS = 6
+
+ArchivedIngredient = namedtuple('ArchivedIngredient', ['id', 'name'])
+ArchivedItem = namedtuple('ArchivedItem', ['ingredient_id', 'quantity', 'ingredient'])
+ArchivedList = namedtuple('ArchivedList', ['id', 'name', 'created_on', 'revision', 'grocery_ingredients', 'active'], defaults=[False])
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+def months_before(day, months):
+    '''The first day of the month months before day's month.'''
+    index = day.year * 12 + day.month - 1 - months
+    return date(index // 12, index % 12 + 1, 1)
+
+def encode_lists(rows):
+    '''JSON lines for grocery list rows of (list id, name, created_on, revision, ingredient id, ingredient name, quantity), ordered by list id.'''
+    lines = []
+    current = None
+    for row in rows:
+        if current is None or current['id'] != row.id:
+            if current is not None:
+                lines.append(json.dumps(current))
+            current = {'id': row.id, 'name': row.name, 'created_on': row.created_on.isoformat(), 'revision': row.revision, 'items': []}
+        if row.ingredient_id is not None:
+            current['items'].append({'ingredient_id': row.ingredient_id, 'name': row.ingredient_name, 'quantity': row.quantity})
+    if current is not None:
+        lines.append(json.dumps(current))
+    return ''.join(line + '\n' for line in lines).encode()
+
+def decode_lists(payload):
+    '''ArchivedLists from an archive payload, newest first.'''
+    lists = []
+    for line in gzip.decompress(payload).decode().splitlines():
+        record = json.loads(line)
+        items = [ArchivedItem(item['ingredient_id'], item['quantity'], ArchivedIngredient(item['ingredient_id'], item['name']))
+                 for item in record['items']]
+        lists.append(ArchivedList(record['id'], record['name'], date.fromisoformat(record['created_on']), record['revision'], items))
+    return sorted(lists, key=lambda grocery_list: grocery_list.id, reverse=True)
+
+
+def archive_month(user_id, month, list_ids):
+    '''Move the given purchased lists of one user and month into its archive row, and commit.'''
+    rows = db.session.execute(select(GroceryList.id, GroceryList.name, GroceryList.created_on, GroceryList.revision,
+                                     GroceryIngredient.ingredient_id, Ingredient.name.label('ingredient_name'), GroceryIngredient.quantity)
+                              .outerjoin(GroceryIngredient, GroceryIngredient.grocery_list_id == GroceryList.id)
+                              .outerjoin(Ingredient, Ingredient.id == GroceryIngredient.ingredient_id)
+                              .where(GroceryList.id.in_(list_ids))
+                              .order_by(GroceryList.id, GroceryIngredient.id)).all()
+    #gzip members can be concatenated, so adding to a month that already has an archive is an append
+    payload = gzip.compress(encode_lists(rows))
+    existing = db.session.execute(select(GroceryArchive).filter_by(user_id=user_id, month=month)).scalar()
+    if existing is None:
+        db.session.execute(insert(GroceryArchive).values(user_id=user_id, month=month, list_count=len(list_ids), payload=payload,
+                                                         first_list_id=min(list_ids), last_list_id=max(list_ids)))
+    else:
+        existing.payload += payload
+        existing.list_count += len(list_ids)
+        existing.first_list_id = min(existing.first_list_id, *list_ids)
+        existing.last_list_id = max(existing.last_list_id, *list_ids)
+    bulk_delete.delete_grocery_lists(user_id, list_ids, purchased_only=True)
+    db.session.commit()
+
+def archive_grocery_lists(months=ARCHIVE_AFTER_MONTHS, today=None):
+    '''Archive every purchased list dated more than months whole months ago. Returns how many lists were moved.'''
+    cutoff = months_before(today or date.today(), months)
+    due = db.session.execute(select(GroceryList.user_id, GroceryList.created_on, GroceryList.id)
+                             .where(GroceryList.active == False, GroceryList.created_on < cutoff)
+                             .order_by(GroceryList.user_id, GroceryList.created_on)).all()
+
+    by_month = {}
+    for row in due:
+        by_month.setdefault((row.user_id, month_start(row.created_on)), []).append(row.id)
+    for ((user_id, month), list_ids) in by_month.items():
+        archive_month(user_id, month, list_ids)
+    return len(due)
+
+
+def archived_months(user_id):
+    '''(month, list_count) rows for the user's archives, newest first. Payloads are not loaded.'''
+    return db.session.execute(select(GroceryArchive.month, GroceryArchive.list_count)
+                              .filter_by(user_id=user_id)
+                              .order_by(GroceryArchive.month.desc())).all()
+
+def archived_lists(user_id, month):
+    '''The ArchivedLists of one month, newest first, or None if the user has no archive for it.'''
+    payload = db.session.execute(select(GroceryArchive.payload).filter_by(user_id=user_id, month=month)).scalar()
+    return decode_lists(payload) if payload is not None else None
+
+def archived_list(user_id, grocery_list_id):
+    '''One archived list, or None.'''
+    payloads = db.session.execute(select(GroceryArchive.payload)
+                                  .where(GroceryArchive.user_id == user_id,
+                                         GroceryArchive.first_list_id <= grocery_list_id,
+                                         GroceryArchive.last_list_id >= grocery_list_id)).scalars()
+    for payload in payloads:
+        for grocery_list in decode_lists(payload):
+            if grocery_list.id == grocery_list_id:
+                return grocery_list
+    return None
+
+def iter_archived_lists(user_id):
+    '''Every archived list, newest first, decompressing one month at a time.'''
+    for row in archived_months(user_id):
+        yield from archived_lists(user_id, row.month)
+
+
+if __name__ == '__main__':
+    import server
+
+    parser = argparse.ArgumentParser(description='Move purchased grocery lists older than some months into compressed archives.')
+    parser.add_argument('--months', type=int, default=ARCHIVE_AFTER_MONTHS)
+    args = parser.parse_args()
+
+    server.create_app(push_context=True)
+    print(f'Archived {archive_grocery_lists(args.months)} grocery lists.')
@@ -0,0 +1,232 @@
+'''Async JSON API for menus, pantry, grocery lists and recipes, served over ASGI.
+
+Run it beside the Flask app with an ASGI server, e.g. `uvicorn async_api:app --workers 4`. It
+talks to the same database through SQLAlchemy's async engine (asyncpg for Postgres, aiosqlite
+for SQLite) using the pool settings from model.engine_options, so a worker can keep many
+requests in flight while they wait on the database instead of holding a thread each.
+
+Clients trade a username and password for a bearer token at POST /api/v1/tokens and send it as
+"Authorization: Bearer <token>" on every other call.
+'''
+
+import hashlib
+import os
+import secrets
+from contextlib import asynccontextmanager
+from sqlalchemy import select, insert, update, delete
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from model import (engine_options, enforce_foreign_keys, check_password, upsert, utcnow, User, Ingredient, OnHand, Menu, Day, DaysRecipe, Recipe, RecipeIngredient,
+                   GroceryList, GroceryIngredient, ApiToken)
+from menu_builder import insert_menus
+
+#Largest number of items accepted in one bulk request body
+MAX_BULK = 500
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+
+def async_database_uri(uri):
+    '''The async-driver form of a database uri.'''
+    url = make_url(uri)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+engine = create_async_engine(async_database_uri(os.environ['POSTGRES_URI']), **engine_options(os.environ['POSTGRES_URI']))
+enforce_foreign_keys(engine.sync_engine)
+
+
+async def read_json(request):
+    '''The request body as a JSON object, or a 400.'''
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise HTTPException(400, 'Expected a JSON object.')
+    return body
+
+async def authenticate(request, conn):
+    '''The id of the user whose bearer token is on the request, or a 401.'''
+    (scheme, _, token) = request.headers.get('Authorization', '').partition(' ')
+    user_id = None
+    if scheme.lower() == 'bearer' and token:
+        user_id = (await conn.execute(select(ApiToken.user_id).filter_by(token_hash=hash_token(token.strip())))).scalar()
+    if user_id is None:
+        raise HTTPException(401, 'A valid bearer token is required.')
+    return user_id
+
+def endpoint(handler):
+    '''Run handler(request, conn, user_id) in one transaction for the authenticated user.'''
+    async def wrapper(request):
+        async with engine.begin() as conn:
+            user_id = await authenticate(request, conn)
+            return await handler(request, conn, user_id)
+    return wrapper
+
+
+async def create_token(request):
+    body = await read_json(request)
+    async with engine.begin() as conn:
+        user = (await conn.execute(select(User.id, User.password).filter_by(username=body.get('username')))).first()
+        #Password hashing is deliberately slow, so keep it off the event loop
+        (matches, new_hash) = (False, None) if user is None else await run_in_threadpool(check_password, user.password, str(body.get('password', '')))
+        if not matches:
+            raise HTTPException(401, 'Incorrect username or password.')
+        if new_hash:
+            await conn.execute(update(User).where(User.id == user.id).values(password=new_hash))
+
+        token = secrets.token_urlsafe(32)
+        await conn.execute(insert(ApiToken).values(user_id=user.id, token_hash=hash_token(token),
+                                                   name=body.get('name'), created_at=utcnow()))
+    return JSONResponse({'token': token}, status_code=201)
+
+@endpoint
+async def list_menus(request, conn, user_id):
+    rows = await conn.execute(select(Menu.id, Menu.name, Menu.active, Day.day_of_week, Recipe.id.label('recipe_id'), Recipe.name.label('recipe_name'))
+                              .select_from(Menu)
+                              .outerjoin(Day, Day.menu_id == Menu.id)
+                              .outerjoin(DaysRecipe, DaysRecipe.day_id == Day.id)
+                              .outerjoin(Recipe, Recipe.id == DaysRecipe.recipe_id)
+                              .where(Menu.user_id == user_id)
+                              .order_by(Menu.id, Day.day_of_week, DaysRecipe.id))
+    menus = {}
+    for row in rows:
+        menu = menus.setdefault(row.id, {'id': row.id, 'name': row.name, 'active': row.active, 'days': {}})
+        if row.day_of_week is not None:
+            recipes = menu['days'].setdefault(str(row.day_of_week), [])
+            if row.recipe_id is not None:
+                recipes.append({'id': row.recipe_id, 'name': row.recipe_name})
+    return JSONResponse({'menus': list(menus.values())})
+
+@endpoint
+async def create_menus(request, conn, user_id):
+    '''Create one menu, or up to MAX_BULK at once, from {"name": ..., "days": {day: [recipe ids]}} or {"menus": [...]}.'''
+    body = await read_json(request)
+    specs = body['menus'] if 'menus' in body else [body]
+    try:
+        if len(specs) > MAX_BULK:
+            raise ValueError(f'Send at most {MAX_BULK} menus at a time.')
+        menu_ids = await conn.run_sync(insert_menus, user_id, [(spec['name'], spec.get('days', {})) for spec in specs])
+    except (KeyError, TypeError, AttributeError):
+        raise HTTPException(400, 'Each menu needs a name and a days mapping.')
+    except ValueError as error:
+        raise HTTPException(400, str(error))
+    return JSONResponse({'menu_ids': menu_ids}, status_code=201)
+
+@endpoint
+async def list_pantry(request, conn, user_id):
+    rows = await conn.execute(select(OnHand.ingredient_id, Ingredient.name, OnHand.quantity)
+                              .join(Ingredient, Ingredient.id == OnHand.ingredient_id)
+                              .where(OnHand.user_id == user_id)
+                              .order_by(Ingredient.name))
+    return JSONResponse({'items': [{'ingredient_id': row.ingredient_id, 'name': row.name, 'quantity': row.quantity} for row in rows]})
+
+@endpoint
+async def add_to_pantry(request, conn, user_id):
+    '''Add up to MAX_BULK items from {"items": [{"ingredient_id": ..., "quantity": ...}]} in one upsert.'''
+    body = await read_json(request)
+    try:
+        items = body['items']
+        if len(items) > MAX_BULK:
+            raise HTTPException(400, f'Send at most {MAX_BULK} items at a time.')
+        quantities = {}
+        for (position, item) in enumerate(items, start=1):
+            ingredient_id = int(item['ingredient_id'])
+            quantity = int(item['quantity'])
+            #int() would quietly truncate a fractional quantity
+            if quantity < 0 or isinstance(item['quantity'], float) and not item['quantity'].is_integer():
+                raise HTTPException(400, f'Item {position} needs a whole number quantity of 0 or more.')
+            quantities[ingredient_id] = quantities.get(ingredient_id, 0) + quantity
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(400, 'Expected {"items": [{"ingredient_id": ..., "quantity": ...}]}.')
+    if not quantities:
+        return JSONResponse({'added': 0})
+
+    known = set((await conn.execute(select(Ingredient.id).where(Ingredient.id.in_(quantities)))).scalars())
+    if set(quantities) - known:
+        raise HTTPException(400, f'Unknown ingredient ids: {", ".join(str(ingredient_id) for ingredient_id in sorted(set(quantities) - known))}')
+
+    merge = upsert(OnHand, conn.dialect).values([{'user_id': user_id, 'ingredient_id': ingredient_id, 'quantity': quantity}
+                                                 for (ingredient_id, quantity) in quantities.items()])
+    merge = merge.on_conflict_do_update(index_elements=['user_id', 'ingredient_id'],
+                                        set_={'quantity': OnHand.quantity + merge.excluded.quantity})
+    await conn.execute(merge)
+    return JSONResponse({'added': len(quantities)})
+
+@endpoint
+async def remove_from_pantry(request, conn, user_id):
+    result = await conn.execute(delete(OnHand).filter_by(user_id=user_id, ingredient_id=request.path_params['ingredient_id']))
+    if not result.rowcount:
+        raise HTTPException(404, 'That ingredient is not in your pantry.')
+    return JSONResponse({'removed': result.rowcount})
+
+@endpoint
+async def active_list(request, conn, user_id):
+    grocery_list = (await conn.execute(select(GroceryList.id, GroceryList.name)
+                                       .filter_by(user_id=user_id, active=True)
+                                       .order_by(GroceryList.id.desc()))).first()
+    if grocery_list is None:
+        return JSONResponse({'list': None})
+
+    rows = await conn.execute(select(GroceryIngredient.id, GroceryIngredient.ingredient_id, Ingredient.name, GroceryIngredient.quantity)
+                              .join(Ingredient, Ingredient.id == GroceryIngredient.ingredient_id)
+                              .where(GroceryIngredient.grocery_list_id == grocery_list.id)
+                              .order_by(GroceryIngredient.id))
+    items = [{'id': row.id, 'ingredient_id': row.ingredient_id, 'name': row.name, 'quantity': row.quantity} for row in rows]
+    return JSONResponse({'list': {'id': grocery_list.id, 'name': grocery_list.name, 'items': items}})
+
+async def recipes_json(conn, user_id, recipe_id=None):
+    query = (select(Recipe.id, Recipe.name, Recipe.instructions, RecipeIngredient.ingredient_id, Ingredient.name.label('ingredient_name'), RecipeIngredient.quantity)
+             .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+             .outerjoin(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+             .where(Recipe.user_id == user_id)
+             .order_by(Recipe.name, Recipe.id, RecipeIngredient.id))
+    if recipe_id is not None:
+        query = query.where(Recipe.id == recipe_id)
+
+    recipes = {}
+    for row in await conn.execute(query):
+        recipe = recipes.setdefault(row.id, {'id': row.id, 'name': row.name, 'instructions': row.instructions, 'ingredients': []})
+        if row.ingredient_id is not None:
+            recipe['ingredients'].append({'ingredient_id': row.ingredient_id, 'name': row.ingredient_name, 'quantity': row.quantity})
+    return list(recipes.values())
+
+@endpoint
+async def list_recipes(request, conn, user_id):
+    return JSONResponse({'recipes': await recipes_json(conn, user_id)})
+
+@endpoint
+async def get_recipe(request, conn, user_id):
+    recipes = await recipes_json(conn, user_id, request.path_params['recipe_id'])
+    if not recipes:
+        raise HTTPException(404, 'No such recipe.')
+    return JSONResponse(recipes[0])
+
+
+async def http_error(request, error):
+    return JSONResponse({'error': error.detail}, status_code=error.status_code)
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    await engine.dispose()
+
+app = Starlette(routes=[
+    Route('/api/v1/tokens', create_token, methods=['POST']),
+    Route('/api/v1/menus', list_menus, methods=['GET']),
+    Route('/api/v1/menus', create_menus, methods=['POST']),
+    Route('/api/v1/pantry', list_pantry, methods=['GET']),
+    Route('/api/v1/pantry', add_to_pantry, methods=['POST']),
+    Route('/api/v1/pantry/{ingredient_id:int}', remove_from_pantry, methods=['DELETE']),
+    Route('/api/v1/lists/active', active_list, methods=['GET']),
+    Route('/api/v1/recipes', list_recipes, methods=['GET']),
+    Route('/api/v1/recipes/{recipe_id:int}', get_recipe, methods=['GET']),
+], exception_handlers={HTTPException: http_error}, lifespan=lifespan)
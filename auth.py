@@ -0,0 +1,97 @@
+'''Who is signed in, without a database round trip per request, and how their passwords are hashed.
+
+load_user() answers from a small per-worker cache of id -> SessionUser, a plain record of the
+few user columns the app reads through current_user. Entries live for USER_CACHE_TTL seconds
+(MENU_MASTER_USER_CACHE_TTL), and a change to a user row through the ORM drops its entry in
+this worker at once; other workers see it when their entry expires.
+
+Passwords are hashed with model.PASSWORD_HASH_METHOD (MENU_MASTER_PASSWORD_HASH). A stored hash
+made with other parameters still verifies, and is replaced with one made with the current method
+at the user's next successful login.
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from model import db, User, check_password
+
+USER_CACHE_TTL = float(os.environ.get('MENU_MASTER_USER_CACHE_TTL', 300))
+MAX_CACHED_USERS = 10000
+
+
+class SessionUser(UserMixin):
+    '''The signed-in user as flask_login sees it. Not an ORM object; use .id for queries.'''
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    def __repr__(self):
+        return f'<SessionUser user_id={self.id} username={self.username}>'
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email)
+
+
+class UserCache:
+    '''A TTL'd LRU of user id -> SessionUser.'''
+
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=MAX_CACHED_USERS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def load(self, user_id):
+        '''The SessionUser for user_id, or None if there is no such user.'''
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and cached[0] > now:
+                self._entries.move_to_end(user_id)
+                return cached[1]
+
+        row = db.session.execute(select(User.id, User.username, User.email).where(User.id == user_id)).first()
+        if row is None:
+            self.forget(user_id)
+            return None
+        record = SessionUser(row.id, row.username, row.email)
+        self.store(record)
+        return record
+
+    def store(self, record):
+        with self._lock:
+            self._entries[record.id] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(record.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def forget(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+user_cache = UserCache()
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    user_cache.forget(target.id)
+
+
+def verify_password(user, password):
+    '''Check password against an ORM user's hash, upgrading the hash to PASSWORD_HASH_METHOD if it is out of date.
+
+    The new hash is left on user for the caller to commit.
+    '''
+    (matches, new_hash) = check_password(user.password, password)
+    if new_hash:
+        user.password = new_hash
+    return matches
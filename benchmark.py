@@ -0,0 +1,294 @@
+'''Reproducible benchmark of the real routes against a synthetic dataset.
+
+Generates users x recipes x ingredients per recipe x menus x historical lists into the database given
+by --database-uri (a throwaway SQLite file by default, or a local Postgres). It then drives the Flask
+routes through the test client and writes latency percentiles, queries per request, peak RSS and an
+EXPLAIN check of the hot lookups to a JSON file. Pass --baseline with an earlier result to fail the
+run when a route gets slower or issues more queries.
+
+Usage: python benchmark.py --users 5 --recipes 500 --output bench.json [--baseline old.json]
+'''
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROUTES = ['/menus', '/lists', '/pantry', '/recipe/view/<id>', '/lists/generate', '/lists/purchase']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark Menu Master routes against a synthetic dataset.')
+    parser.add_argument('--database-uri', default=f'sqlite:///{os.path.join(tempfile.gettempdir(), "menu_master_bench.db")}')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate the tables even if the database has data')
+    parser.add_argument('--skip-generate', action='store_true', help='benchmark the data already in the database')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--ingredients', type=int, default=2000, help='size of the shared ingredient catalog')
+    parser.add_argument('--recipes', type=int, default=200, help='recipes per user')
+    parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+    parser.add_argument('--pantry', type=int, default=100, help='pantry items per user')
+    parser.add_argument('--menus', type=int, default=20, help='menus per user')
+    parser.add_argument('--lists', type=int, default=100, help='historical grocery lists per user')
+    parser.add_argument('--items-per-list', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=20, help='passes over the routes per user')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', help='earlier output to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='allowed fractional p90 slowdown against the baseline')
+    parser.add_argument('--fail-on-full-scan', action='store_true', help='exit non-zero if a hot lookup scans its whole table')
+    return parser.parse_args()
+
+def generate(args, rng):
+    '''Bulk load the synthetic dataset and return the generated user ids.'''
+    from sqlalchemy import insert, update
+    from werkzeug.security import generate_password_hash
+    from model import db, User, Ingredient, Recipe, RecipeIngredient, OnHand, Menu, GroceryList, GroceryIngredient
+    import menu_builder
+    import shortfall
+
+    db.session.execute(insert(Ingredient), [{'name': f'Ingredient {n}'} for n in range(args.ingredients)])
+    ingredient_ids = list(range(1, args.ingredients + 1))
+    password = generate_password_hash('bench')
+
+    user_ids = []
+    for n in range(args.users):
+        user_id = db.session.execute(insert(User)
+                                     .values(username=f'bench{n}', email=f'bench{n}@bench.test', password=password)
+                                     .returning(User.id)).scalar_one()
+        user_ids.append(user_id)
+
+        recipe_ids = db.session.execute(insert(Recipe)
+                                        .values([{'name': f'Recipe {n}-{r}', 'instructions': 'Cook it.', 'user_id': user_id}
+                                                 for r in range(args.recipes)])
+                                        .returning(Recipe.id)).scalars().all()
+        db.session.execute(insert(RecipeIngredient), [
+            {'recipe_id': recipe_id, 'ingredient_id': ingredient_id, 'quantity': rng.randint(1, 5)}
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(ingredient_ids, args.ingredients_per_recipe)
+        ])
+        db.session.execute(insert(OnHand), [
+            {'user_id': user_id, 'ingredient_id': ingredient_id, 'quantity': rng.randint(1, 10)}
+            for ingredient_id in rng.sample(ingredient_ids, args.pantry)
+        ])
+        db.session.commit()
+
+        if args.menus:
+            menu_ids = menu_builder.build_menus(user_id, [
+                (f'Menu {m}', {day: [rng.choice(recipe_ids)] for day in range(1, menu_builder.DAYS_IN_WEEK + 1)})
+                for m in range(args.menus)
+            ])
+            db.session.execute(update(Menu).where(Menu.id == menu_ids[-1]).values(active=True))
+            shortfall.set_active_menu(user_id, menu_ids[-1])
+
+        for l in range(args.lists):
+            list_id = db.session.execute(insert(GroceryList)
+                                         .values(name=f'History {l}', active=False, user_id=user_id)
+                                         .returning(GroceryList.id)).scalar_one()
+            db.session.execute(insert(GroceryIngredient), [
+                {'grocery_list_id': list_id, 'ingredient_id': ingredient_id, 'quantity': rng.randint(1, 5)}
+                for ingredient_id in rng.sample(ingredient_ids, args.items_per_list)
+            ])
+        db.session.commit()
+
+    return user_ids
+
+def hot_lookups(user_id):
+    '''(name, table, statement) for the indexed lookups the routes rely on.'''
+    from sqlalchemy import select
+    from model import db, Recipe, RecipeIngredient, OnHand, Menu, Day, DaysRecipe, GroceryList, GroceryIngredient
+
+    menu_id = db.session.execute(select(Menu.id).filter_by(user_id=user_id).limit(1)).scalar() or 0
+    day_id = db.session.execute(select(Day.id).filter_by(menu_id=menu_id).limit(1)).scalar() or 0
+    recipe_id = db.session.execute(select(Recipe.id).filter_by(user_id=user_id).limit(1)).scalar() or 0
+    list_id = db.session.execute(select(GroceryList.id).filter_by(user_id=user_id).limit(1)).scalar() or 0
+
+    return [
+        ('active menu', 'menus', select(Menu.id).filter_by(user_id=user_id, active=True)),
+        ('active list', 'grocery_list', select(GroceryList.id).filter_by(user_id=user_id, active=True)),
+        ('list history page', 'grocery_list',
+         select(GroceryList.id).filter_by(user_id=user_id, active=False).order_by(GroceryList.id.desc()).limit(10)),
+        ('list items', 'grocery_ingredients', select(GroceryIngredient.id).filter_by(grocery_list_id=list_id)),
+        ('pantry item', 'on_hand', select(OnHand.id).filter_by(user_id=user_id, ingredient_id=1)),
+        ('user recipes', 'recipes', select(Recipe.id).filter_by(user_id=user_id)),
+        ('recipe ingredients', 'recipe_ingredients', select(RecipeIngredient.id).filter_by(recipe_id=recipe_id)),
+        ('menu days', 'days', select(Day.id).filter_by(menu_id=menu_id)),
+        ('day recipes', 'days_recipes', select(DaysRecipe.id).filter_by(day_id=day_id)),
+    ]
+
+def explain(user_id):
+    '''EXPLAIN each hot lookup and report whether it scans its whole table.'''
+    from sqlalchemy import text
+    from model import db
+
+    dialect = db.engine.dialect
+    if dialect.name == 'postgresql':
+        db.session.execute(text('ANALYZE'))
+
+    results = {}
+    for (name, table, statement) in hot_lookups(user_id):
+        sql = str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+        if dialect.name == 'postgresql':
+            plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+            full_scan = any(node.get('Node Type') == 'Seq Scan' and node.get('Relation Name') == table
+                            for node in walk_plan(plan[0]['Plan']))
+        else:
+            plan = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+            full_scan = any(detail.startswith(f'SCAN {table}') for detail in plan)
+        results[name] = {'table': table, 'full_scan': full_scan, 'plan': plan}
+    return results
+
+def walk_plan(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk_plan(child)
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def drive(app, user_ids, iterations, rng):
+    '''Request every route for every user and return {route: {latencies, queries}}.'''
+    from sqlalchemy import event, select
+    from model import db, Recipe
+
+    with app.app_context():
+        recipe_ids = {user_id: db.session.execute(select(Recipe.id).filter_by(user_id=user_id)).scalars().all()
+                      for user_id in user_ids}
+        engine = db.engine
+
+    counter = {'queries': 0}
+    def count_query(*args):
+        counter['queries'] += 1
+    event.listen(engine, 'before_cursor_execute', count_query)
+
+    samples = {route: {'latencies': [], 'queries': []} for route in ROUTES}
+    for user_id in user_ids:
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+
+        for _ in range(iterations):
+            for route in ROUTES:
+                url = route.replace('<id>', str(rng.choice(recipe_ids[user_id]))) if recipe_ids[user_id] else route
+                counter['queries'] = 0
+                started = time.perf_counter()
+                response = client.get(url)
+                response.get_data()
+                elapsed = time.perf_counter() - started
+
+                if response.status_code >= 400:
+                    sys.exit(f'{url} returned {response.status_code}')
+                samples[route]['latencies'].append(elapsed)
+                samples[route]['queries'].append(counter['queries'])
+
+    event.remove(engine, 'before_cursor_execute', count_query)
+    return samples
+
+def summarize(samples):
+    summary = {}
+    for (route, data) in samples.items():
+        latencies = data['latencies']
+        if not latencies:
+            continue
+        summary[route] = {
+            'requests': len(latencies),
+            'mean_ms': 1000 * sum(latencies) / len(latencies),
+            'p50_ms': 1000 * percentile(latencies, 0.50),
+            'p90_ms': 1000 * percentile(latencies, 0.90),
+            'p99_ms': 1000 * percentile(latencies, 0.99),
+            'queries_mean': sum(data['queries']) / len(data['queries']),
+            'queries_max': max(data['queries']),
+        }
+    return summary
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #macOS reports bytes, Linux reports kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def regressions(summary, baseline, max_regression):
+    '''Describe every route that got slower than allowed or issues more queries than the baseline.'''
+    problems = []
+    for (route, old) in baseline.get('routes', {}).items():
+        new = summary.get(route)
+        if not new:
+            continue
+        if new['p90_ms'] > old['p90_ms'] * (1 + max_regression):
+            problems.append(f'{route}: p90 {old["p90_ms"]:.1f}ms -> {new["p90_ms"]:.1f}ms')
+        if new['queries_max'] > old['queries_max']:
+            problems.append(f'{route}: queries per request {old["queries_max"]} -> {new["queries_max"]}')
+    return problems
+
+def main():
+    args = parse_args()
+    os.environ['POSTGRES_URI'] = args.database_uri
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+
+    import server
+    from sqlalchemy import select
+    from model import db, User
+
+    app = server.create_app()
+    rng = random.Random(args.seed)
+
+    with app.app_context():
+        if args.skip_generate:
+            user_ids = db.session.execute(select(User.id).order_by(User.id)).scalars().all()
+        else:
+            db.create_all()
+            if db.session.execute(select(User.id).limit(1)).first():
+                if not args.reset:
+                    sys.exit('The database already has data; pass --reset to replace it or --skip-generate to reuse it.')
+                db.drop_all()
+                db.create_all()
+            started = time.perf_counter()
+            user_ids = generate(args, rng)
+            print(f'Generated {len(user_ids)} users in {time.perf_counter() - started:.1f}s')
+        explain_results = explain(user_ids[0]) if user_ids else {}
+
+    summary = summarize(drive(app, user_ids, args.iterations, rng))
+    result = {
+        'commit': current_commit(),
+        'database': args.database_uri.split(':', 1)[0],
+        'dataset': {key: getattr(args, key) for key in ['seed', 'users', 'ingredients', 'recipes', 'ingredients_per_recipe',
+                                                        'pantry', 'menus', 'lists', 'items_per_list', 'iterations']},
+        'routes': summary,
+        'peak_rss_kb': peak_rss_kb(),
+        'explain': explain_results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    for (route, stats) in summary.items():
+        print(f'{route:20} p50 {stats["p50_ms"]:7.1f}ms  p90 {stats["p90_ms"]:7.1f}ms  p99 {stats["p99_ms"]:7.1f}ms  '
+              f'queries {stats["queries_max"]}')
+    print(f'peak RSS {result["peak_rss_kb"]} KB, results written to {args.output}')
+
+    failures = []
+    full_scans = [name for (name, check) in explain_results.items() if check['full_scan']]
+    if full_scans:
+        print(f'Full table scans: {", ".join(full_scans)}')
+        if args.fail_on_full_scan:
+            failures.extend(f'{name} scans its whole table' for name in full_scans)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures.extend(regressions(summary, json.load(f), args.max_regression))
+
+    if failures:
+        sys.exit('Performance regressions:\n' + '\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+'''Deleting many recipes, menus or grocery lists at once.
+
+Each delete is one statement scoped to the user. The database removes child rows itself through
+ON DELETE CASCADE (recipe ingredients, days and their recipes, grocery list items), so nothing is
+loaded into Python. What the ORM events would otherwise keep in step is done here in bulk: the
+active menu's demand, menu revisions and cached fragments.
+None of these functions commit. After committing deleted recipes, pass their ids to
+ranking.recipe_ranker.recipes_removed so the ranking index is updated in place.
+'''
+
+from sqlalchemy import select, update, delete
+from model import db, Recipe, Menu, Day, DaysRecipe, GroceryList
+from revisions import bump
+import fragments
+import shortfall
+
+
+def run_delete(statement):
+    '''Rows from a DELETE ... RETURNING, without the ORM looking for the rows in the session.'''
+    return db.session.execute(statement, execution_options={'synchronize_session': False}).all()
+
+def delete_recipes(user_id, recipe_ids):
+    '''Delete the user's recipes with these ids, taking them off every menu. Returns the deleted (id, name) rows.'''
+    owned = select(Recipe.id).where(Recipe.user_id == user_id, Recipe.id.in_(recipe_ids))
+    shortfall.remove_recipes(owned)
+    db.session.execute(update(Menu)
+                       .where(Menu.id.in_(select(Day.menu_id)
+                                          .join(DaysRecipe, DaysRecipe.day_id == Day.id)
+                                          .where(DaysRecipe.recipe_id.in_(owned))))
+                       .values(bump(Menu)),
+                       execution_options={'synchronize_session': False})
+
+    return run_delete(delete(Recipe)
+                      .where(Recipe.user_id == user_id, Recipe.id.in_(recipe_ids))
+                      .returning(Recipe.id, Recipe.name))
+
+def delete_menus(user_id, menu_ids):
+    '''Delete the user's menus with these ids. Returns the deleted (id, name) rows.'''
+    deleted = run_delete(delete(Menu)
+                         .where(Menu.user_id == user_id, Menu.id.in_(menu_ids))
+                         .returning(Menu.id, Menu.name, Menu.active))
+    if any(row.active for row in deleted):
+        shortfall.clear(user_id)
+    for row in deleted:
+        fragments.fragment_cache.forget(fragments.MENU_WEEK, row.id)
+    return deleted
+
+def delete_grocery_lists(user_id, grocery_list_ids=None, purchased_only=False):
+    '''Delete the user's grocery lists with these ids, or every list if grocery_list_ids is None.
+
+    Pass purchased_only=True to keep the active list. Returns the deleted ids.
+    '''
+    statement = delete(GroceryList).where(GroceryList.user_id == user_id)
+    if grocery_list_ids is not None:
+        statement = statement.where(GroceryList.id.in_(grocery_list_ids))
+    if purchased_only:
+        statement = statement.where(GroceryList.active == False)
+
+    deleted = [row.id for row in run_delete(statement.returning(GroceryList.id))]
+    for grocery_list_id in deleted:
+        for kind in (fragments.ACTIVE_LIST, fragments.PAST_LIST):
+            fragments.fragment_cache.forget(kind, grocery_list_id)
+    return deleted
@@ -0,0 +1,116 @@
+'''Process-wide cache of the ingredient catalog, with a prefix index for typeahead search.
+
+The cache is dropped straight away when this process changes an ingredient. Changes made by other
+workers are noticed through the shared counter in catalog_versions, which is checked at most once
+every CHECK_INTERVAL seconds.
+'''
+
+import threading
+import time
+from bisect import bisect_left
+from sqlalchemy import event, inspect, select, update, insert
+from model import db, Ingredient, CatalogVersion
+
+CATALOG_NAME = 'ingredients'
+CHECK_INTERVAL = 5
+SEARCH_LIMIT = 10
+
+
+class CatalogSnapshot:
+    '''An immutable copy of the catalog: names by id, plus sorted keys for prefix search.
+
+    Every ingredient is indexed under its full lowercased name and under the rest of the name from
+    the start of each later word, so "cheese" finds "8 oz Package of Cream Cheese".
+    '''
+
+    def __init__(self, rows):
+        self.names = dict(rows)
+        full = sorted((name.lower(), ingredient_id) for (ingredient_id, name) in rows)
+        words = sorted((name.lower()[i + 1:], ingredient_id)
+                       for (ingredient_id, name) in rows
+                       for (i, char) in enumerate(name) if char == ' ' and name[i + 1:i + 2].strip())
+        self.full_keys = [key for (key, _) in full]
+        self.full_ids = [ingredient_id for (_, ingredient_id) in full]
+        self.word_keys = [key for (key, _) in words]
+        self.word_ids = [ingredient_id for (_, ingredient_id) in words]
+
+    def search(self, query, limit):
+        '''Ids of up to limit ingredients matching query, whole-name prefix matches first.'''
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        found = []
+        for (keys, ids) in ((self.full_keys, self.full_ids), (self.word_keys, self.word_ids)):
+            i = bisect_left(keys, query)
+            while i < len(keys) and keys[i].startswith(query) and len(found) < limit:
+                if ids[i] not in found:
+                    found.append(ids[i])
+                i += 1
+        return found
+
+class IngredientCatalog:
+    '''The current CatalogSnapshot, rebuilt only when the catalog version moves.'''
+
+    def __init__(self, check_interval=CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        '''Drop the cached snapshot so the next read rebuilds it.'''
+        self._snapshot = None
+
+    def snapshot(self):
+        '''Return the cached snapshot, rebuilding it if this worker's copy is stale.'''
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            version = current_version()
+            if self._snapshot is None or version != self._version:
+                rows = db.session.execute(select(Ingredient.id, Ingredient.name)).all()
+                self._snapshot = CatalogSnapshot([(ingredient_id, name) for (ingredient_id, name) in rows])
+                self._version = version
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def name(self, ingredient_id):
+        '''The name of an ingredient, or None if there is no such ingredient.'''
+        return self.snapshot().names.get(ingredient_id)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        '''Up to limit (id, name) pairs matching the start of the name or of any word in it.'''
+        snapshot = self.snapshot()
+        return [(ingredient_id, snapshot.names[ingredient_id]) for ingredient_id in snapshot.search(query, limit)]
+
+ingredient_catalog = IngredientCatalog()
+
+
+def current_version():
+    '''The shared ingredient catalog version, 0 if it has never been bumped.'''
+    return db.session.execute(select(CatalogVersion.version).filter_by(name=CATALOG_NAME)).scalar() or 0
+
+def bump_version(connection):
+    '''Increment the shared ingredient catalog version using the given connection, and drop this worker's cache.'''
+    result = connection.execute(update(CatalogVersion)
+                                .where(CatalogVersion.name == CATALOG_NAME)
+                                .values(version=CatalogVersion.version + 1))
+    if result.rowcount == 0:
+        connection.execute(insert(CatalogVersion).values(name=CATALOG_NAME, version=1))
+    ingredient_catalog.invalidate()
+
+@event.listens_for(Ingredient, 'after_insert')
+@event.listens_for(Ingredient, 'after_delete')
+def ingredient_changed(mapper, connection, target):
+    bump_version(connection)
+
+@event.listens_for(Ingredient, 'after_update')
+def ingredient_updated(mapper, connection, target):
+    #Adding to one of an ingredient's backref collections also flushes it as an update, with no column changed
+    state = inspect(target)
+    if any(state.attrs[column.key].history.has_changes() for column in mapper.column_attrs):
+        bump_version(connection)
@@ -0,0 +1,89 @@
+'''One grocery list for several menus over several weeks, against one shared pantry.
+
+The menus' recipes are a sparse recipe x ingredient matrix in coordinate form, read straight
+from recipe_ingredients. Each menu's days_recipes rows, weighted by the weeks it will run, give
+a recipe occurrence vector, and total demand is one matrix-vector product: a bincount over the
+matrix entries. The pantry is subtracted once from the total, so a pantry shared by several
+menus is never counted twice.
+'''
+
+import numpy as np
+from datetime import date
+from sqlalchemy import select
+from model import db, Menu, Day, DaysRecipe, RecipeIngredient, OnHand
+from grocery import write_list
+
+MAX_WEEKS = 12
+
+
+def menu_weeks(user_id, weeks):
+    '''Check {menu id: weeks} against the user's menus and return it with ints throughout.
+
+    Raises ValueError for a menu the user doesn't own or a week count outside 1 to MAX_WEEKS.
+    '''
+    weeks = {int(menu_id): int(count) for (menu_id, count) in weeks.items()}
+    if not weeks:
+        raise ValueError('Pick at least one menu.')
+    for (menu_id, count) in weeks.items():
+        if not 1 <= count <= MAX_WEEKS:
+            raise ValueError(f'Menu {menu_id} must run for between 1 and {MAX_WEEKS} weeks.')
+
+    owned = set(db.session.execute(select(Menu.id).where(Menu.user_id == user_id, Menu.id.in_(weeks))).scalars())
+    if set(weeks) - owned:
+        raise ValueError(f'Unknown menu ids: {", ".join(str(menu_id) for menu_id in sorted(set(weeks) - owned))}')
+    return weeks
+
+def consolidated_shortfall(user_id, weeks):
+    '''[(ingredient id, quantity)] the user is short on to cook every menu in {menu id: weeks}.'''
+    menu_ids = np.array(list(weeks), dtype=np.int64)
+    week_counts = np.array(list(weeks.values()), dtype=np.float64)
+
+    #Recipe occurrences: one row per recipe slot, weighted by its menu's week count
+    occurrences = np.array(db.session.execute(select(DaysRecipe.recipe_id, Day.menu_id)
+                                              .join(Day, Day.id == DaysRecipe.day_id)
+                                              .where(Day.menu_id.in_(weeks), DaysRecipe.recipe_id.is_not(None))).all(), dtype=np.int64).reshape(-1, 2)
+    if not len(occurrences):
+        return []
+    (recipe_ids, occurrence_rows) = np.unique(occurrences[:, 0], return_inverse=True)
+    menu_index = np.searchsorted(np.sort(menu_ids), occurrences[:, 1])
+    occurrence_weeks = week_counts[np.argsort(menu_ids)][menu_index]
+    recipe_counts = np.bincount(occurrence_rows, weights=occurrence_weeks, minlength=len(recipe_ids))
+
+    #Sparse recipe x ingredient matrix for just the recipes on these menus
+    used_recipes = (select(DaysRecipe.recipe_id)
+                    .join(Day, Day.id == DaysRecipe.day_id)
+                    .where(Day.menu_id.in_(weeks)))
+    entries = np.array(db.session.execute(select(RecipeIngredient.recipe_id, RecipeIngredient.ingredient_id, RecipeIngredient.quantity)
+                                          .where(RecipeIngredient.recipe_id.in_(used_recipes))).all(), dtype=np.int64).reshape(-1, 3)
+    if not len(entries):
+        return []
+    rows = np.searchsorted(recipe_ids, entries[:, 0])
+    (ingredient_ids, columns) = np.unique(entries[:, 1], return_inverse=True)
+    demand = np.bincount(columns, weights=entries[:, 2] * recipe_counts[rows], minlength=len(ingredient_ids))
+
+    #Subtract the pantry, matched onto the same ingredient columns
+    pantry = np.array(db.session.execute(select(OnHand.ingredient_id, OnHand.quantity).where(OnHand.user_id == user_id)).all(),
+                      dtype=np.int64).reshape(-1, 2)
+    positions = np.minimum(np.searchsorted(ingredient_ids, pantry[:, 0]), len(ingredient_ids) - 1)
+    needed = ingredient_ids[positions] == pantry[:, 0]
+    on_hand = np.zeros(len(ingredient_ids))
+    on_hand[positions[needed]] = np.maximum(pantry[needed, 1], 0)
+
+    shortfall = np.ceil(np.maximum(demand - on_hand, 0)).astype(np.int64)
+    short = np.flatnonzero(shortfall)
+    return list(zip(ingredient_ids[short].tolist(), shortfall[short].tolist()))
+
+def consolidate_lists(user_id, weeks, name=None):
+    '''Create one active grocery list covering every menu in {menu id: weeks} and commit.
+
+    Returns None if the pantry already covers them all. Raises ValueError for bad menus or weeks.
+    '''
+    weeks = menu_weeks(user_id, weeks)
+    rows = consolidated_shortfall(user_id, weeks)
+    if not rows:
+        return None
+
+    total_weeks = sum(weeks.values())
+    grocery_list = write_list(user_id, rows, name or f'{date.today()} ({len(weeks)} menus, {total_weeks} weeks)')
+    db.session.commit()
+    return grocery_list
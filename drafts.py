@@ -0,0 +1,90 @@
+'''Server-side store for recipes being built in the add-recipe wizard.
+
+The session only carries the draft id, so the cookie stays the same size however many ingredients
+a recipe has. Drafts that are never finished are evicted once they are older than DRAFT_TTL.
+'''
+
+from datetime import timedelta
+from sqlalchemy import select, insert, delete, literal
+from model import db, utcnow, Ingredient, Recipe, RecipeIngredient, RecipeDraft, RecipeDraftIngredient
+
+DRAFT_TTL = timedelta(days=1)
+
+
+class DraftExpired(ValueError):
+    '''The draft was evicted or never belonged to the user, so the recipe has to be started again.'''
+    def __init__(self):
+        super().__init__('That recipe draft has expired. Please start again.')
+
+def evict_expired():
+    '''Delete drafts older than DRAFT_TTL along with their ingredients.'''
+    expired = select(RecipeDraft.id).where(RecipeDraft.created_at < utcnow() - DRAFT_TTL)
+    db.session.execute(delete(RecipeDraftIngredient).where(RecipeDraftIngredient.draft_id.in_(expired)))
+    db.session.execute(delete(RecipeDraft).where(RecipeDraft.id.in_(expired)))
+
+def create_draft(user_id, name):
+    '''Start a new draft and return its id.'''
+    evict_expired()
+    draft_id = db.session.execute(insert(RecipeDraft)
+                                  .values(name=name, user_id=user_id, created_at=utcnow())
+                                  .returning(RecipeDraft.id)).scalar_one()
+    db.session.commit()
+    return draft_id
+
+def owns_draft(user_id, draft_id):
+    '''True if draft_id is a live draft belonging to the user.'''
+    return db.session.execute(select(RecipeDraft.id).filter_by(id=draft_id, user_id=user_id)).scalar() is not None
+
+def check_ingredient_ids(ingredient_ids):
+    '''Raise ValueError naming any of ingredient_ids that isn't in the catalog. One IN query.'''
+    ingredient_ids = set(ingredient_ids)
+    known = set(db.session.execute(select(Ingredient.id).where(Ingredient.id.in_(ingredient_ids))).scalars())
+    if ingredient_ids - known:
+        raise ValueError(f'Unknown ingredient ids: {", ".join(str(ingredient_id) for ingredient_id in sorted(ingredient_ids - known))}')
+
+def add_ingredients(user_id, draft_id, items):
+    '''Add (ingredient_id, quantity) pairs to a draft in one insert. Returns how many were added.
+
+    Raises DraftExpired if the draft is gone, and ValueError, adding nothing, if any ingredient id
+    isn't in the catalog.
+    '''
+    if not owns_draft(user_id, draft_id):
+        raise DraftExpired()
+
+    rows = [{'draft_id': draft_id, 'ingredient_id': int(ingredient_id), 'quantity': int(quantity)} for (ingredient_id, quantity) in items]
+    check_ingredient_ids(row['ingredient_id'] for row in rows)
+    if rows:
+        db.session.execute(insert(RecipeDraftIngredient), rows)
+    db.session.commit()
+    return len(rows)
+
+def discard(draft_id):
+    '''Delete a draft and its ingredients. Does not commit.'''
+    db.session.execute(delete(RecipeDraftIngredient).where(RecipeDraftIngredient.draft_id == draft_id))
+    db.session.execute(delete(RecipeDraft).where(RecipeDraft.id == draft_id))
+
+def commit_draft(user_id, draft_id, instructions):
+    '''Turn a draft into a recipe and return the recipe id.
+
+    Every ingredient id in the draft is checked in a single IN query, and the recipe ingredients are
+    copied across with one INSERT ... SELECT.
+    '''
+    name = db.session.execute(select(RecipeDraft.name).filter_by(id=draft_id, user_id=user_id)).scalar()
+    if name is None:
+        raise DraftExpired()
+
+    draft_ingredients = select(RecipeDraftIngredient.ingredient_id).filter_by(draft_id=draft_id)
+    check_ingredient_ids(db.session.execute(draft_ingredients).scalars())
+
+    recipe_id = db.session.execute(insert(Recipe)
+                                   .values(name=name, instructions=instructions, user_id=user_id)
+                                   .returning(Recipe.id)).scalar_one()
+    db.session.execute(insert(RecipeIngredient).from_select(
+        ['recipe_id', 'ingredient_id', 'quantity'],
+        select(literal(recipe_id), RecipeDraftIngredient.ingredient_id, RecipeDraftIngredient.quantity)
+        .filter_by(draft_id=draft_id)
+        .order_by(RecipeDraftIngredient.id)))
+
+    discard(draft_id)
+    db.session.commit()
+    return recipe_id
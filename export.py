@@ -0,0 +1,171 @@
+'''Streaming export of everything a user has: recipes, menus, pantry and grocery list history.
+
+Each section is read with one ordered query run with yield_per, which on PostgreSQL uses a
+server-side cursor, so rows arrive in fixed-size batches and memory stays flat however big the
+account is. Rows are grouped back into one record per recipe, menu or list as they stream past.
+
+The NDJSON output is one record per line, each with a "type". Recipe lines are in the
+data/recipes.json format and pantry lines in the data/on_hand.json format, so an export can be
+fed straight back to importer.py and the pantry import, which skip lines of other types.
+Archived grocery lists are included after the recent ones.
+
+Usage: python export.py --user test [--sections recipes,pantry] [--output export.jsonl]
+       python export.py --user test --format parquet --output export/   (needs pyarrow)
+'''
+
+import argparse
+import json
+import os
+import sys
+from itertools import groupby
+from sqlalchemy import select
+from model import db, User, Ingredient, Recipe, RecipeIngredient, Menu, Day, DaysRecipe, OnHand, GroceryList, GroceryIngredient
+import archive
+
+SECTIONS = ('recipes', 'menus', 'pantry', 'grocery_lists')
+YIELD_PER = 1000
+
+
+def stream(query):
+    '''Rows of query, fetched YIELD_PER at a time.'''
+    return db.session.execute(query.execution_options(yield_per=YIELD_PER))
+
+def recipe_rows(user_id):
+    '''(recipe id, name, instructions, ingredient, qty) rows, one per recipe ingredient.'''
+    return stream(select(Recipe.id, Recipe.name, Recipe.instructions, Ingredient.name.label('ingredient'), RecipeIngredient.quantity.label('qty'))
+                  .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+                  .outerjoin(Ingredient, Ingredient.id == RecipeIngredient.ingredient_id)
+                  .where(Recipe.user_id == user_id)
+                  .order_by(Recipe.id, RecipeIngredient.id))
+
+def menu_rows(user_id):
+    '''(menu id, name, active, day_of_week, recipe) rows, one per recipe on a day.'''
+    return stream(select(Menu.id, Menu.name, Menu.active, Day.day_of_week, Recipe.name.label('recipe'))
+                  .outerjoin(Day, Day.menu_id == Menu.id)
+                  .outerjoin(DaysRecipe, DaysRecipe.day_id == Day.id)
+                  .outerjoin(Recipe, Recipe.id == DaysRecipe.recipe_id)
+                  .where(Menu.user_id == user_id)
+                  .order_by(Menu.id, Day.day_of_week, DaysRecipe.id))
+
+def pantry_rows(user_id):
+    '''(name, qty) rows for the user's pantry.'''
+    return stream(select(Ingredient.name, OnHand.quantity.label('qty'))
+                  .join(Ingredient, Ingredient.id == OnHand.ingredient_id)
+                  .where(OnHand.user_id == user_id)
+                  .order_by(Ingredient.name))
+
+def grocery_list_rows(user_id):
+    '''(list id, name, created_on, active, ingredient, qty) rows, one per item, recent lists then archived ones.'''
+    yield from stream(select(GroceryList.id, GroceryList.name, GroceryList.created_on, GroceryList.active,
+                             Ingredient.name.label('ingredient'), GroceryIngredient.quantity.label('qty'))
+                      .outerjoin(GroceryIngredient, GroceryIngredient.grocery_list_id == GroceryList.id)
+                      .outerjoin(Ingredient, Ingredient.id == GroceryIngredient.ingredient_id)
+                      .where(GroceryList.user_id == user_id)
+                      .order_by(GroceryList.id.desc(), GroceryIngredient.id))
+    for grocery_list in archive.iter_archived_lists(user_id):
+        if not grocery_list.grocery_ingredients:
+            yield (grocery_list.id, grocery_list.name, grocery_list.created_on, False, None, None)
+        for item in grocery_list.grocery_ingredients:
+            yield (grocery_list.id, grocery_list.name, grocery_list.created_on, False, item.ingredient.name, item.quantity)
+
+SECTION_ROWS = {'recipes': recipe_rows, 'menus': menu_rows, 'pantry': pantry_rows, 'grocery_lists': grocery_list_rows}
+
+
+def iter_export(user_id, sections=SECTIONS):
+    '''Yield the user's export records, section by section.'''
+    if 'recipes' in sections:
+        for ((_, name, instructions), rows) in groupby(recipe_rows(user_id), key=lambda row: tuple(row[:3])):
+            yield {'type': 'recipe', 'name': name, 'instructions': instructions,
+                   'ingredients': [{'name': row[3], 'qty': row[4]} for row in rows if row[3] is not None]}
+
+    if 'menus' in sections:
+        for ((_, name, active), rows) in groupby(menu_rows(user_id), key=lambda row: tuple(row[:3])):
+            days = {}
+            for row in rows:
+                if row[3] is not None:
+                    days.setdefault(str(row[3]), [])
+                    if row[4] is not None:
+                        days[str(row[3])].append(row[4])
+            yield {'type': 'menu', 'name': name, 'active': active, 'days': days}
+
+    if 'pantry' in sections:
+        for row in pantry_rows(user_id):
+            yield {'type': 'pantry', 'name': row[0], 'qty': row[1]}
+
+    if 'grocery_lists' in sections:
+        for ((_, name, created_on, active), rows) in groupby(grocery_list_rows(user_id), key=lambda row: tuple(row[:4])):
+            yield {'type': 'grocery_list', 'name': name, 'created_on': created_on.isoformat(), 'active': active,
+                   'items': [{'name': row[4], 'qty': row[5]} for row in rows if row[4] is not None]}
+
+def iter_ndjson(user_id, sections=SECTIONS):
+    '''The user's export as lines of JSON.'''
+    for record in iter_export(user_id, sections):
+        yield json.dumps(record) + '\n'
+
+
+def write_parquet(user_id, directory, sections=SECTIONS):
+    '''Write each section's flat rows to <directory>/<section>.parquet, YIELD_PER rows at a time.'''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schemas = {
+        'recipes': pa.schema([('recipe_id', pa.int64()), ('name', pa.string()), ('instructions', pa.string()), ('ingredient', pa.string()), ('qty', pa.int64())]),
+        'menus': pa.schema([('menu_id', pa.int64()), ('name', pa.string()), ('active', pa.bool_()), ('day_of_week', pa.int64()), ('recipe', pa.string())]),
+        'pantry': pa.schema([('name', pa.string()), ('qty', pa.int64())]),
+        'grocery_lists': pa.schema([('list_id', pa.int64()), ('name', pa.string()), ('created_on', pa.date32()), ('active', pa.bool_()),
+                                    ('ingredient', pa.string()), ('qty', pa.int64())]),
+    }
+    os.makedirs(directory, exist_ok=True)
+    for section in sections:
+        schema = schemas[section]
+        with pq.ParquetWriter(os.path.join(directory, f'{section}.parquet'), schema) as writer:
+            batch = []
+            for row in SECTION_ROWS[section](user_id):
+                batch.append(tuple(row))
+                if len(batch) == YIELD_PER:
+                    writer.write_batch(pa.RecordBatch.from_pylist([dict(zip(schema.names, row)) for row in batch], schema=schema))
+                    batch = []
+            if batch:
+                writer.write_batch(pa.RecordBatch.from_pylist([dict(zip(schema.names, row)) for row in batch], schema=schema))
+
+
+def parse_sections(value):
+    '''A tuple of section names from a comma separated string. Raises ValueError for unknown ones.'''
+    sections = tuple(section.strip() for section in value.split(',') if section.strip()) if value else SECTIONS
+    unknown = [section for section in sections if section not in SECTIONS]
+    if unknown:
+        raise ValueError(f'Unknown sections: {", ".join(unknown)}. Choose from {", ".join(SECTIONS)}.')
+    return sections
+
+
+if __name__ == '__main__':
+    import server
+
+    parser = argparse.ArgumentParser(description="Export a user's recipes, menus, pantry and grocery lists.")
+    parser.add_argument('--user', default='test', help='username to export')
+    parser.add_argument('--sections', help=f'comma separated, from {", ".join(SECTIONS)} (default all)')
+    parser.add_argument('--format', choices=['ndjson', 'parquet'], default='ndjson')
+    parser.add_argument('--output', help='file for ndjson (default stdout), directory for parquet')
+    args = parser.parse_args()
+
+    try:
+        sections = parse_sections(args.sections)
+    except ValueError as error:
+        parser.error(str(error))
+
+    server.create_app(push_context=True)
+    user = User.query.filter_by(username=args.user).first()
+    if not user:
+        parser.error(f'no user named {args.user}')
+
+    if args.format == 'parquet':
+        if not args.output:
+            parser.error('--output is required for parquet')
+        write_parquet(user.id, args.output, sections)
+    else:
+        out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            out.writelines(iter_ndjson(user.id, sections))
+        finally:
+            if out is not sys.stdout:
+                out.close()
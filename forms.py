@@ -1,6 +1,10 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, IntegerField, TextAreaField, SelectField, SubmitField, EmailField, Form, FormField, FieldList
-from wtforms.validators import DataRequired
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, IntegerField, TextAreaField, SelectField, SubmitField, EmailField, BooleanField, Form, FormField, FieldList
+from wtforms.validators import DataRequired, NumberRange, ValidationError
+from wtforms.widgets import HiddenInput
+from catalog import ingredient_catalog
+from planner import MAX_RECIPES_PER_DAY
 import model
 
 
@@ -16,14 +20,24 @@ class CreateUserForm(FlaskForm):
     confirm_password = PasswordField("Confirm Password", validators=[DataRequired()])
     submit = SubmitField("Submit")
     
+class IngredientField(IntegerField):
+    '''The id of an ingredient picked with the typeahead search box. Checked against the ingredient catalog.'''
+    widget = HiddenInput()
+    
+    def pre_validate(self, form):
+        if self.data is not None and ingredient_catalog.name(self.data) is None:
+            raise ValidationError('Please pick an ingredient from the list.')
+
 class AddIngredientForm(FlaskForm):
-    ingredient = SelectField("Ingredient", validators=[DataRequired()])
+    ingredient = IngredientField("Ingredient", validators=[DataRequired(message='Please pick an ingredient from the list.')])
     quantity = IntegerField("Quantity", validators=[DataRequired()])
     submit = SubmitField("Submit")
-    
-    def update_ingredients(self, ingredients):
-        self.ingredient.choices = [(item.id, item.name) for item in ingredients]
         
+class PantryImportForm(FlaskForm):
+    inventory = FileField("Inventory File", validators=[FileRequired(), FileAllowed(['json', 'jsonl', 'csv'], 'Upload a JSON, JSON Lines or CSV file.')])
+    mode = SelectField("Quantities", choices=[('add', 'Add to what I have'), ('set', 'Replace what I have')])
+    submit = SubmitField("Import")
+
 class CreateMenuForm(FlaskForm):
     name = StringField("Menu Name", validators=[DataRequired()])
     sunday_recipe = SelectField("Sunday Recipe")
@@ -35,25 +49,40 @@ class CreateMenuForm(FlaskForm):
     saturday_recipe = SelectField("Saturday Recipe")
     submit = SubmitField("Submit")
     
+    def day_fields(self):
+        '''The recipe fields in day of week order, Sunday first.'''
+        return [self.sunday_recipe, self.monday_recipe, self.tuesday_recipe, self.wednesday_recipe,
+                self.thursday_recipe, self.friday_recipe, self.saturday_recipe]
+    
     def update_recipe_choices(self, recipes):
         recipe_choices = [(recipe.id, recipe.name) for recipe in recipes]
-        self.sunday_recipe.choices = recipe_choices
-        self.monday_recipe.choices = recipe_choices
-        self.tuesday_recipe.choices = recipe_choices
-        self.wednesday_recipe.choices = recipe_choices
-        self.thursday_recipe.choices = recipe_choices
-        self.friday_recipe.choices = recipe_choices
-        self.saturday_recipe.choices = recipe_choices
+        for field in self.day_fields():
+            field.choices = recipe_choices
         
+class PlanMenuForm(FlaskForm):
+    name = StringField("Menu Name", validators=[DataRequired()])
+    recipes_per_day = IntegerField("Recipes Per Day", default=1, validators=[DataRequired(), NumberRange(min=1, max=MAX_RECIPES_PER_DAY)])
+    objective = SelectField("Plan For", choices=[('shortfall', 'Shortest grocery list'), ('pantry', 'Using up the pantry')])
+    allow_repeats = BooleanField("Allow a recipe more than once")
+    submit = SubmitField("Plan My Week")
+
+class MenuWeeksForm(Form):
+    menu_id = IntegerField(widget=HiddenInput())
+    weeks = IntegerField("Weeks", default=0, validators=[NumberRange(min=0, max=12)])
+
+class ConsolidateListForm(FlaskForm):
+    name = StringField("List Name")
+    menus = FieldList(FormField(MenuWeeksForm))
+    submit = SubmitField("Create Combined List")
+
+class ClearHistoryForm(FlaskForm):
+    submit = SubmitField("Delete Past Lists")
 
 class RecipeIngredientForm(FlaskForm):
-    ingredient = SelectField("Ingredient", validators=[DataRequired()])
+    ingredient = IngredientField("Ingredient", validators=[DataRequired(message='Please pick an ingredient from the list.')])
     quantity = IntegerField("Quantity", validators=[DataRequired()])
     add_another = SelectField("Add Another Ingredient?", choices=["Yes", "No"], validators=[DataRequired()])
     submit = SubmitField("Submit")
-    
-    def update_recipe_ingredients(self, ingredients):
-        self.ingredient.choices = [(item.id, item.name) for item in ingredients]
         
 class RecipeNameForm(FlaskForm):
     name = StringField("Recipe Name", validators=[DataRequired()])
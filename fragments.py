@@ -0,0 +1,157 @@
+'''Cache of rendered template fragments, keyed by the revision of the rows they show.
+
+A fragment is stored under (kind, id, revision, template digest). Any change to a menu or grocery
+list moves its revision (see revisions.py), so the next page render misses and re-renders just
+that block, while every other block is reused as-is. Mapper events also drop a changed or
+deleted row's fragments from the in-process LRU so dead entries don't crowd out live ones.
+
+Fragments live in an in-process LRU. Set MENU_MASTER_FRAGMENT_REDIS (e.g.
+redis://localhost:6379/0) to also share them between workers through Redis or any
+Redis-compatible server; it is only consulted on a local miss, and if it is unreachable the
+cache quietly falls back to rendering.
+'''
+
+import os
+import threading
+from collections import OrderedDict
+from markupsafe import Markup
+from sqlalchemy import event, select
+from model import Menu, Day, DaysRecipe, GroceryList, GroceryIngredient
+from http_cache import TEMPLATE_DIGEST
+
+try:
+    from redis.exceptions import RedisError
+except ImportError:
+    class RedisError(Exception):
+        pass
+
+MAX_FRAGMENTS = 4096
+FRAGMENT_TTL = 7 * 24 * 60 * 60
+
+
+class FragmentCache:
+    '''An LRU of rendered HTML, optionally backed by a Redis-compatible server.'''
+
+    def __init__(self, max_entries=MAX_FRAGMENTS, redis=None, ttl=FRAGMENT_TTL):
+        self.max_entries = max_entries
+        self.redis = redis
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._keys_by_owner = {}
+
+    @staticmethod
+    def key(kind, object_id, revision):
+        return f'fragment:{kind}:{object_id}:{revision}:{TEMPLATE_DIGEST[:16]}'
+
+    def get_many(self, keys):
+        '''{key: html} for every key that is cached locally or in Redis.'''
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.redis is not None:
+            try:
+                remote = dict(zip(missing, self.redis.mget(missing)))
+            except RedisError:
+                remote = {}
+            remote = {key: html.decode() for (key, html) in remote.items() if html is not None}
+            self._store(remote)
+            found.update(remote)
+        return found
+
+    def set_many(self, fragments):
+        '''Cache {key: html} locally and in Redis.'''
+        self._store(fragments)
+        if fragments and self.redis is not None:
+            try:
+                pipeline = self.redis.pipeline(transaction=False)
+                for (key, html) in fragments.items():
+                    pipeline.setex(key, self.ttl, html)
+                pipeline.execute()
+            except RedisError:
+                pass
+
+    def forget(self, kind, object_id):
+        '''Drop every local fragment of one row, whatever its revision.'''
+        with self._lock:
+            for key in self._keys_by_owner.pop((kind, str(object_id)), ()):
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_owner.clear()
+
+    def _store(self, fragments):
+        with self._lock:
+            for (key, html) in fragments.items():
+                self._entries[key] = html
+                self._entries.move_to_end(key)
+                (_, kind, object_id, _, _) = key.split(':')
+                self._keys_by_owner.setdefault((kind, object_id), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                (key, _) = self._entries.popitem(last=False)
+                (_, kind, object_id, _, _) = key.split(':')
+                owner_keys = self._keys_by_owner.get((kind, object_id))
+                if owner_keys is not None:
+                    owner_keys.discard(key)
+                    if not owner_keys:
+                        del self._keys_by_owner[(kind, object_id)]
+
+    def render(self, kind, versions, render_missing):
+        '''Rendered fragments {id: Markup} for versions, a list of (id, revision) pairs.
+
+        Only the ids that miss are passed to render_missing, which must return {id: html} for them.
+        '''
+        keys = {object_id: self.key(kind, object_id, revision) for (object_id, revision) in versions}
+        found = self.get_many(list(keys.values()))
+        missing = [object_id for (object_id, key) in keys.items() if key not in found]
+        if missing:
+            rendered = {keys[object_id]: html for (object_id, html) in render_missing(missing).items()}
+            self.set_many(rendered)
+            found.update(rendered)
+        return {object_id: Markup(found[key]) for (object_id, key) in keys.items() if key in found}
+
+
+def connect_redis(url):
+    import redis
+    return redis.Redis.from_url(url, socket_timeout=0.25)
+
+redis_url = os.environ.get('MENU_MASTER_FRAGMENT_REDIS')
+fragment_cache = FragmentCache(redis=connect_redis(redis_url) if redis_url else None)
+
+
+#Fragment kinds, and the row each one is built from
+MENU_WEEK = 'menu_week'
+ACTIVE_LIST = 'active_list'
+PAST_LIST = 'past_list'
+
+@event.listens_for(Menu, 'after_update')
+@event.listens_for(Menu, 'after_delete')
+def menu_changed(mapper, connection, target):
+    fragment_cache.forget(MENU_WEEK, target.id)
+
+@event.listens_for(DaysRecipe, 'after_insert')
+@event.listens_for(DaysRecipe, 'after_update')
+@event.listens_for(DaysRecipe, 'after_delete')
+def days_recipe_changed(mapper, connection, target):
+    menu_id = connection.execute(select(Day.menu_id).where(Day.id == target.day_id)).scalar()
+    fragment_cache.forget(MENU_WEEK, menu_id)
+
+@event.listens_for(GroceryList, 'after_update')
+@event.listens_for(GroceryList, 'after_delete')
+def grocery_list_changed(mapper, connection, target):
+    for kind in (ACTIVE_LIST, PAST_LIST):
+        fragment_cache.forget(kind, target.id)
+
+@event.listens_for(GroceryIngredient, 'after_insert')
+@event.listens_for(GroceryIngredient, 'after_update')
+@event.listens_for(GroceryIngredient, 'after_delete')
+def grocery_ingredient_changed(mapper, connection, target):
+    for kind in (ACTIVE_LIST, PAST_LIST):
+        fragment_cache.forget(kind, target.grocery_list_id)
@@ -0,0 +1,54 @@
+'''Grocery list engine. Reads the active menu's shortfall against the pantry in SQL and writes the list in bulk.'''
+
+from datetime import date
+from sqlalchemy import select, insert, update, func, literal
+from model import db, upsert, Menu, OnHand, GroceryList, GroceryIngredient
+from shortfall import shortfall_query
+from revisions import bump
+
+
+def active_menu_id(user_id):
+    '''Return the id of the user's active menu, or None.'''
+    return db.session.execute(select(Menu.id).filter_by(user_id=user_id, active=True).limit(1)).scalar()
+
+def write_list(user_id, rows, name=None):
+    '''Add an active grocery list holding rows of (ingredient_id, quantity) and return it. Does not commit.'''
+    grocery_list = GroceryList(name=name or str(date.today()), user_id=user_id, active=True)
+    db.session.add(grocery_list)
+    db.session.flush()
+
+    db.session.execute(insert(GroceryIngredient), [
+        {'grocery_list_id': grocery_list.id, 'ingredient_id': ingredient_id, 'quantity': quantity}
+        for (ingredient_id, quantity) in rows
+    ])
+    return grocery_list
+
+def generate_list(user_id):
+    '''Create a grocery list for everything the active menu is short on. Returns None if the pantry covers the menu.'''
+    rows = db.session.execute(shortfall_query(user_id)).all()
+
+    if not rows:
+        return None
+    grocery_list = write_list(user_id, rows)
+    db.session.commit()
+    return grocery_list
+
+def active_list_id(user_id):
+    '''Return the id of the user's active grocery list, or None.'''
+    return db.session.execute(select(GroceryList.id).filter_by(user_id=user_id, active=True).limit(1)).scalar()
+
+def purchase_list(user_id, grocery_list_id):
+    '''Merge every item on the list into the user's pantry and deactivate the list, in one transaction.'''
+    items = (select(literal(user_id), GroceryIngredient.ingredient_id, func.sum(GroceryIngredient.quantity))
+             .where(GroceryIngredient.grocery_list_id == grocery_list_id)
+             .group_by(GroceryIngredient.ingredient_id))
+
+    merge = upsert(OnHand).from_select(['user_id', 'ingredient_id', 'quantity'], items)
+    merge = merge.on_conflict_do_update(index_elements=['user_id', 'ingredient_id'],
+                                        set_={'quantity': OnHand.quantity + merge.excluded.quantity})
+    db.session.execute(merge)
+
+    db.session.execute(update(GroceryList)
+                       .where(GroceryList.id == grocery_list_id, GroceryList.user_id == user_id)
+                       .values({GroceryList.active: False, **bump(GroceryList)}))
+    db.session.commit()
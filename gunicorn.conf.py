@@ -0,0 +1,31 @@
+'''Gunicorn settings for running the Flask app on every core: `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+The app is imported and warmed once in the master, then forked, so workers start with the catalog
+and compiled templates already in memory. Each worker drops the connections it inherited and
+opens its own pool, since a socket shared between processes corrupts both ends.
+'''
+
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+
+
+def when_ready(server):
+    #Keep the preloaded objects out of the collector so forking doesn't copy their pages
+    gc.freeze()
+
+def post_fork(server, worker):
+    from wsgi import app
+    from model import db
+    with app.app_context():
+        db.engine.dispose(close=False)
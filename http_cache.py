@@ -0,0 +1,87 @@
+'''Conditional GETs for pages built from versioned rows.
+
+Each cacheable page has a signature function that reads only the ids and revision counters the
+page is built from, and turns them into a strong ETag. When the browser already holds that
+ETag the view answers 304 without loading the ORM graph or rendering anything.
+'''
+
+import hashlib
+import os
+from flask import request, session, make_response
+from sqlalchemy import select
+from model import db, Recipe, GroceryList, GroceryArchive
+
+#Revalidate on every use. A 304 costs one or two narrow queries.
+REVALIDATE = 'private, no-cache'
+#Purchased grocery lists never change again
+IMMUTABLE = 'private, max-age=31536000, immutable'
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def template_digest(template_dir=TEMPLATE_DIR):
+    '''A hash of every template, so a deploy that changes how pages look also changes their ETags.'''
+    digest = hashlib.sha1()
+    for (root, dirs, files) in os.walk(template_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                digest.update(os.path.relpath(path, template_dir).encode())
+                digest.update(f.read())
+    return digest.hexdigest()
+
+TEMPLATE_DIGEST = template_digest()
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr((TEMPLATE_DIGEST,) + parts).encode()).hexdigest()
+
+def conditional(etag, render, cache_control=REVALIDATE):
+    '''A 304 if the request already has etag, otherwise the page from render() tagged with it.
+
+    Pass etag=None to skip caching. Pages with flashed messages waiting are rendered untagged so
+    the message is shown once and never replayed from the browser cache.
+    '''
+    if etag is None or '_flashes' in session:
+        response = make_response(render())
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def recipe_etag(recipe_id):
+    '''ETag for a recipe page, or None if there is no such recipe.'''
+    revision = db.session.execute(select(Recipe.revision).filter_by(id=recipe_id)).scalar()
+    return make_etag('recipe', recipe_id, revision) if revision is not None else None
+
+def menus_etag(user_id, menus, shortfalls):
+    '''ETag for the menus page from its menu summary rows and the active menu's shortfalls.'''
+    return make_etag('menus', user_id, [(menu.id, menu.revision, menu.active) for menu in menus], sorted(shortfalls.items()))
+
+def lists_etag(user_id, before, active_list, history, archived=()):
+    '''ETag for one page of the grocery lists page from its summary rows and archived month rows.'''
+    active = (active_list.id, active_list.revision) if active_list else None
+    return make_etag('lists', user_id, before, active, [(row.id, row.revision) for row in history], [tuple(row) for row in archived])
+
+def archive_etag(user_id, month):
+    '''ETag for a month of archived grocery lists, or None if the user has no archive for it.'''
+    list_count = db.session.execute(select(GroceryArchive.list_count).filter_by(user_id=user_id, month=month)).scalar()
+    return make_etag('archive', user_id, month, list_count) if list_count is not None else None
+
+def grocery_list_cache(user_id, grocery_list_id):
+    '''(ETag, Cache-Control) for a single grocery list page, or (None, None) if the user has no such list.
+
+    The active list can still change, so it is revalidated. Purchased lists are immutable.
+    '''
+    row = db.session.execute(select(GroceryList.revision, GroceryList.active).filter_by(id=grocery_list_id, user_id=user_id)).first()
+    if row is None:
+        return (None, None)
+    return (make_etag('grocery_list', grocery_list_id, row.revision), REVALIDATE if row.active else IMMUTABLE)
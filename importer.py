@@ -0,0 +1,159 @@
+'''Bulk, idempotent import of recipes in the data/recipes.json format.
+
+Accepts a JSON array or JSON Lines (one recipe per line) and streams it, so large files are never
+held in memory. Ingredient names are resolved against an in-memory name -> id map, new ingredients
+are upserted with INSERT ... ON CONFLICT on Ingredient.name, and recipes the user already has
+(matched by name) are skipped. Running the same file twice is therefore a cheap no-op.
+
+Usage: python importer.py data/recipes.json [--user test] [--batch-size 500]
+'''
+
+import argparse
+import json
+import time
+from itertools import islice
+from sqlalchemy import select, insert
+from model import db, upsert, User, Ingredient, Recipe, RecipeIngredient
+from catalog import bump_version
+import ranking
+
+BATCH_SIZE = 500
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_records(path):
+    '''Yield each record of a JSON array or JSON Lines file.'''
+    with open(path) as f:
+        yield from iter_file_records(f)
+
+def iter_file_records(f):
+    '''Yield each record of an open, seekable JSON array or JSON Lines text file.'''
+    start = f.read(1)
+    while start.isspace():
+        start = f.read(1)
+
+    if start == '[':
+        yield from _iter_json_array(f)
+    else:
+        f.seek(0)
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def _iter_json_array(f):
+    '''Decode the items of a JSON array one at a time. The opening bracket has already been read.'''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+
+        yield record
+        buffer = buffer[end:]
+
+def batched(iterable, size):
+    '''Yield lists of up to size items from iterable.'''
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+def load_ingredient_ids():
+    '''Map every ingredient name to its id.'''
+    return dict(db.session.execute(select(Ingredient.name, Ingredient.id)).all())
+
+def resolve_ingredients(names, ingredient_ids):
+    '''Make sure every name is in the ingredients table and in ingredient_ids. Returns how many ingredients were created.'''
+    missing = sorted({name for name in names if name not in ingredient_ids})
+    if not missing:
+        return 0
+
+    result = db.session.execute(upsert(Ingredient)
+                                .values([{'name': name} for name in missing])
+                                .on_conflict_do_nothing(index_elements=['name']))
+    rows = db.session.execute(select(Ingredient.name, Ingredient.id).where(Ingredient.name.in_(missing))).all()
+    ingredient_ids.update(rows)
+
+    if result.rowcount:
+        bump_version(db.session.connection())
+    return max(result.rowcount, 0)
+
+def import_recipes(records, user_id, batch_size=BATCH_SIZE):
+    '''Import recipe records for a user in batched transactions. Returns counts of the rows created.
+
+    Records with a "type" other than "recipe", such as the other sections of an export.py file, are skipped.
+    '''
+    counts = {'ingredients': 0, 'recipes': 0, 'recipe_ingredients': 0}
+    records = (record for record in records if record.get('type', 'recipe') == 'recipe')
+    ingredient_ids = load_ingredient_ids()
+    known_recipes = set(db.session.execute(select(Recipe.name).filter_by(user_id=user_id)).scalars())
+
+    for batch in batched(records, batch_size):
+        new_recipes = {}
+        for record in batch:
+            if record['name'] not in known_recipes and record['name'] not in new_recipes:
+                new_recipes[record['name']] = record
+        if not new_recipes:
+            continue
+
+        counts['ingredients'] += resolve_ingredients(
+            (ingredient['name'] for record in new_recipes.values() for ingredient in record['ingredients']),
+            ingredient_ids)
+
+        recipe_rows = db.session.execute(insert(Recipe)
+                                         .values([{'name': record['name'], 'instructions': record.get('instructions'), 'user_id': user_id}
+                                                  for record in new_recipes.values()])
+                                         .returning(Recipe.name, Recipe.id)).all()
+        recipe_ids = dict(recipe_rows)
+
+        recipe_ingredient_rows = [
+            {'recipe_id': recipe_ids[name], 'ingredient_id': ingredient_ids[ingredient['name']], 'quantity': ingredient['qty']}
+            for (name, record) in new_recipes.items()
+            for ingredient in record['ingredients']
+        ]
+        if recipe_ingredient_rows:
+            db.session.execute(insert(RecipeIngredient), recipe_ingredient_rows)
+        ranking.bump_version(user_id)
+        db.session.commit()
+
+        known_recipes.update(new_recipes)
+        counts['recipes'] += len(recipe_ids)
+        counts['recipe_ingredients'] += len(recipe_ingredient_rows)
+
+    return counts
+
+
+if __name__ == '__main__':
+    import server
+    from model import connect_to_db
+
+    parser = argparse.ArgumentParser(description='Bulk import recipes from a JSON or JSON Lines file.')
+    parser.add_argument('path')
+    parser.add_argument('--user', default='test', help='username that will own the recipes')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    connect_to_db(server.app)
+    user = User.query.filter_by(username=args.user).first()
+    if not user:
+        parser.error(f'no user named {args.user}')
+
+    started = time.perf_counter()
+    counts = import_recipes(iter_records(args.path), user.id, args.batch_size)
+    elapsed = time.perf_counter() - started
+
+    rows = sum(counts.values())
+    print(', '.join(f'{count} {table}' for (table, count) in counts.items()))
+    print(f'{rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/sec)')
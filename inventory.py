@@ -0,0 +1,157 @@
+'''Bulk pantry operations: inventory import, batch edits and using up ingredients when a day is cooked.
+
+Inventories are in the data/on_hand.json format ({"name": ..., "qty": ...} records) as a JSON
+array, JSON Lines or a CSV file with name and qty columns. They are parsed as a stream and
+merged into on_hand with one upsert per batch, all in a single transaction, so a bad record
+part way through leaves the pantry untouched.
+
+Every path here treats a quantity of 0 the same way: an item that ends up with none on hand is
+removed from the pantry, and only items the operation touched are looked at.
+'''
+
+import csv
+import io
+from sqlalchemy import select, delete, update, func, case
+from model import db, upsert, OnHand, Ingredient, Menu, Day, DaysRecipe, RecipeIngredient
+from importer import iter_file_records, batched, load_ingredient_ids, resolve_ingredients
+
+BATCH_SIZE = 500
+MODES = ('add', 'set')
+
+
+def iter_csv_records(f):
+    '''Yield {"name": ..., "qty": ...} records from a CSV file with a header row.'''
+    for record in csv.DictReader(f):
+        yield {'name': (record.get('name') or '').strip(), 'qty': record.get('qty')}
+
+def iter_upload(stream, filename):
+    '''Records from an uploaded inventory file, read as a stream. CSV is picked by the .csv extension.'''
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if filename.lower().endswith('.csv'):
+        return iter_csv_records(text)
+    return iter_file_records(text)
+
+def parse_quantity(value, position):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        quantity = -1
+    if quantity < 0:
+        raise ValueError(f'Item {position} needs a whole number quantity of 0 or more.')
+    return quantity
+
+def remove_empty(user_id, ingredient_ids):
+    '''Remove the given pantry items if none of them is left. ingredient_ids can be a list or a select. Does not commit.'''
+    db.session.execute(delete(OnHand).where(OnHand.user_id == user_id, OnHand.ingredient_id.in_(ingredient_ids), OnHand.quantity <= 0))
+
+def merge_into_pantry(user_id, quantities, mode='add'):
+    '''Upsert {ingredient id: quantity} into the user's pantry in one statement. Does not commit.
+
+    mode "add" adds to what is already on hand, "set" replaces it. Items left with 0 are removed.
+    '''
+    if not quantities:
+        return
+    merge = upsert(OnHand).values([{'user_id': user_id, 'ingredient_id': ingredient_id, 'quantity': quantity}
+                                   for (ingredient_id, quantity) in quantities.items()])
+    new_quantity = merge.excluded.quantity if mode == 'set' else OnHand.quantity + merge.excluded.quantity
+    db.session.execute(merge.on_conflict_do_update(index_elements=['user_id', 'ingredient_id'], set_={'quantity': new_quantity}))
+    remove_empty(user_id, list(quantities))
+
+def import_inventory(user_id, records, mode='add', batch_size=BATCH_SIZE):
+    '''Merge inventory records into the user's pantry and commit. Returns counts of items and new ingredients.
+
+    When a name appears more than once, "add" adds every quantity and "set" keeps the last one.
+    Unknown ingredient names are added to the catalog. Records with a "type" other than "pantry",
+    such as the other sections of an export.py file, are skipped. Raises ValueError, with nothing
+    saved, if any record is malformed.
+    '''
+    if mode not in MODES:
+        raise ValueError(f'Mode must be one of: {", ".join(MODES)}.')
+    records = (record for record in records if not isinstance(record, dict) or record.get('type', 'pantry') == 'pantry')
+
+    counts = {'items': 0, 'ingredients': 0}
+    ingredient_ids = load_ingredient_ids()
+    try:
+        for batch in batched(enumerate(records, start=1), batch_size):
+            quantities = {}
+            for (position, record) in batch:
+                name = record.get('name') if isinstance(record, dict) else None
+                if not name:
+                    raise ValueError(f'Item {position} needs a name.')
+                quantities[name] = parse_quantity(record.get('qty'), position) + (quantities.get(name, 0) if mode == 'add' else 0)
+
+            counts['ingredients'] += resolve_ingredients(quantities, ingredient_ids)
+            merge_into_pantry(user_id, {ingredient_ids[name]: quantity for (name, quantity) in quantities.items()}, mode)
+            counts['items'] += len(batch)
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.commit()
+    return counts
+
+def batch_edit(user_id, items, mode='set', remove=()):
+    '''Apply [(ingredient id, quantity)] edits and remove the ingredient ids in remove from the user's pantry, in one transaction, and commit.
+
+    An item left with 0, e.g. set to 0, is removed. Everything is checked before anything is
+    written, so a ValueError leaves the pantry untouched. Returns how many items were changed and
+    how many were removed.
+    '''
+    if mode not in MODES:
+        raise ValueError(f'Mode must be one of: {", ".join(MODES)}.')
+
+    removals = set()
+    for (position, ingredient_id) in enumerate(remove, start=1):
+        try:
+            removals.add(int(ingredient_id))
+        except (TypeError, ValueError):
+            raise ValueError(f'Removal {position} needs an ingredient id.')
+
+    quantities = {}
+    for (position, (ingredient_id, quantity)) in enumerate(items, start=1):
+        try:
+            ingredient_id = int(ingredient_id)
+        except (TypeError, ValueError):
+            raise ValueError(f'Item {position} needs an ingredient id.')
+        quantity = parse_quantity(quantity, position)
+        quantities[ingredient_id] = quantity + (quantities.get(ingredient_id, 0) if mode == 'add' else 0)
+
+    known = set(db.session.execute(select(Ingredient.id).where(Ingredient.id.in_(quantities))).scalars())
+    if set(quantities) - known:
+        raise ValueError(f'Unknown ingredient ids: {", ".join(str(ingredient_id) for ingredient_id in sorted(set(quantities) - known))}')
+
+    try:
+        merge_into_pantry(user_id, quantities, mode)
+        removed = 0
+        if removals:
+            removed = db.session.execute(delete(OnHand).where(OnHand.user_id == user_id, OnHand.ingredient_id.in_(removals))).rowcount
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.commit()
+    return (len(quantities), removed)
+
+def cook_day(user_id, menu_id, day_of_week):
+    '''Use up the ingredients for every recipe on one day of a menu and commit. Returns how many pantry items changed.
+
+    The day's needs are summed per ingredient and taken off on_hand in a single UPDATE ... FROM,
+    never going below zero. Items the day used up are removed from the pantry.
+    '''
+    day_id = db.session.execute(select(Day.id)
+                                .join(Menu, Menu.id == Day.menu_id)
+                                .where(Menu.id == menu_id, Menu.user_id == user_id, Day.day_of_week == day_of_week)).scalar()
+    if day_id is None:
+        raise ValueError("That day isn't on one of your menus.")
+
+    used = (select(RecipeIngredient.ingredient_id, func.sum(RecipeIngredient.quantity).label('quantity'))
+            .join(DaysRecipe, DaysRecipe.recipe_id == RecipeIngredient.recipe_id)
+            .where(DaysRecipe.day_id == day_id)
+            .group_by(RecipeIngredient.ingredient_id)
+            .subquery())
+    result = db.session.execute(update(OnHand)
+                                .where(OnHand.user_id == user_id, OnHand.ingredient_id == used.c.ingredient_id)
+                                .values(quantity=case((OnHand.quantity > used.c.quantity, OnHand.quantity - used.c.quantity), else_=0)))
+    remove_empty(user_id, select(used.c.ingredient_id))
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,73 @@
+'''Builds menus from a plan mapping day of week -> recipe ids, using a fixed handful of bulk statements however many menus there are.'''
+
+from sqlalchemy import select, insert
+from model import db, Menu, Day, DaysRecipe, Recipe
+
+DAYS_IN_WEEK = 7
+
+
+def recipe_choices(user_id):
+    '''(id, name) rows for every recipe the user owns, for the menu form.'''
+    return db.session.execute(select(Recipe.id, Recipe.name).filter_by(user_id=user_id).order_by(Recipe.name)).all()
+
+def normalize_plan(plan):
+    '''Turn {day: recipe id or list of ids} into {int day: [int ids]}, raising ValueError for anything malformed.'''
+    normalized = {}
+    for (day, recipe_ids) in plan.items():
+        try:
+            day = int(day)
+            if not isinstance(recipe_ids, (list, tuple)):
+                recipe_ids = [recipe_ids]
+            recipe_ids = [int(recipe_id) for recipe_id in recipe_ids]
+        except (TypeError, ValueError):
+            raise ValueError(f'Day {day} must map to a list of recipe ids.')
+
+        if not 1 <= day <= DAYS_IN_WEEK:
+            raise ValueError(f'Day {day} is not between 1 and {DAYS_IN_WEEK}.')
+        normalized.setdefault(day, []).extend(recipe_ids)
+    return normalized
+
+def insert_menus(connection, user_id, menus):
+    '''Insert menus from a list of (name, plan) pairs through connection, a Session or Connection, and return their ids in order.
+
+    Every recipe id across all the plans is checked against the user's recipes in a single IN query,
+    then the menus, their days and the days' recipes go in with one INSERT each. Raises ValueError
+    for an empty list, a malformed plan or a recipe the user doesn't own. Does not commit.
+    '''
+    menus = [(name, normalize_plan(plan)) for (name, plan) in menus]
+    if not menus:
+        raise ValueError('Send at least one menu.')
+    recipe_ids = {recipe_id for (_, plan) in menus for ids in plan.values() for recipe_id in ids}
+
+    if recipe_ids:
+        owned = set(connection.execute(select(Recipe.id)
+                                       .where(Recipe.user_id == user_id, Recipe.id.in_(recipe_ids))).scalars())
+        missing = recipe_ids - owned
+        if missing:
+            raise ValueError(f'Unknown recipe ids: {", ".join(str(recipe_id) for recipe_id in sorted(missing))}')
+
+    menu_ids = connection.execute(insert(Menu).returning(Menu.id, sort_by_parameter_order=True),
+                                  [{'name': name, 'user_id': user_id, 'active': False} for (name, _) in menus]).scalars().all()
+
+    #Every menu gets a full week of days, whether or not each day has recipes.
+    day_ids = {(menu_id, day): day_id for (menu_id, day, day_id) in connection.execute(
+        insert(Day)
+        .values([{'menu_id': menu_id, 'day_of_week': day} for menu_id in menu_ids for day in range(1, DAYS_IN_WEEK + 1)])
+        .returning(Day.menu_id, Day.day_of_week, Day.id))}
+
+    day_recipe_rows = [{'day_id': day_ids[(menu_id, day)], 'recipe_id': recipe_id}
+                       for (menu_id, (_, plan)) in zip(menu_ids, menus)
+                       for (day, ids) in plan.items() for recipe_id in ids]
+    if day_recipe_rows:
+        connection.execute(insert(DaysRecipe), day_recipe_rows)
+    return menu_ids
+
+def build_menus(user_id, menus):
+    '''Create menus from a list of (name, plan) pairs in one transaction and return their ids.'''
+    menu_ids = insert_menus(db.session, user_id, menus)
+    db.session.commit()
+    return menu_ids
+
+def build_menu(user_id, name, plan):
+    '''Create a single menu from a plan and return its id.'''
+    return build_menus(user_id, [(name, plan)])[0]
@@ -0,0 +1,204 @@
+'''Opt-in request and query profiling. Set MENU_MASTER_METRICS=1 to turn it on.
+
+For each endpoint it records the request count and latency histogram, query count, database time,
+template render time and the slowest statements. Every response gets a Server-Timing header with
+its own numbers. The totals are served from /_metrics in the Prometheus text format, but only
+when MENU_MASTER_METRICS_TOKEN is set, and only to requests that send it as
+"Authorization: Bearer <token>", because they include SQL text. Totals are kept per worker process.
+'''
+
+import heapq
+import hmac
+import os
+import re
+import threading
+import time
+from flask import g, request, has_request_context, abort, Response, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_STATEMENTS = 5
+STATEMENT_LENGTH = 200
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class RequestStats:
+    '''What one request has spent so far.'''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_starts = []
+        self.slowest = []
+
+    def add_query(self, seconds, statement):
+        self.queries += 1
+        self.db_time += seconds
+        keep_slowest(self.slowest, seconds, statement)
+
+class EndpointStats:
+    '''Running totals for every request an endpoint has served.'''
+
+    def __init__(self):
+        self.requests = 0
+        self.duration = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.queries = 0
+        self.max_queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.slowest = []
+
+    def add_request(self, duration, stats):
+        self.requests += 1
+        self.duration += duration
+        for (i, bound) in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.buckets[i] += 1
+        self.queries += stats.queries
+        self.max_queries = max(self.max_queries, stats.queries)
+        self.db_time += stats.db_time
+        self.render_time += stats.render_time
+        for (seconds, statement) in stats.slowest:
+            keep_slowest(self.slowest, seconds, statement)
+
+class Metrics:
+    '''Per-endpoint totals for this worker process.'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, duration, stats):
+        with self._lock:
+            self.endpoints.setdefault(endpoint, EndpointStats()).add_request(duration, stats)
+
+    def render_prometheus(self):
+        '''Format the totals in the Prometheus text exposition format.'''
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            lines = []
+
+            def family(name, kind, help_text, samples):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for (suffix, labels, value) in samples:
+                    label_text = ','.join(f'{key}="{escape_label(str(label))}"' for (key, label) in labels.items())
+                    lines.append(f'{name}{suffix}{{{label_text}}} {value}')
+
+            histogram = []
+            for (endpoint, stats) in endpoints:
+                for (bound, count) in zip(LATENCY_BUCKETS, stats.buckets):
+                    histogram.append(('_bucket', {'endpoint': endpoint, 'le': bound}, count))
+                histogram.append(('_bucket', {'endpoint': endpoint, 'le': '+Inf'}, stats.requests))
+                histogram.append(('_sum', {'endpoint': endpoint}, stats.duration))
+                histogram.append(('_count', {'endpoint': endpoint}, stats.requests))
+            family('menu_master_request_duration_seconds', 'histogram', 'Time spent handling requests.', histogram)
+
+            family('menu_master_db_queries_total', 'counter', 'SQL statements executed while handling requests.',
+                   [('', {'endpoint': endpoint}, stats.queries) for (endpoint, stats) in endpoints])
+            family('menu_master_db_queries_max', 'gauge', 'Most SQL statements executed by a single request.',
+                   [('', {'endpoint': endpoint}, stats.max_queries) for (endpoint, stats) in endpoints])
+            family('menu_master_db_time_seconds_total', 'counter', 'Time spent waiting on SQL statements.',
+                   [('', {'endpoint': endpoint}, stats.db_time) for (endpoint, stats) in endpoints])
+            family('menu_master_render_time_seconds_total', 'counter', 'Time spent rendering templates.',
+                   [('', {'endpoint': endpoint}, stats.render_time) for (endpoint, stats) in endpoints])
+            family('menu_master_slow_query_seconds', 'gauge', 'The slowest SQL statements seen for each endpoint.',
+                   [('', {'endpoint': endpoint, 'rank': rank, 'statement': statement}, seconds)
+                    for (endpoint, stats) in endpoints
+                    for (rank, (seconds, statement)) in enumerate(sorted(stats.slowest, reverse=True), start=1)])
+
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+
+def keep_slowest(heap, seconds, statement):
+    '''Keep the SLOW_STATEMENTS slowest (seconds, statement) pairs in a min-heap.'''
+    if len(heap) < SLOW_STATEMENTS:
+        heapq.heappush(heap, (seconds, statement))
+    elif seconds > heap[0][0]:
+        heapq.heapreplace(heap, (seconds, statement))
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def current_stats():
+    '''The RequestStats for the current request, or None outside a profiled request.'''
+    if has_request_context():
+        return g.get('_request_stats')
+    return None
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_starts', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['query_starts'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.add_query(seconds, re.sub(r'\s+', ' ', statement).strip()[:STATEMENT_LENGTH])
+
+def handle_error(exception_context):
+    #A failed statement never reaches after_cursor_execute, so drop its start time here
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('query_starts'):
+        conn.info['query_starts'].pop()
+
+def start_render(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None:
+        stats.render_starts.append(time.perf_counter())
+
+def finish_render(sender, template, context, **extra):
+    stats = current_stats()
+    if stats is not None and stats.render_starts:
+        seconds = time.perf_counter() - stats.render_starts.pop()
+        #Only count the outermost template so nested renders aren't counted twice
+        if not stats.render_starts:
+            stats.render_time += seconds
+
+def start_request():
+    g._request_stats = RequestStats()
+
+def finish_request(response):
+    stats = g.pop('_request_stats', None)
+    if stats is None:
+        return response
+
+    duration = time.perf_counter() - stats.started
+    metrics.record(request.endpoint or 'unknown', duration, stats)
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+        f'render;dur={stats.render_time * 1000:.1f}',
+        f'total;dur={duration * 1000:.1f}',
+    ])
+    return response
+
+def metrics_view():
+    token = os.environ['MENU_MASTER_METRICS_TOKEN']
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        abort(404)
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+def flag(name):
+    '''True if the environment variable name is set to 1, true, yes or on.'''
+    return os.environ.get(name, '').strip().lower() in TRUE_VALUES
+
+def init_metrics(app):
+    '''Install the profiling hooks on app if MENU_MASTER_METRICS is on, and /_metrics if MENU_MASTER_METRICS_TOKEN is also set.'''
+    if not flag('MENU_MASTER_METRICS'):
+        return False
+
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(Engine, 'handle_error', handle_error)
+    before_render_template.connect(start_render, app)
+    template_rendered.connect(finish_render, app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    if os.environ.get('MENU_MASTER_METRICS_TOKEN'):
+        app.add_url_rule('/_metrics', 'metrics', metrics_view)
+    return True
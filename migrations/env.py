@@ -0,0 +1,39 @@
+'''Alembic environment. Migrates the database named by POSTGRES_URI using the models in model.py.'''
+
+import os
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import engine_from_config, pool
+from model import db
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+config.set_main_option('sqlalchemy.url', os.environ['POSTGRES_URI'])
+target_metadata = db.metadata
+
+
+def run_migrations_offline():
+    '''Emit the migration SQL without connecting to a database.'''
+    context.configure(url=config.get_main_option('sqlalchemy.url'), target_metadata=target_metadata,
+                      literal_binds=True, render_as_batch=True)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    '''Run the migrations against a live connection.'''
+    connectable = engine_from_config(config.get_section(config.config_ini_section), prefix='sqlalchemy.', poolclass=pool.NullPool)
+
+    with connectable.connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
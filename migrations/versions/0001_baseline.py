@@ -0,0 +1,83 @@
+'''Baseline schema, as created by db.create_all() before migrations were introduced.
+
+Databases that were created with seed_database.py before this point should be marked with
+`alembic stamp 0001` and then upgraded.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(), nullable=False, unique=True),
+        sa.Column('email', sa.String(), nullable=False, unique=True),
+        sa.Column('password', sa.String(), nullable=False),
+    )
+    op.create_table('ingredients',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False, unique=True),
+    )
+    op.create_table('recipes',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('instructions', sa.Text()),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+    )
+    op.create_table('recipe_ingredients',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('recipe_id', sa.Integer(), sa.ForeignKey('recipes.id')),
+        sa.Column('ingredient_id', sa.Integer(), sa.ForeignKey('ingredients.id')),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+    )
+    op.create_table('on_hand',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+        sa.Column('ingredient_id', sa.Integer(), sa.ForeignKey('ingredients.id')),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+    )
+    op.create_table('menus',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String()),
+        sa.Column('active', sa.Boolean(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+    )
+    op.create_table('days',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('day_of_week', sa.Integer()),
+        sa.Column('menu_id', sa.Integer(), sa.ForeignKey('menus.id')),
+    )
+    op.create_table('days_recipes',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('day_id', sa.Integer(), sa.ForeignKey('days.id')),
+        sa.Column('recipe_id', sa.Integer(), sa.ForeignKey('recipes.id')),
+    )
+    op.create_table('grocery_list',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String()),
+        sa.Column('active', sa.Boolean(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+    )
+    op.create_table('grocery_ingredients',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('ingredient_id', sa.Integer(), sa.ForeignKey('ingredients.id')),
+        sa.Column('grocery_list_id', sa.Integer(), sa.ForeignKey('grocery_list.id')),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+    )
+
+
+def downgrade():
+    for table in ['grocery_ingredients', 'grocery_list', 'days_recipes', 'days', 'menus',
+                  'on_hand', 'recipe_ingredients', 'recipes', 'ingredients', 'users']:
+        op.drop_table(table)
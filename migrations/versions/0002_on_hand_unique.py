@@ -0,0 +1,36 @@
+'''One pantry row per user and ingredient.
+
+Merges any duplicate on_hand rows into the oldest one before adding the unique constraint that
+purchasing a list upserts against.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        UPDATE on_hand SET quantity = (
+            SELECT sum(duplicate.quantity) FROM on_hand AS duplicate
+            WHERE duplicate.user_id = on_hand.user_id AND duplicate.ingredient_id = on_hand.ingredient_id
+        )
+        WHERE id IN (SELECT min(id) FROM on_hand GROUP BY user_id, ingredient_id HAVING count(*) > 1)
+    ''')
+    op.execute('DELETE FROM on_hand WHERE id NOT IN (SELECT min(id) FROM on_hand GROUP BY user_id, ingredient_id)')
+
+    with op.batch_alter_table('on_hand') as batch_op:
+        batch_op.create_unique_constraint('uq_on_hand_user_id_ingredient_id', ['user_id', 'ingredient_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('on_hand') as batch_op:
+        batch_op.drop_constraint('uq_on_hand_user_id_ingredient_id', type_='unique')
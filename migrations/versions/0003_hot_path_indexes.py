@@ -0,0 +1,50 @@
+'''Indexes for the filters server.py runs on every page, and one active menu and list per user.
+
+If a user has several active menus or lists, every one except the newest is deactivated before the
+partial unique indexes are built.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_recipes_user_id', 'recipes', ['user_id'])
+    op.create_index('ix_recipe_ingredients_recipe_id', 'recipe_ingredients', ['recipe_id'])
+    op.create_index('ix_days_menu_id', 'days', ['menu_id'])
+    op.create_index('ix_days_recipes_day_id', 'days_recipes', ['day_id'])
+    op.create_index('ix_days_recipes_recipe_id', 'days_recipes', ['recipe_id'])
+    op.create_index('ix_menus_user_id_active', 'menus', ['user_id', 'active'])
+    op.create_index('ix_grocery_list_user_id_active_id', 'grocery_list', ['user_id', 'active', 'id'])
+    op.create_index('ix_grocery_ingredients_grocery_list_id_ingredient_id', 'grocery_ingredients', ['grocery_list_id', 'ingredient_id'])
+
+    for table in ['menus', 'grocery_list']:
+        op.execute(f'''
+            UPDATE {table} SET active = false
+            WHERE active AND id NOT IN (SELECT max(id) FROM {table} WHERE active GROUP BY user_id)
+        ''')
+        op.create_index(f'uq_{table}_user_id_active', table, ['user_id'], unique=True,
+                        postgresql_where=sa.text('active'), sqlite_where=sa.text('active'))
+
+
+def downgrade():
+    op.drop_index('uq_grocery_list_user_id_active', 'grocery_list')
+    op.drop_index('uq_menus_user_id_active', 'menus')
+    op.drop_index('ix_grocery_ingredients_grocery_list_id_ingredient_id', 'grocery_ingredients')
+    op.drop_index('ix_grocery_list_user_id_active_id', 'grocery_list')
+    op.drop_index('ix_menus_user_id_active', 'menus')
+    op.drop_index('ix_days_recipes_recipe_id', 'days_recipes')
+    op.drop_index('ix_days_recipes_day_id', 'days_recipes')
+    op.drop_index('ix_days_menu_id', 'days')
+    op.drop_index('ix_recipe_ingredients_recipe_id', 'recipe_ingredients')
+    op.drop_index('ix_recipes_user_id', 'recipes')
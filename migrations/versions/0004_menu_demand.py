@@ -0,0 +1,37 @@
+'''Incrementally maintained demand for each user's active menu.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('menu_demand',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('ingredient_id', sa.Integer(), sa.ForeignKey('ingredients.id'), primary_key=True),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+    )
+    op.execute('''
+        INSERT INTO menu_demand (user_id, ingredient_id, quantity)
+        SELECT menus.user_id, recipe_ingredients.ingredient_id, sum(recipe_ingredients.quantity)
+        FROM menus
+        JOIN days ON days.menu_id = menus.id
+        JOIN days_recipes ON days_recipes.day_id = days.id
+        JOIN recipe_ingredients ON recipe_ingredients.recipe_id = days_recipes.recipe_id
+        WHERE menus.active
+        GROUP BY menus.user_id, recipe_ingredients.ingredient_id
+    ''')
+
+
+def downgrade():
+    op.drop_table('menu_demand')
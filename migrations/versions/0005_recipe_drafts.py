@@ -0,0 +1,38 @@
+'''Server-side drafts for the add-recipe wizard.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('recipe_drafts',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_recipe_drafts_user_id', 'recipe_drafts', ['user_id'])
+    op.create_index('ix_recipe_drafts_created_at', 'recipe_drafts', ['created_at'])
+    op.create_table('recipe_draft_ingredients',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('draft_id', sa.Integer(), sa.ForeignKey('recipe_drafts.id')),
+        sa.Column('ingredient_id', sa.Integer(), sa.ForeignKey('ingredients.id')),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+    )
+    op.create_index('ix_recipe_draft_ingredients_draft_id', 'recipe_draft_ingredients', ['draft_id'])
+
+
+def downgrade():
+    op.drop_table('recipe_draft_ingredients')
+    op.drop_table('recipe_drafts')
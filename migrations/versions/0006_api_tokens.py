@@ -0,0 +1,30 @@
+'''Bearer tokens for the async JSON API.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('api_tokens',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('token_hash', sa.String(), nullable=False, unique=True),
+        sa.Column('name', sa.String()),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_api_tokens_user_id', 'api_tokens', ['user_id'])
+
+
+def downgrade():
+    op.drop_table('api_tokens')
@@ -0,0 +1,28 @@
+'''Revision counters behind the ETags on recipe, menu and grocery list pages.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+TABLES = ('recipes', 'menus', 'grocery_list')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('revision', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    for table in TABLES:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('revision')
@@ -0,0 +1,55 @@
+'''ON DELETE CASCADE from recipes, menus, grocery lists and drafts to their child rows.
+
+Child rows orphaned by earlier deletes, which set their parent id to NULL, are removed first.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+#(table, column, referred table)
+FOREIGN_KEYS = (
+    ('recipe_ingredients', 'recipe_id', 'recipes'),
+    ('days', 'menu_id', 'menus'),
+    ('days_recipes', 'day_id', 'days'),
+    ('days_recipes', 'recipe_id', 'recipes'),
+    ('grocery_ingredients', 'grocery_list_id', 'grocery_list'),
+    ('recipe_draft_ingredients', 'draft_id', 'recipe_drafts'),
+)
+
+#Lets batch mode find SQLite's unnamed foreign keys when it copies a table
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def foreign_key_name(table, column, referred):
+    '''The name the baseline schema's unnamed foreign key has on this database.'''
+    if op.get_bind().dialect.name == 'sqlite':
+        return f'fk_{table}_{column}_{referred}'
+    return f'{table}_{column}_fkey'
+
+def replace_foreign_keys(ondelete):
+    for (table, column, referred) in FOREIGN_KEYS:
+        name = foreign_key_name(table, column, referred)
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    op.execute('DELETE FROM days_recipes WHERE recipe_id IS NULL OR day_id IS NULL '
+               'OR day_id IN (SELECT id FROM days WHERE menu_id IS NULL)')
+    for (table, column, _) in FOREIGN_KEYS:
+        op.execute(f'DELETE FROM {table} WHERE {column} IS NULL')
+    replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    replace_foreign_keys(None)
@@ -0,0 +1,47 @@
+'''A real date on grocery lists, and month archives of old purchased lists.
+
+Existing lists get their date from their name, which has always started with the date the list
+was made; lists with any other name are dated today.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('grocery_list') as batch_op:
+        batch_op.add_column(sa.Column('created_on', sa.Date(), nullable=False, server_default=sa.func.current_date()))
+        batch_op.create_index('ix_grocery_list_created_on', ['created_on'])
+
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute('UPDATE grocery_list SET created_on = date(substr(name, 1, 10)) WHERE date(substr(name, 1, 10)) IS NOT NULL')
+    else:
+        op.execute("UPDATE grocery_list SET created_on = CAST(substr(name, 1, 10) AS date) WHERE name ~ '^[0-9]{4}-[0-9]{2}-[0-9]{2}'")
+
+    op.create_table('grocery_archives',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('list_count', sa.Integer(), nullable=False),
+        sa.Column('first_list_id', sa.Integer(), nullable=False),
+        sa.Column('last_list_id', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.LargeBinary(), nullable=False),
+        sa.UniqueConstraint('user_id', 'month', name='uq_grocery_archives_user_id_month'),
+    )
+
+
+def downgrade():
+    op.drop_table('grocery_archives')
+    with op.batch_alter_table('grocery_list') as batch_op:
+        batch_op.drop_index('ix_grocery_list_created_on')
+        batch_op.drop_column('created_on')
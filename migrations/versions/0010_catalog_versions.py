@@ -0,0 +1,30 @@
+'''Version counters behind the per-worker ingredient catalog and recipe ranking caches.
+
+The table arrived with the cached ingredient catalog but was missing from the migrations, so a
+database stamped at 0001 never got it. Databases that already have it are left alone.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+'''
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('catalog_versions'):
+        op.create_table('catalog_versions',
+            sa.Column('name', sa.String(), primary_key=True),
+            sa.Column('version', sa.Integer(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('catalog_versions')
@@ -1,10 +1,23 @@
 import os
+from datetime import datetime, date, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+#Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.environ.get('MENU_MASTER_PASSWORD_HASH', 'scrypt:32768:8:1')
+
+def utcnow():
+    '''The current UTC time as a naive datetime, which is how DateTime columns store it.'''
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class User(db.Model, UserMixin):
     '''A user with their username, email, and password'''
     __tablename__ = 'users'
@@ -20,7 +33,7 @@ class User(db.Model, UserMixin):
     @classmethod
     def create(cls, username, email, password):
         '''Create and return a new user'''
-        return cls(username=username, email=email, password=generate_password_hash(password))
+        return cls(username=username, email=email, password=hash_password(password))
     
 class Ingredient(db.Model):
     '''An ingredient for use in recipes or on-hand. Quantities are tracked in other tables.'''
@@ -37,15 +50,19 @@ class Ingredient(db.Model):
         return cls(name=name)
     
 class Recipe(db.Model):
-    '''A recipe. Ingredients and quantites are stored in the recipe_ingredients association table.'''
+    '''A recipe. Ingredients and quantites are stored in the recipe_ingredients association table.
+    
+    revision goes up whenever the recipe or its ingredients change (see revisions.py).
+    '''
     __tablename__ = 'recipes'
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable = False)
     instructions = db.Column(db.Text)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index = True)
+    revision = db.Column(db.Integer, nullable = False, default = 1, server_default = '1')
     
-    user = db.relationship('User', backref='recipes', lazy=False)
+    user = db.relationship('User', backref='recipes')
     
     def __repr__(self):
         return f'<Recipe id={self.id} name={self.name} user_id={self.user_id}>'
@@ -59,12 +76,12 @@ class RecipeIngredient(db.Model):
     __tablename__ = 'recipe_ingredients'
     
     id = db.Column(db.Integer, primary_key = True)
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'))
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete = 'CASCADE'), index = True)
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'))
     quantity = db.Column(db.Integer, nullable = False)
     
-    recipe = db.relationship('Recipe', backref='recipe_ingredients', lazy=False)
-    ingredient = db.relationship('Ingredient', backref='recipe_ingredients', lazy=False)
+    recipe = db.relationship('Recipe', backref=db.backref('recipe_ingredients', passive_deletes=True))
+    ingredient = db.relationship('Ingredient', backref='recipe_ingredients')
     
     def __repr__(self):
         return f'<RecipeIngredient id={self.id} recipe_id={self.recipe_id} ingredient_id={self.ingredient_id} quantity={self.quantity}>'
@@ -74,16 +91,17 @@ class RecipeIngredient(db.Model):
         return cls(recipe=recipe, ingredient=ingredient, quantity=quantity)
         
 class OnHand(db.Model):
-    '''List of ingredients a user has available to them.'''
+    '''List of ingredients a user has available to them. A user has at most one row per ingredient.'''
     __tablename__ = 'on_hand'
+    __table_args__ = (db.UniqueConstraint('user_id', 'ingredient_id', name='uq_on_hand_user_id_ingredient_id'),)
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'))
     quantity = db.Column(db.Integer, nullable = False)
     
-    user = db.relationship('User', backref='on_hand', lazy=False)
-    ingredient = db.relationship('Ingredient', backref='on_hand', lazy=False)
+    user = db.relationship('User', backref='on_hand')
+    ingredient = db.relationship('Ingredient', backref='on_hand')
     
     def __repr__(self):
         return f'<OnHand id={self.id} user_id={self.user_id} ingredient_id={self.ingredient_id} quantity={self.quantity}>'
@@ -93,16 +111,24 @@ class OnHand(db.Model):
         return cls(user=user, ingredient=ingredient, quantity=quantity)
 
 class Menu(db.Model):
-    '''A menu item. One menu can have many days planned.'''
+    '''A menu item. One menu can have many days planned. revision goes up whenever the menu or its recipes change.'''
     __tablename__ = 'menus'
     
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String)
     active = db.Column(db.Boolean, nullable=False, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    revision = db.Column(db.Integer, nullable = False, default = 1, server_default = '1')
+    
+    __table_args__ = (
+        db.Index('ix_menus_user_id_active', 'user_id', 'active'),
+        #A user can only have one active menu at a time
+        db.Index('uq_menus_user_id_active', 'user_id', unique=True,
+                 postgresql_where=db.text('active'), sqlite_where=db.text('active')),
+    )
     
     # days = db.relationship('Day', backref='menus')
-    user = db.relationship('User', backref='menus', lazy=False)
+    user = db.relationship('User', backref='menus')
     
     def __repr__(self):
         return f'<Menu id={self.id} name={self.name} user_id={self.user_id}>'
@@ -117,9 +143,9 @@ class Day(db.Model):
     
     id = db.Column(db.Integer, primary_key = True)
     day_of_week = db.Column(db.Integer)
-    menu_id = db.Column(db.Integer, db.ForeignKey('menus.id'))
+    menu_id = db.Column(db.Integer, db.ForeignKey('menus.id', ondelete = 'CASCADE'), index = True)
     
-    menu = db.relationship('Menu', backref='days', lazy=False)
+    menu = db.relationship('Menu', backref=db.backref('days', order_by='Day.day_of_week', passive_deletes=True))
     
     def __repr__(self):
         return f'<Day id={self.id} day_of_week={self.day_of_week} menu_id={self.menu_id}>'
@@ -132,11 +158,11 @@ class DaysRecipe(db.Model):
     '''An association table for recipes within a given day.'''
     __tablename__ = 'days_recipes'
     id = db.Column(db.Integer, primary_key = True)
-    day_id = db.Column(db.Integer, db.ForeignKey('days.id'))
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id'))
+    day_id = db.Column(db.Integer, db.ForeignKey('days.id', ondelete = 'CASCADE'), index = True)
+    recipe_id = db.Column(db.Integer, db.ForeignKey('recipes.id', ondelete = 'CASCADE'), index = True)
     
-    day = db.relationship('Day', backref='days_recipes', lazy=False)
-    recipe = db.relationship('Recipe', backref='days_recipes', lazy=False)
+    day = db.relationship('Day', backref=db.backref('days_recipes', passive_deletes=True))
+    recipe = db.relationship('Recipe', backref=db.backref('days_recipes', passive_deletes=True))
     
     def __repr__(self):
         return f'<DaysRecipe id={self.id} day={self.day_id} recipe={self.recipe_id}>'
@@ -146,13 +172,23 @@ class DaysRecipe(db.Model):
         return cls(day=day, recipe=recipe)
 
 class GroceryList(db.Model):
-    '''A list of ingredients.'''
+    '''A list of ingredients. revision goes up whenever the list or its ingredients change.'''
     __tablename__ = 'grocery_list'
     
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String)
     active = db.Column(db.Boolean, nullable=False, default=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    revision = db.Column(db.Integer, nullable = False, default = 1, server_default = '1')
+    created_on = db.Column(db.Date, nullable = False, default = date.today, server_default = db.func.current_date(), index = True)
+    
+    __table_args__ = (
+        #Covers the active list lookup and keyset pages of history, newest first
+        db.Index('ix_grocery_list_user_id_active_id', 'user_id', 'active', 'id'),
+        #A user can only have one active grocery list at a time
+        db.Index('uq_grocery_list_user_id_active', 'user_id', unique=True,
+                 postgresql_where=db.text('active'), sqlite_where=db.text('active')),
+    )
     
     user = db.relationship('User', backref='grocery_list')
     
@@ -169,11 +205,13 @@ class GroceryIngredient(db.Model):
     
     id = db.Column(db.Integer, primary_key = True)
     ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'))
-    grocery_list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id'))
+    grocery_list_id = db.Column(db.Integer, db.ForeignKey('grocery_list.id', ondelete = 'CASCADE'))
     quantity = db.Column(db.Integer, nullable = False)
     
+    __table_args__ = (db.Index('ix_grocery_ingredients_grocery_list_id_ingredient_id', 'grocery_list_id', 'ingredient_id'),)
+    
     ingredient = db.relationship('Ingredient', backref='grocery_ingredients')
-    grocery_list = db.relationship('GroceryList', backref=('grocery_ingredients'))
+    grocery_list = db.relationship('GroceryList', backref=db.backref('grocery_ingredients', passive_deletes=True))
     
     def __repr__(self):
         return f'<GroceryIngredient id={self.id} ingredient_id={self.ingredient_id} grocery_list_id={self.grocery_list_id} quantity={self.quantity}>'
@@ -182,10 +220,141 @@ class GroceryIngredient(db.Model):
     def create(cls, ingredient, grocery_list, quantity):
         return cls(ingredient=ingredient, grocery_list=grocery_list, quantity=quantity)
 
-def connect_to_db(app):
+class GroceryArchive(db.Model):
+    '''One month of a user's purchased grocery lists, moved out of grocery_list by archive.py.
+    
+    payload is the lists as gzipped JSON Lines. first_list_id and last_list_id bound the ids inside
+    so a single archived list can be found without opening every month.
+    '''
+    __tablename__ = 'grocery_archives'
+    __table_args__ = (db.UniqueConstraint('user_id', 'month', name='uq_grocery_archives_user_id_month'),)
+    
+    id = db.Column(db.Integer, primary_key = True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False)
+    month = db.Column(db.Date, nullable = False)
+    list_count = db.Column(db.Integer, nullable = False)
+    first_list_id = db.Column(db.Integer, nullable = False)
+    last_list_id = db.Column(db.Integer, nullable = False)
+    payload = db.Column(db.LargeBinary, nullable = False)
+    
+    def __repr__(self):
+        return f'<GroceryArchive id={self.id} user_id={self.user_id} month={self.month} list_count={self.list_count}>'
+
+class RecipeDraft(db.Model):
+    '''A recipe being put together in the add-recipe wizard. Only its id is kept in the session.'''
+    __tablename__ = 'recipe_drafts'
+    
+    id = db.Column(db.Integer, primary_key = True)
+    name = db.Column(db.String, nullable = False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), index = True)
+    created_at = db.Column(db.DateTime, nullable = False, default = utcnow, index = True)
+    
+    def __repr__(self):
+        return f'<RecipeDraft id={self.id} name={self.name} user_id={self.user_id}>'
+
+class RecipeDraftIngredient(db.Model):
+    '''An ingredient and quantity added to a recipe draft.'''
+    __tablename__ = 'recipe_draft_ingredients'
+    
+    id = db.Column(db.Integer, primary_key = True)
+    draft_id = db.Column(db.Integer, db.ForeignKey('recipe_drafts.id', ondelete = 'CASCADE'), index = True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'))
+    quantity = db.Column(db.Integer, nullable = False)
+    
+    def __repr__(self):
+        return f'<RecipeDraftIngredient id={self.id} draft_id={self.draft_id} ingredient_id={self.ingredient_id} quantity={self.quantity}>'
+
+class MenuDemand(db.Model):
+    '''How much of each ingredient a user's active menu needs for the week. Kept up to date by shortfall.py.'''
+    __tablename__ = 'menu_demand'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key = True)
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('ingredients.id'), primary_key = True)
+    quantity = db.Column(db.Integer, nullable = False)
+    
+    def __repr__(self):
+        return f'<MenuDemand user_id={self.user_id} ingredient_id={self.ingredient_id} quantity={self.quantity}>'
+
+class CatalogVersion(db.Model):
+    '''A version counter for a shared, cached table. Bumped on every change so each worker can tell when its cache is stale.'''
+    __tablename__ = 'catalog_versions'
+    
+    name = db.Column(db.String, primary_key = True)
+    version = db.Column(db.Integer, nullable = False, default = 0)
+    
+    def __repr__(self):
+        return f'<CatalogVersion name={self.name} version={self.version}>'
+
+class ApiToken(db.Model):
+    '''A bearer token for the JSON API. Only a SHA-256 hash of the token is stored.'''
+    __tablename__ = 'api_tokens'
+    
+    id = db.Column(db.Integer, primary_key = True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable = False, index = True)
+    token_hash = db.Column(db.String, unique = True, nullable = False)
+    name = db.Column(db.String)
+    created_at = db.Column(db.DateTime, nullable = False, default = utcnow)
+    
+    def __repr__(self):
+        return f'<ApiToken id={self.id} user_id={self.user_id} name={self.name}>'
+
+def upsert(model, dialect=None):
+    '''Return an INSERT for model that supports ON CONFLICT clauses on the connected database, or on dialect if given.'''
+    if (dialect or db.engine.dialect).name == 'sqlite':
+        return sqlite_insert(model)
+    return postgresql_insert(model)
+
+def hash_password(password):
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+@lru_cache(maxsize=None)
+def hash_prefix(method):
+    '''The method and parameters werkzeug writes in front of a hash made with method, defaults filled in.'''
+    return generate_password_hash('', method=method).split('$', 1)[0]
+
+def check_password(password_hash, password):
+    '''(whether password matches, a replacement hash if password_hash was made with other parameters than PASSWORD_HASH_METHOD).
+
+    Old hashes keep working, so the hashing cost can be changed in either direction without locking anyone out.
+    '''
+    if not check_password_hash(password_hash, password):
+        return (False, None)
+    if password_hash.split('$', 1)[0] != hash_prefix(PASSWORD_HASH_METHOD):
+        return (True, hash_password(password))
+    return (True, None)
+
+def engine_options(uri):
+    '''Connection pool settings for uri, tuned with DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE and DB_POOL_PRE_PING.'''
+    options = {
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') != '0',
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    #SQLite has no server connections to share, so the sizing settings only apply to real servers
+    if make_url(uri).get_backend_name() != 'sqlite':
+        options.update(pool_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+                       max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+                       pool_timeout=int(os.environ.get('DB_POOL_TIMEOUT', 30)))
+    return options
+
+def connect_to_db(app, push_context=True):
+    '''Point db at POSTGRES_URI. Scripts get an app context pushed for them; pass push_context=False to manage contexts yourself.'''
     app.config["SQLALCHEMY_DATABASE_URI"] = os.environ['POSTGRES_URI']
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(os.environ['POSTGRES_URI'])
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
-    app.app_context().push()
+    if push_context:
+        app.app_context().push()
     db.init_app(app)
+    with app.app_context():
+        enforce_foreign_keys(db.engine)
+
+def enforce_foreign_keys(engine):
+    '''Turn on foreign key enforcement, and so ON DELETE CASCADE, for every SQLite connection. PostgreSQL always enforces them.'''
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', sqlite_foreign_keys)
+
+def sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
     
@@ -0,0 +1,152 @@
+'''Automatic weekly menu planning that keeps the resulting grocery list as short as possible.
+
+A week is scored on the shortfall generate_list would produce for it (total quantity needed
+beyond what is on hand) and on how much of the pantry it uses. The planner fills each slot
+greedily with the recipe whose marginal cost is lowest, then improves the week by swapping one
+slot at a time for the best replacement until nothing helps or the time budget runs out. Every
+candidate is scored at once from a sparse recipe x ingredient matrix, so a step costs a couple of
+numpy passes over the user's recipe ingredients however many recipes there are.
+'''
+
+import time
+from collections import namedtuple
+import numpy as np
+from sqlalchemy import select
+from model import db, OnHand
+from menu_builder import DAYS_IN_WEEK, build_menu
+from ranking import recipe_ranker
+
+PLAN_BUDGET = 0.25
+MAX_RECIPES_PER_DAY = 5
+OBJECTIVES = ('shortfall', 'pantry')
+
+#Secondary objectives only break ties between weeks that are equal on the primary one
+TIE_BREAK = 1e-3
+
+Plan = namedtuple('Plan', ['days', 'shortfall', 'pantry_used'])
+
+
+class RecipeMatrix:
+    '''A user's recipes as a sparse recipe x ingredient matrix in coordinate form.
+
+    Entry k says recipe row rows[k] needs quantities[k] of ingredient column columns[k].
+    '''
+
+    def __init__(self, requirements, pantry):
+        self.recipe_ids = list(requirements)
+        ingredient_ids = sorted({ingredient_id for requirement in requirements.values() for ingredient_id in requirement})
+        column = {ingredient_id: i for (i, ingredient_id) in enumerate(ingredient_ids)}
+
+        entries = [(row, column[ingredient_id], quantity)
+                   for (row, requirement) in enumerate(requirements.values())
+                   for (ingredient_id, quantity) in requirement.items()]
+        self.rows = np.array([row for (row, _, _) in entries], dtype=np.int64)
+        self.columns = np.array([col for (_, col, _) in entries], dtype=np.int64)
+        self.quantities = np.array([quantity for (_, _, quantity) in entries], dtype=np.float64)
+        self.on_hand = np.array([max(pantry.get(ingredient_id, 0), 0) for ingredient_id in ingredient_ids], dtype=np.float64)
+
+    def demand(self, recipe_rows):
+        '''Total quantity of each ingredient column needed by the given recipe rows (repeats count twice).'''
+        counts = np.bincount(np.asarray(recipe_rows, dtype=np.int64), minlength=len(self.recipe_ids))
+        return np.bincount(self.columns, weights=self.quantities * counts[self.rows], minlength=len(self.on_hand))
+
+    def score(self, demand):
+        '''(shortfall, pantry used) for a week with the given demand.'''
+        return (float(np.maximum(demand - self.on_hand, 0).sum()), float(np.minimum(demand, self.on_hand).sum()))
+
+    def marginal_costs(self, demand, weights):
+        '''The change in weighted cost from adding each recipe to a week with the given demand.
+
+        weights is (shortfall weight, pantry used weight). An extra a of an ingredient adds
+        max(a - slack, 0) to the shortfall and uses min(a, slack) of the pantry, where slack is
+        what is left on hand after the current demand.
+        '''
+        slack = np.maximum(self.on_hand - demand, 0)[self.columns]
+        (shortfall_weight, pantry_weight) = weights
+        per_entry = shortfall_weight * np.maximum(self.quantities - slack, 0) - pantry_weight * np.minimum(self.quantities, slack)
+        return np.bincount(self.rows, weights=per_entry, minlength=len(self.recipe_ids))
+
+
+def objective_weights(objective):
+    if objective not in OBJECTIVES:
+        raise ValueError(f'Objective must be one of: {", ".join(OBJECTIVES)}.')
+    return (1.0, TIE_BREAK) if objective == 'shortfall' else (TIE_BREAK, 1.0)
+
+def optimize(matrix, slots, weights, no_repeats=True, budget=PLAN_BUDGET):
+    '''Pick a recipe row for each of slots slots, returning the rows in slot order.
+
+    Once the budget is spent, the remaining slots are filled from the last marginal costs
+    computed instead of fresh ones, and the local search is skipped.
+    '''
+    deadline = time.monotonic() + budget
+    chosen = []
+    demand = np.zeros(len(matrix.on_hand))
+    used = np.zeros(len(matrix.recipe_ids), dtype=bool)
+
+    costs = None
+    for _ in range(slots):
+        if costs is None or time.monotonic() < deadline:
+            costs = matrix.marginal_costs(demand, weights)
+        if no_repeats:
+            costs[used] = np.inf
+        row = int(np.argmin(costs))
+        chosen.append(row)
+        used[row] = True
+        demand += matrix.demand([row])
+
+    #Local search: replace one slot at a time with the best recipe for the rest of the week
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        for slot in range(slots):
+            if time.monotonic() >= deadline:
+                break
+            current = chosen[slot]
+            without = demand - matrix.demand([current])
+            costs = matrix.marginal_costs(without, weights)
+            if no_repeats:
+                used[current] = False
+                costs[used] = np.inf
+            best = int(np.argmin(costs))
+            if costs[best] < costs[current] - 1e-9:
+                chosen[slot] = best
+                demand = without + matrix.demand([best])
+                improved = True
+            used[chosen[slot]] = True
+
+    return chosen
+
+def plan_week(user_id, days=None, recipes_per_day=1, no_repeats=True, objective='shortfall', budget=PLAN_BUDGET):
+    '''Plan a week from the user's recipes and pantry without saving it.
+
+    days are the days of the week to fill (all of them by default). Raises ValueError if the
+    constraints cannot be met.
+    '''
+    days = sorted(set(days)) if days is not None else list(range(1, DAYS_IN_WEEK + 1))
+    if any(not 1 <= day <= DAYS_IN_WEEK for day in days):
+        raise ValueError(f'Days must be between 1 and {DAYS_IN_WEEK}.')
+    if not 1 <= recipes_per_day <= MAX_RECIPES_PER_DAY:
+        raise ValueError(f'Plan between 1 and {MAX_RECIPES_PER_DAY} recipes per day.')
+    weights = objective_weights(objective)
+
+    index = recipe_ranker.index(user_id)
+    with index.lock:
+        requirements = dict(index.requirements)
+    slots = len(days) * recipes_per_day
+    if not requirements or (no_repeats and len(requirements) < slots):
+        raise ValueError(f'You need at least {slots} recipes to plan this week without repeats.' if requirements
+                         else 'Add some recipes before planning a menu.')
+
+    pantry = dict(db.session.execute(select(OnHand.ingredient_id, OnHand.quantity).filter_by(user_id=user_id)).all())
+    matrix = RecipeMatrix(requirements, pantry)
+    chosen = optimize(matrix, slots, weights, no_repeats, budget)
+
+    plan = {day: [matrix.recipe_ids[row] for row in chosen[i * recipes_per_day:(i + 1) * recipes_per_day]]
+            for (i, day) in enumerate(days)}
+    (shortfall, pantry_used) = matrix.score(matrix.demand(chosen))
+    return Plan(plan, shortfall, pantry_used)
+
+def create_planned_menu(user_id, name, **constraints):
+    '''Plan a week and save it as a menu. Returns (menu id, Plan).'''
+    plan = plan_week(user_id, **constraints)
+    return (build_menu(user_id, name, plan.days), plan)
@@ -0,0 +1,104 @@
+'''Named loading strategies for pages that walk deep relationship graphs, and the queries built on them.
+
+Each strategy loads a whole graph in a fixed number of statements, so a page costs the same
+number of queries whether the user has one menu or a hundred.
+'''
+
+from sqlalchemy import select
+from sqlalchemy.orm import configure_mappers, selectinload, joinedload
+from model import db, Menu, Day, DaysRecipe, Recipe, RecipeIngredient, OnHand, GroceryList, GroceryIngredient
+
+#Backref attributes such as Menu.days only exist once the mappers are configured.
+configure_mappers()
+
+HISTORY_PAGE_SIZE = 10
+
+#Menu -> days -> day recipes -> recipe
+MENU_WITH_WEEK = (
+    selectinload(Menu.days).selectinload(Day.days_recipes).joinedload(DaysRecipe.recipe),
+)
+
+#Grocery list -> list items -> ingredient
+GROCERY_LIST_WITH_INGREDIENTS = (
+    selectinload(GroceryList.grocery_ingredients).joinedload(GroceryIngredient.ingredient),
+)
+
+#Recipe -> recipe ingredients -> ingredient
+RECIPE_WITH_INGREDIENTS = (
+    selectinload(Recipe.recipe_ingredients).joinedload(RecipeIngredient.ingredient),
+)
+
+#Pantry item -> ingredient
+PANTRY_WITH_INGREDIENTS = (
+    joinedload(OnHand.ingredient),
+)
+
+
+def menu_summaries(user_id):
+    '''(id, name, active, revision) rows for each of a user's menus, without their days.'''
+    return db.session.execute(select(Menu.id, Menu.name, Menu.active, Menu.revision).filter_by(user_id=user_id).order_by(Menu.id)).all()
+
+def menus_with_week(user_id, menu_ids=None):
+    '''A user's menus, or just those in menu_ids, with every day and recipe loaded.'''
+    query = Menu.query.options(*MENU_WITH_WEEK).filter_by(user_id=user_id)
+    if menu_ids is not None:
+        query = query.filter(Menu.id.in_(menu_ids))
+    return query.order_by(Menu.id).all()
+
+def active_list(user_id):
+    '''The user's active grocery list with its ingredients, or None.'''
+    return GroceryList.query.options(*GROCERY_LIST_WITH_INGREDIENTS).filter_by(user_id=user_id, active=True).first()
+
+def active_list_summary(user_id):
+    '''(id, name, revision) of the user's active grocery list, or None.'''
+    return db.session.execute(select(GroceryList.id, GroceryList.name, GroceryList.revision).filter_by(user_id=user_id, active=True)).first()
+
+def grocery_history_summaries(user_id, before=None, limit=HISTORY_PAGE_SIZE):
+    '''(id, name, revision) rows for the page of history grocery_history_page would load.'''
+    query = select(GroceryList.id, GroceryList.name, GroceryList.revision).filter_by(user_id=user_id, active=False)
+    if before is not None:
+        query = query.where(GroceryList.id < before)
+    return db.session.execute(query.order_by(GroceryList.id.desc()).limit(limit)).all()
+
+def grocery_lists_with_ingredients(grocery_list_ids):
+    '''The grocery lists with the given ids, with their ingredients.'''
+    return GroceryList.query.options(*GROCERY_LIST_WITH_INGREDIENTS).filter(GroceryList.id.in_(grocery_list_ids)).all()
+
+def grocery_list_with_ingredients(grocery_list_id):
+    '''A single grocery list with its ingredients, or None.'''
+    return GroceryList.query.options(*GROCERY_LIST_WITH_INGREDIENTS).filter_by(id=grocery_list_id).first()
+
+def grocery_history_page(user_id, before=None, limit=HISTORY_PAGE_SIZE):
+    '''Up to limit of the user's previous grocery lists, newest first, with ids below before.'''
+    query = (GroceryList.query.options(*GROCERY_LIST_WITH_INGREDIENTS)
+             .filter_by(user_id=user_id, active=False))
+    if before is not None:
+        query = query.filter(GroceryList.id < before)
+    return query.order_by(GroceryList.id.desc()).limit(limit).all()
+
+def iter_grocery_history(user_id, page_size=HISTORY_PAGE_SIZE):
+    '''Yield every previous grocery list, one keyset page at a time, dropping each page from the session once it has been consumed.'''
+    before = None
+    while True:
+        page = grocery_history_page(user_id, before, page_size)
+        yield from page
+
+        if len(page) < page_size:
+            return
+        before = page[-1].id
+        for grocery_list in page:
+            for grocery_ingredient in grocery_list.grocery_ingredients:
+                db.session.expunge(grocery_ingredient)
+            db.session.expunge(grocery_list)
+
+def recipe_with_ingredients(recipe_id):
+    '''A single recipe with its ingredients, or None.'''
+    return Recipe.query.options(*RECIPE_WITH_INGREDIENTS).filter_by(id=recipe_id).first()
+
+def recipes_with_ingredients(user_id):
+    '''All of a user's recipes with their ingredients.'''
+    return Recipe.query.options(*RECIPE_WITH_INGREDIENTS).filter_by(user_id=user_id).order_by(Recipe.id).all()
+
+def pantry_with_ingredients(user_id):
+    '''All of a user's pantry items with their ingredients.'''
+    return OnHand.query.options(*PANTRY_WITH_INGREDIENTS).filter_by(user_id=user_id).order_by(OnHand.id).all()
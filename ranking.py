@@ -0,0 +1,239 @@
+'''"Cook from pantry" ranking: which of a user's recipes can they make with what is on hand?
+
+Each user's recipes are held in memory as an inverted index from ingredient id to the recipes that
+need it, so scoring only touches the postings of ingredients actually in the pantry. The index is
+updated in place when this worker adds or deletes a recipe. Changes made elsewhere are noticed
+through a per-user counter in catalog_versions, which every read checks.
+'''
+
+import heapq
+import threading
+from collections import OrderedDict, namedtuple
+import numpy as np
+from sqlalchemy import select, update, insert
+from model import db, Recipe, RecipeIngredient, OnHand, CatalogVersion
+
+RANK_LIMIT = 10
+MAX_INDEXES = 128
+COMPACT_AFTER = 1000
+
+Match = namedtuple('Match', ['recipe_id', 'name', 'coverage', 'missing'])
+
+
+class RecipeIndex:
+    '''One user's recipes, indexed by ingredient.
+
+    requirements ({recipe id: {ingredient id: quantity}}) is the source of truth. It is compiled
+    into numpy arrays: each ingredient owns a slice of posting_rows/posting_needed naming the
+    recipes that use it, so a pantry is scored with a couple of bincounts. Recipes added since the
+    last compile are kept in pending and scored in Python, and deleted ones are masked out through
+    alive, until COMPACT_AFTER changes have built up. Hold lock while reading or changing an index
+    that other threads can see.
+    '''
+
+    def __init__(self, rows=()):
+        self.lock = threading.Lock()
+        self.names = {}
+        self.requirements = {}
+        for (recipe_id, name, ingredient_id, quantity) in rows:
+            self.names[recipe_id] = name
+            requirement = self.requirements.setdefault(recipe_id, {})
+            if ingredient_id is not None:
+                requirement[ingredient_id] = requirement.get(ingredient_id, 0) + quantity
+        self.compile()
+
+    def compile(self):
+        '''Rebuild the arrays from requirements, folding in every pending change.'''
+        self.recipe_ids = np.fromiter(self.requirements, dtype=np.int64, count=len(self.requirements))
+        self.rows = {recipe_id: row for (row, recipe_id) in enumerate(self.recipe_ids.tolist())}
+        self.totals = np.array([sum(requirement.values()) for requirement in self.requirements.values()], dtype=np.float64)
+        self.sizes = np.array([len(requirement) for requirement in self.requirements.values()], dtype=np.float64)
+        self.alive = np.ones(len(self.recipe_ids), dtype=bool)
+
+        postings = {}
+        for (row, requirement) in enumerate(self.requirements.values()):
+            for (ingredient_id, quantity) in requirement.items():
+                postings.setdefault(ingredient_id, []).append((row, quantity))
+        self.slices = {}
+        posting_rows = []
+        posting_needed = []
+        for (ingredient_id, posting) in postings.items():
+            self.slices[ingredient_id] = (len(posting_rows), len(posting_rows) + len(posting))
+            for (row, quantity) in posting:
+                posting_rows.append(row)
+                posting_needed.append(quantity)
+        self.posting_rows = np.array(posting_rows, dtype=np.int64)
+        self.posting_needed = np.array(posting_needed, dtype=np.float64)
+
+        self.pending = set()
+        self.changes = 0
+
+    def add(self, recipe_id, name, ingredients):
+        '''Index a recipe from its (ingredient id, quantity) pairs, replacing any earlier copy.'''
+        self.remove(recipe_id)
+        requirement = {}
+        for (ingredient_id, quantity) in ingredients:
+            requirement[ingredient_id] = requirement.get(ingredient_id, 0) + quantity
+        self.names[recipe_id] = name
+        self.requirements[recipe_id] = requirement
+        self.pending.add(recipe_id)
+        self._changed()
+
+    def remove(self, recipe_id):
+        '''Drop a recipe from the index. Unknown ids are ignored.'''
+        if recipe_id not in self.names:
+            return
+        row = self.rows.pop(recipe_id, None)
+        if row is not None:
+            self.alive[row] = False
+        self.pending.discard(recipe_id)
+        del self.names[recipe_id]
+        del self.requirements[recipe_id]
+        self._changed()
+
+    def _changed(self):
+        self.changes += 1
+        if self.changes >= COMPACT_AFTER:
+            self.compile()
+
+    def rank(self, pantry, limit=RANK_LIMIT):
+        '''The top limit recipes for a pantry of {ingredient id: quantity}, best first.
+
+        Recipes are ordered by the fraction of their total quantity on hand, then by how many of
+        their ingredients are short. Recipes with no ingredients count as fully covered. Only the
+        recipes that can still make the top limit on coverage are sorted.
+        '''
+        candidates = self._rank_compiled(pantry, limit)
+        for recipe_id in self.pending:
+            requirement = self.requirements[recipe_id]
+            total = sum(requirement.values())
+            covered = sum(min(pantry.get(ingredient_id, 0), quantity) for (ingredient_id, quantity) in requirement.items())
+            missing = sum(1 for (ingredient_id, quantity) in requirement.items() if pantry.get(ingredient_id, 0) < quantity)
+            candidates.append((-(covered / total) if total else -1.0, missing, recipe_id))
+
+        return [Match(recipe_id, self.names[recipe_id], -negative_coverage, missing)
+                for (negative_coverage, missing, recipe_id) in heapq.nsmallest(limit, candidates)]
+
+    def _rank_compiled(self, pantry, limit):
+        #Returns (-coverage, missing, recipe id) for the best live compiled recipes, plus any that tie with the last of them
+        if not len(self.recipe_ids) or limit <= 0:
+            return []
+
+        slices = [(self.slices[ingredient_id], on_hand) for (ingredient_id, on_hand) in pantry.items()
+                  if on_hand > 0 and ingredient_id in self.slices]
+        covered = np.zeros(len(self.recipe_ids))
+        satisfied = np.zeros(len(self.recipe_ids))
+        if slices:
+            rows = np.concatenate([self.posting_rows[start:end] for ((start, end), _) in slices])
+            needed = np.concatenate([self.posting_needed[start:end] for ((start, end), _) in slices])
+            on_hand = np.repeat([on_hand for (_, on_hand) in slices], [end - start for ((start, end), _) in slices])
+            covered = np.bincount(rows, weights=np.minimum(on_hand, needed), minlength=len(self.recipe_ids))
+            satisfied = np.bincount(rows, weights=on_hand >= needed, minlength=len(self.recipe_ids))
+
+        coverage = np.divide(covered, self.totals, out=np.ones_like(covered), where=self.totals > 0)
+        coverage[~self.alive] = -1.0
+        if limit < len(coverage):
+            cutoff = np.partition(coverage, len(coverage) - limit)[len(coverage) - limit]
+            rows = np.flatnonzero((coverage >= cutoff) & self.alive)
+        else:
+            rows = np.flatnonzero(self.alive)
+        missing = self.sizes[rows] - satisfied[rows]
+        best = rows[np.lexsort((self.recipe_ids[rows], missing, -coverage[rows]))[:limit]]
+        return list(zip((-coverage[best]).tolist(), (self.sizes[best] - satisfied[best]).astype(int).tolist(), self.recipe_ids[best].tolist()))
+
+class RecipeRanker:
+    '''Per-user RecipeIndexes for the most recently ranked MAX_INDEXES users.'''
+
+    def __init__(self, max_indexes=MAX_INDEXES):
+        self.max_indexes = max_indexes
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()
+
+    def index(self, user_id):
+        '''The user's index, rebuilt with one query if another worker has changed their recipes.'''
+        version = current_version(user_id)
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if cached is not None and cached[0] == version:
+                self._indexes.move_to_end(user_id)
+                return cached[1]
+
+        rows = db.session.execute(select(Recipe.id, Recipe.name, RecipeIngredient.ingredient_id, RecipeIngredient.quantity)
+                                  .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+                                  .where(Recipe.user_id == user_id)).all()
+        index = RecipeIndex(rows)
+        self._store(user_id, version, index)
+        return index
+
+    def rank(self, user_id, limit=RANK_LIMIT):
+        '''The user's top limit recipes for what is currently in their pantry.'''
+        index = self.index(user_id)
+        pantry = dict(db.session.execute(select(OnHand.ingredient_id, OnHand.quantity).filter_by(user_id=user_id)).all())
+        with index.lock:
+            return index.rank(pantry, limit)
+
+    def recipe_added(self, user_id, recipe_id):
+        '''Record a newly committed recipe and add it to the cached index in place.'''
+        version = bump_version(user_id)
+        db.session.commit()
+        rows = db.session.execute(select(Recipe.name, RecipeIngredient.ingredient_id, RecipeIngredient.quantity)
+                                  .outerjoin(RecipeIngredient, RecipeIngredient.recipe_id == Recipe.id)
+                                  .where(Recipe.id == recipe_id)).all()
+        self._update(user_id, version, lambda index: index.add(
+            recipe_id, rows[0][0], [(ingredient_id, quantity) for (_, ingredient_id, quantity) in rows if ingredient_id is not None]))
+
+    def recipes_removed(self, user_id, recipe_ids):
+        '''Record committed recipe deletes and remove the recipes from the cached index in place.'''
+        if not recipe_ids:
+            return
+        version = bump_version(user_id)
+        db.session.commit()
+        def remove(index):
+            for recipe_id in recipe_ids:
+                index.remove(recipe_id)
+        self._update(user_id, version, remove)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def _update(self, user_id, version, change):
+        #Only patch an index that was current just before this change; anything older is rebuilt on next read
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if cached is None:
+                return
+            if cached[0] != version - 1:
+                del self._indexes[user_id]
+                return
+            with cached[1].lock:
+                change(cached[1])
+            self._indexes[user_id] = (version, cached[1])
+
+    def _store(self, user_id, version, index):
+        with self._lock:
+            self._indexes[user_id] = (version, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+
+recipe_ranker = RecipeRanker()
+
+
+def version_name(user_id):
+    return f'recipes:{user_id}'
+
+def current_version(user_id):
+    '''The version of a user's recipe set, 0 if it has never been bumped.'''
+    return db.session.execute(select(CatalogVersion.version).filter_by(name=version_name(user_id))).scalar() or 0
+
+def bump_version(user_id):
+    '''Increment the version of a user's recipe set and return the new version. Does not commit.'''
+    version = db.session.execute(update(CatalogVersion)
+                                 .where(CatalogVersion.name == version_name(user_id))
+                                 .values(version=CatalogVersion.version + 1)
+                                 .returning(CatalogVersion.version)).scalar()
+    if version is None:
+        db.session.execute(insert(CatalogVersion).values(name=version_name(user_id), version=1))
+        version = 1
+    return version
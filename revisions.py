@@ -0,0 +1,42 @@
+'''Keeps the revision counters on recipes, menus and grocery lists moving.
+
+ORM changes bump them through the mapper events below: a parent's own row is bumped in the
+UPDATE the ORM already sends, and a change to a child row bumps its parent with one extra
+UPDATE. Bulk Core statements skip mapper events, so code that changes existing rows that way
+must bump the revision in the same statement (see bump()).
+'''
+
+from sqlalchemy import event, select, update
+from model import Recipe, RecipeIngredient, Menu, Day, DaysRecipe, GroceryList, GroceryIngredient
+
+
+def bump(model):
+    '''The SET value that moves model's revision on, for use in Core or bulk query updates.'''
+    return {model.revision: model.revision + 1}
+
+@event.listens_for(Recipe, 'before_update')
+@event.listens_for(Menu, 'before_update')
+@event.listens_for(GroceryList, 'before_update')
+def parent_changed(mapper, connection, target):
+    target.revision = type(target).revision + 1
+
+def bump_parent(connection, model, parent_id):
+    connection.execute(update(model).where(model.id == parent_id).values(bump(model)))
+
+@event.listens_for(RecipeIngredient, 'after_insert')
+@event.listens_for(RecipeIngredient, 'after_update')
+@event.listens_for(RecipeIngredient, 'after_delete')
+def recipe_ingredient_changed(mapper, connection, target):
+    bump_parent(connection, Recipe, target.recipe_id)
+
+@event.listens_for(DaysRecipe, 'after_insert')
+@event.listens_for(DaysRecipe, 'after_update')
+@event.listens_for(DaysRecipe, 'after_delete')
+def days_recipe_changed(mapper, connection, target):
+    bump_parent(connection, Menu, select(Day.menu_id).where(Day.id == target.day_id).scalar_subquery())
+
+@event.listens_for(GroceryIngredient, 'after_insert')
+@event.listens_for(GroceryIngredient, 'after_update')
+@event.listens_for(GroceryIngredient, 'after_delete')
+def grocery_ingredient_changed(mapper, connection, target):
+    bump_parent(connection, GroceryList, target.grocery_list_id)
@@ -1,82 +1,49 @@
 '''Script to seed the database'''
 
 import os
-import json
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import insert
 
 import model
 import server
+import importer
 
 os.system('dropdb menu_master')
 os.system('createdb menu_master')
 
-model.connect_to_db(server.app)
-model.db.create_all()
+#Build the schema through the migrations, so the new database is already at the latest revision
+command.upgrade(Config('alembic.ini'), 'head')
+server.create_app(push_context=True)
 
 #Create and add a test user to own our test recipes
 user = model.User.create('test', 'test@test.test', 'test')
 model.db.session.add(user)
+model.db.session.commit()
 
-with open('data/recipes.json') as f:
-    #Get the data from the JSON file
-    recipe_data = json.loads(f.read())
-    recipes_in_db = []
-    
-    for recipe in recipe_data:
-        name_to_add = recipe['name']
-        # print(name_to_add)
-        instruction_to_add = recipe['instructions']
-        
-        #Create the Recipe entry to be referenced later
-        new_recipe = model.Recipe.create(name_to_add, instruction_to_add, user)
-        model.db.session.add(new_recipe)
-        
-        #Get the list of Ingredients
-        ingredients_to_add = recipe['ingredients']
-        # print(ingredients_to_add)
-        
-        #Iterate over the ingredients and add them to the Ingredient table
-        for ingredient in ingredients_to_add:
-            # print(ingredient["name"])
-            # print(ingredient["qty"])
-            existing_ingredient = model.Ingredient.query.filter_by(name=ingredient['name']).first()
-            qty = ingredient["qty"]
-            if not existing_ingredient:
-                #If the ingredient does not exist, create an entry for it.
-                ingredient_new = model.Ingredient.create(ingredient['name'])
-                model.db.session.add(ingredient_new)
-                
-                #Link the ingredient to its recipe and get the quantity
-                recipe_ingredient = model.RecipeIngredient.create(new_recipe, ingredient_new, qty)
-                model.db.session.add(recipe_ingredient)
-                model.db.session.commit()
-            else:
-                #If the ingredient already exists, link it to the recipe.
-                recipe_ingredient = model.RecipeIngredient.create(new_recipe, existing_ingredient, qty)
-                model.db.session.add(recipe_ingredient)
-                model.db.session.commit()
+#Bulk load the recipes, creating their ingredients as we go
+importer.import_recipes(importer.iter_records('data/recipes.json'), user.id)
 
 #Create an on_hand inventory for our user
-with open('data/on_hand.json') as f:
-    on_hand_data = json.loads(f.read())
-    
-    for ingredient in on_hand_data:
-        ingredient_obj = model.Ingredient.query.filter_by(name=ingredient['name']).first()
-        qty = ingredient['qty']
-        new_on_hand = model.OnHand.create(user, ingredient_obj, qty)
-        model.db.session.add(new_on_hand)
-        model.db.session.commit()
-        
+on_hand_data = list(importer.iter_records('data/on_hand.json'))
+ingredient_ids = importer.load_ingredient_ids()
+importer.resolve_ingredients((ingredient['name'] for ingredient in on_hand_data), ingredient_ids)
+model.db.session.execute(insert(model.OnHand), [
+    {'user_id': user.id, 'ingredient_id': ingredient_ids[ingredient['name']], 'quantity': ingredient['qty']}
+    for ingredient in on_hand_data
+])
+model.db.session.commit()
+
 #Create an example menu for our user
 menu = model.Menu.create('Example', user)
 model.db.session.add(menu)
 
-#Create days for the menu
-for n in range(7):
-    #Get a day of the week number using the range function
+#Create days for the menu, each with one of the test recipes
+recipes = model.Recipe.query.filter_by(user_id=user.id).order_by(model.Recipe.id).limit(7).all()
+for n, recipe in enumerate(recipes):
     new_day = model.Day.create(n+1, menu)
     model.db.session.add(new_day)
-    #Get a recipe out of the database and add it to the day.
-    recipe = model.Recipe.query.filter_by(id=n).first()
     new_day_recipe = model.DaysRecipe.create(new_day, recipe)
+    model.db.session.add(new_day_recipe)
 
-model.db.session.commit()
\ No newline at end of file
+model.db.session.commit()
@@ -1,21 +1,39 @@
 import os
+import itertools
 from datetime import date
-from flask import Flask, render_template, request, flash, session, redirect, url_for
+from flask import Flask, Response, render_template, request, flash, session, redirect, url_for, stream_with_context, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_required, login_user, logout_user, current_user
-from model import db, connect_to_db, User, OnHand, Ingredient, Menu, Day, DaysRecipe, Recipe, RecipeIngredient, GroceryIngredient, GroceryList
-from werkzeug.security import check_password_hash
-from forms import LoginForm, CreateUserForm, AddIngredientForm, CreateMenuForm, RecipeIngredientForm, RecipeNameForm, RecipeInstructionForm
+from model import db, connect_to_db, User, OnHand, Ingredient, Menu, GroceryIngredient, GroceryList
+from forms import LoginForm, CreateUserForm, AddIngredientForm, CreateMenuForm, PlanMenuForm, ConsolidateListForm, ClearHistoryForm, PantryImportForm, RecipeIngredientForm, RecipeNameForm, RecipeInstructionForm
+from catalog import ingredient_catalog
+from metrics import init_metrics
+import drafts
+import grocery
+import export
+import archive
+import auth
+import bulk_delete
+import consolidate
+import inventory
+import shortfall
+import menu_builder
+import planner
+import queries
+import revisions
+import http_cache
+import fragments
+import ranking
 
 app = Flask(__name__)
-app.secret_key = os.environ['FLASK_SECRET_KEY']
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+init_metrics(app)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return auth.user_cache.load(int(user_id))
 
 @app.route('/')
 def home():
@@ -55,8 +73,9 @@ def login():
     if login_form.validate_on_submit():
         user = User.query.filter_by(username=login_form.username.data).first()
         if user:
-            if check_password_hash(user.password, login_form.password.data):
-                login_user(user)
+            if auth.verify_password(user, login_form.password.data):
+                db.session.commit()
+                login_user(auth.SessionUser.from_user(user))
                 flash('Login Successful')
                 return redirect(url_for('home'))
             else: 
@@ -76,16 +95,27 @@ def logout():
 @app.route('/menus')
 @login_required
 def menus():
-    user_menus = Menu.query.filter_by(user_id=current_user.id).all()
-    active_menu = Menu.query.filter_by(user_id=current_user.id, active=True).first()
+    user_menus = queries.menu_summaries(current_user.id)
+    shortfalls = shortfall.shortfalls(current_user.id)
+    
+    def render():
+        #Each menu's week is rendered once per revision; only menus that changed are loaded
+        weeks = fragments.fragment_cache.render(fragments.MENU_WEEK, [(menu.id, menu.revision) for menu in user_menus],
+                                                lambda menu_ids: {menu.id: render_template('fragments/menu_week.html', menu=menu)
+                                                                  for menu in queries.menus_with_week(current_user.id, menu_ids)})
+        active_menu = next((menu for menu in user_menus if menu.active), None)
+        return render_template('menus.html', user_menus=user_menus, active_menu=active_menu, shortfalls=shortfalls, weeks=weeks)
     
-    return render_template('menus.html', user_menus=user_menus, active_menu=active_menu)
+    return http_cache.conditional(http_cache.menus_etag(current_user.id, user_menus, shortfalls), render)
 
 @app.route('/menus/active/<menu_id>')
 @login_required
 def make_menu_active(menu_id):
-    active_menu = Menu.query.filter_by(id=menu_id).first()
+    active_menu = Menu.query.filter_by(id=menu_id, user_id=current_user.id).first()
+    #Only one menu can be active, so switch off the current one first
+    Menu.query.filter_by(user_id=current_user.id, active=True).update({'active': False, **revisions.bump(Menu)})
     active_menu.active = True
+    shortfall.set_active_menu(current_user.id, active_menu.id)
     db.session.commit()
     flash(f'{active_menu.name} is now the active menu.')
     return redirect(url_for('menus'))
@@ -93,105 +123,133 @@ def make_menu_active(menu_id):
 @app.route('/menus/deactivate/<menu_id>')
 @login_required
 def deactivate_menu(menu_id):
-    active_menu = Menu.query.filter_by(id=menu_id).first()
+    active_menu = Menu.query.filter_by(id=menu_id, user_id=current_user.id).first()
+    #Only the active menu's demand is tracked, so deactivating any other menu leaves it alone
+    if active_menu.active:
+        shortfall.clear(current_user.id)
     active_menu.active = False
     db.session.commit()
     flash(f'{active_menu.name} has been deactivated.')
     return redirect(url_for('menus'))
 
-@app.route('/menus/delete/<menu_id>')
+@app.route('/menus/<int:menu_id>/cooked/<int:day_of_week>')
+@login_required
+def cook_menu_day(menu_id, day_of_week):
+    '''Take everything the day's recipes use out of the pantry.'''
+    try:
+        changed = inventory.cook_day(current_user.id, menu_id, day_of_week)
+    except ValueError as error:
+        flash(str(error))
+        return redirect(url_for('menus'))
+    
+    flash(f'Enjoy! Used up ingredients for day {day_of_week} ({changed} pantry items updated).')
+    return redirect(url_for('menus'))
+
+@app.route('/menus/delete/<int:menu_id>')
 @login_required
 def delete_menu(menu_id):
-    menu = Menu.query.filter_by(id=menu_id).first()
-    db.session.delete(menu)
+    deleted = bulk_delete.delete_menus(current_user.id, [menu_id])
     db.session.commit()
-    flash(f'{menu.name} has been deleted.')
+    if deleted:
+        flash(f'{deleted[0].name} has been deleted.')
     return redirect(url_for('menus'))
 
 @app.route('/menus/create', methods=["GET", "POST"])
 @login_required
 def create_menu():
     create_menu_form = CreateMenuForm()
-    create_menu_form.update_recipe_choices(Recipe.query.filter_by(user_id=current_user.id).all())
+    create_menu_form.update_recipe_choices(menu_builder.recipe_choices(current_user.id))
     
     if create_menu_form.validate_on_submit():
-        #Create a new menu
-        new_menu = Menu.create(create_menu_form.name.data, current_user)
-        db.session.add(new_menu)
-        
-        #Create days of the week for that menu, append to the list
-        sunday = Day.create(1, new_menu)
-        db.session.add(sunday)
-        
-        monday = Day.create(2, new_menu)
-        db.session.add(monday)
-        
-        tuesday = Day.create(3, new_menu)
-        db.session.add(tuesday)
-        
-        wednesday = Day.create(4, new_menu)
-        db.session.add(wednesday)
-        
-        thursday = Day.create(5, new_menu)
-        db.session.add(thursday)
-        
-        friday = Day.create(6, new_menu)
-        db.session.add(friday)
-        
-        saturday = Day.create(7, new_menu)
-        db.session.add(saturday)
-        
-        #Get the recipes from the form
-        sunday_recipe = Recipe.query.filter_by(id=create_menu_form.sunday_recipe.data).first()
-        print(sunday_recipe)
-        monday_recipe = Recipe.query.filter_by(id=create_menu_form.monday_recipe.data).first()
-        tuesday_recipe = Recipe.query.filter_by(id=create_menu_form.tuesday_recipe.data).first()
-        wednesday_recipe = Recipe.query.filter_by(id=create_menu_form.wednesday_recipe.data).first()
-        thursday_recipe = Recipe.query.filter_by(id=create_menu_form.thursday_recipe.data).first()
-        friday_recipe = Recipe.query.filter_by(id=create_menu_form.friday_recipe.data).first()
-        saturday_recipe = Recipe.query.filter_by(id=create_menu_form.saturday_recipe.data).first()
-        
-        #Create the DaysRecipes object for each day. 
-        sunday_menu = DaysRecipe.create(sunday, sunday_recipe)
-        db.session.add(sunday_menu)
-        
-        monday_menu = DaysRecipe.create(monday, monday_recipe)
-        db.session.add(monday_menu)
+        #Map each day of the week to the recipe picked for it
+        plan = {day: [field.data] for (day, field) in enumerate(create_menu_form.day_fields(), start=1)}
         
-        tuesday_menu = DaysRecipe.create(tuesday, tuesday_recipe)
-        db.session.add(tuesday_menu)
+        try:
+            menu_builder.build_menu(current_user.id, create_menu_form.name.data, plan)
+        except ValueError as error:
+            flash(str(error))
+            return redirect(url_for('create_menu'))
         
-        wednesday_menu = DaysRecipe.create(wednesday, wednesday_recipe)
-        db.session.add(wednesday_menu)
-        
-        thursday_menu = DaysRecipe.create(thursday, thursday_recipe)
-        db.session.add(thursday_menu)
-        
-        friday_menu = DaysRecipe.create(friday, friday_recipe)
-        db.session.add(friday_menu)
-        
-        saturday_menu = DaysRecipe.create(saturday, saturday_recipe)
-        db.session.add(saturday_menu)
-        
-        db.session.commit()
         flash('New Menu Created!')
         return redirect(url_for('menus'))
     
     return render_template('create_menu.html', create_menu_form=create_menu_form)
 
+@app.route('/menus/plan', methods=["GET", "POST"])
+@login_required
+def plan_menu():
+    '''Let the planner pick a week of recipes from the user's pantry.'''
+    plan_menu_form = PlanMenuForm()
+    
+    if plan_menu_form.validate_on_submit():
+        try:
+            (_, plan) = planner.create_planned_menu(current_user.id, plan_menu_form.name.data,
+                                                    recipes_per_day=plan_menu_form.recipes_per_day.data,
+                                                    no_repeats=not plan_menu_form.allow_repeats.data,
+                                                    objective=plan_menu_form.objective.data)
+        except ValueError as error:
+            flash(str(error))
+            return redirect(url_for('plan_menu'))
+        
+        flash(f'New Menu Planned! You will need to buy {plan.shortfall:g} items.')
+        return redirect(url_for('menus'))
+    
+    return render_template('plan_menu.html', plan_menu_form=plan_menu_form)
+
+@app.route('/api/menus/plan', methods=["POST"])
+@login_required
+def api_plan_menu():
+    '''Plan a week from JSON {"name": ..., "days": [...], "recipes_per_day": ..., "no_repeats": ..., "objective": ...}.
+    
+    Pass "save": false to get the plan back without creating a menu.
+    '''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='Expected a JSON object.'), 400
+    
+    try:
+        constraints = {key: body[key] for key in ('days', 'recipes_per_day', 'no_repeats', 'objective') if key in body}
+        if body.get('save', True):
+            (menu_id, plan) = planner.create_planned_menu(current_user.id, body['name'], **constraints)
+        else:
+            (menu_id, plan) = (None, planner.plan_week(current_user.id, **constraints))
+    except (KeyError, TypeError):
+        return jsonify(error='A saved plan needs a name, and days must be a list of day numbers.'), 400
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    
+    return jsonify(menu_id=menu_id, days=plan.days, shortfall=plan.shortfall, pantry_used=plan.pantry_used), 201 if menu_id else 200
+
+@app.route('/api/menus', methods=["POST"])
+@login_required
+def api_create_menus():
+    '''Create one menu, or many at once, from JSON plans of {"name": ..., "days": {day: [recipe ids]}}.'''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='Expected a JSON object.'), 400
+    
+    specs = body['menus'] if 'menus' in body else [body]
+    try:
+        menu_ids = menu_builder.build_menus(current_user.id, [(spec['name'], spec.get('days', {})) for spec in specs])
+    except (KeyError, TypeError, AttributeError):
+        return jsonify(error='Each menu needs a name and a days mapping.'), 400
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    
+    return jsonify(menu_ids=menu_ids), 201
+
 @app.route('/pantry', methods=['GET', 'POST'])
 @login_required
 def pantry():
-    user_pantry = OnHand.query.filter_by(user=current_user).all()
+    user_pantry = queries.pantry_with_ingredients(current_user.id)
     
     add_ingredient_form = AddIngredientForm()
-    add_ingredient_form.update_ingredients(Ingredient.query.all())
     
     if add_ingredient_form.validate_on_submit():
         ing_id = add_ingredient_form.ingredient.data
         ing_to_add = Ingredient.query.filter_by(id=ing_id).first()
         qty_to_add = add_ingredient_form.quantity.data
-        existing_pantry_item = OnHand.query.filter_by(ingredient=ing_to_add, user=current_user).first()
+        existing_pantry_item = OnHand.query.filter_by(ingredient=ing_to_add, user_id=current_user.id).first()
         
         if existing_pantry_item:
             existing_pantry_item.quantity = qty_to_add + existing_pantry_item.quantity
@@ -199,14 +257,68 @@ def pantry():
             flash(f'Added {qty_to_add} of {existing_pantry_item.ingredient.name}.')
             return redirect(url_for('pantry'))
         else:
-            new_pantry_item = OnHand.create(current_user, ing_to_add, qty_to_add)
+            new_pantry_item = OnHand(user_id=current_user.id, ingredient_id=ing_to_add.id, quantity=qty_to_add)
             db.session.add(new_pantry_item)
             db.session.commit()
-            flash(f'Added {new_pantry_item.quantity} of {new_pantry_item.ingredient.name}.')
+            flash(f'Added {qty_to_add} of {ing_to_add.name}.')
             return redirect(url_for('pantry'))
     
-    return render_template('pantry.html', user_pantry=user_pantry, add_ingredient_form=add_ingredient_form)
+    shortfalls = shortfall.shortfalls(current_user.id)
+    
+    return render_template('pantry.html', user_pantry=user_pantry, add_ingredient_form=add_ingredient_form, shortfalls=shortfalls)
+    
+@app.route('/pantry/import', methods=['GET', 'POST'])
+@login_required
+def import_pantry():
+    '''Restock the pantry from an uploaded inventory file.'''
+    import_form = PantryImportForm()
+    
+    if import_form.validate_on_submit():
+        upload = import_form.inventory.data
+        try:
+            counts = inventory.import_inventory(current_user.id, inventory.iter_upload(upload.stream, upload.filename), import_form.mode.data)
+        except (ValueError, UnicodeDecodeError) as error:
+            flash(f'Nothing was imported: {error}')
+            return redirect(url_for('import_pantry'))
+        
+        flash(f'Imported {counts["items"]} pantry items.')
+        return redirect(url_for('pantry'))
+    
+    return render_template('pantry_import.html', import_form=import_form)
+
+@app.route('/api/pantry', methods=['POST'])
+@login_required
+def api_edit_pantry():
+    '''Edit many pantry items at once from JSON {"items": [{"ingredient_id": ..., "quantity": ...}], "mode": "set" or "add", "remove": [ids]}.'''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='Expected a JSON object.'), 400
+    
+    try:
+        items = [(item['ingredient_id'], item['quantity']) for item in body.get('items', [])]
+        (changed, removed) = inventory.batch_edit(current_user.id, items, body.get('mode', 'set'), body.get('remove', []))
+    except (KeyError, TypeError):
+        return jsonify(error='Expected {"items": [{"ingredient_id": ..., "quantity": ...}]}.'), 400
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    
+    return jsonify(changed=changed, removed=removed)
+
+@app.route('/api/pantry/import', methods=['POST'])
+@login_required
+def api_import_pantry():
+    '''Import a multipart-uploaded inventory file. Takes an optional mode of "add" (the default) or "set".'''
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify(error='Upload the inventory as a file field named "file".'), 400
     
+    try:
+        counts = inventory.import_inventory(current_user.id, inventory.iter_upload(upload.stream, upload.filename or ''), request.form.get('mode', 'add'))
+    except (ValueError, UnicodeDecodeError) as error:
+        return jsonify(error=str(error)), 400
+    
+    return jsonify(counts)
+
 @app.route('/pantry/delfrom/<ingredient_id>')
 def del_from_pantry(ingredient_id):
     to_delete = OnHand.query.filter_by(user_id=current_user.id, ingredient_id=ingredient_id).first()
@@ -215,21 +327,90 @@ def del_from_pantry(ingredient_id):
     flash("Ingredient deleted from pantry!")
     return redirect(url_for('pantry'))
 
+def grocery_list_fragments(kind, summaries, load=queries.grocery_lists_with_ingredients):
+    '''Rendered item lists {id: Markup} for grocery list summary rows. Only lists that changed are loaded, through load(ids).'''
+    template = 'fragments/active_list.html' if kind == fragments.ACTIVE_LIST else 'fragments/past_list.html'
+    return fragments.fragment_cache.render(kind, [(row.id, row.revision) for row in summaries],
+                                           lambda list_ids: {grocery_list.id: render_template(template, grocery_list=grocery_list)
+                                                             for grocery_list in load(list_ids)})
+
 @app.route('/lists')
 @login_required
 def lists():
-    active_list = GroceryList.query.filter_by(user_id=current_user.id, active=True).first()
-    previous_lists = GroceryList.query.filter_by(user_id=current_user.id, active=False).all()
+    active_list = queries.active_list_summary(current_user.id)
+    
+    if request.args.get('stream'):
+        #Stream the whole history, rendering each page of lists as it is fetched.
+        template = app.jinja_env.get_template('lists.html')
+        previous_lists = itertools.chain(queries.iter_grocery_history(current_user.id), archive.iter_archived_lists(current_user.id))
+        context = dict(active_list=active_list, previous_lists=previous_lists, next_before=None, archived_months=(),
+                       active_list_items=active_list and grocery_list_fragments(fragments.ACTIVE_LIST, [active_list])[active_list.id],
+                       list_items=lambda grocery_list: grocery_list_fragments(fragments.PAST_LIST, [grocery_list], lambda list_ids: [grocery_list])[grocery_list.id])
+        app.update_template_context(context)
+        return Response(stream_with_context(template.generate(context)))
+    
+    before = request.args.get('before', type=int)
+    previous_lists = queries.grocery_history_summaries(current_user.id, before, queries.HISTORY_PAGE_SIZE + 1)
+    #Archived months are listed after the last page of recent history. They are looked up on every page so each page costs the same queries
+    archived_months = archive.archived_months(current_user.id)
+    if len(previous_lists) > queries.HISTORY_PAGE_SIZE:
+        archived_months = []
+    etag = http_cache.lists_etag(current_user.id, before, active_list, previous_lists, archived_months)
+    next_before = None
+    if len(previous_lists) > queries.HISTORY_PAGE_SIZE:
+        previous_lists = previous_lists[:queries.HISTORY_PAGE_SIZE]
+        next_before = previous_lists[-1].id
+    
+    def render():
+        #Each list's items are rendered once per revision; only lists that changed are loaded
+        history_items = grocery_list_fragments(fragments.PAST_LIST, previous_lists)
+        return render_template('lists.html', active_list=active_list, previous_lists=previous_lists, next_before=next_before, archived_months=archived_months,
+                               active_list_items=active_list and grocery_list_fragments(fragments.ACTIVE_LIST, [active_list])[active_list.id],
+                               list_items=lambda grocery_list: history_items[grocery_list.id])
+    
+    return http_cache.conditional(etag, render)
+
+@app.route('/lists/<int:grocery_list_id>')
+@login_required
+def view_list(grocery_list_id):
+    '''A single grocery list. Purchased lists never change, so browsers may cache them for good.'''
+    (etag, cache_control) = http_cache.grocery_list_cache(current_user.id, grocery_list_id)
+    if etag is None:
+        archived_list = archive.archived_list(current_user.id, grocery_list_id)
+        if archived_list is None:
+            flash("That grocery list doesn't exist.")
+            return redirect(url_for('lists'))
+        etag = http_cache.make_etag('grocery_list', grocery_list_id, archived_list.revision)
+        return http_cache.conditional(etag, lambda: render_template('grocery_list.html', grocery_list=archived_list), http_cache.IMMUTABLE)
+    
+    return http_cache.conditional(etag, lambda: render_template('grocery_list.html', grocery_list=queries.grocery_list_with_ingredients(grocery_list_id)), cache_control)
+
+@app.route('/lists/archive/<int:year>/<int:month>')
+@login_required
+def archived_lists(year, month):
+    '''One month of archived grocery lists.'''
+    try:
+        archive_month = date(year, month, 1)
+    except ValueError:
+        archive_month = None
+    etag = archive_month and http_cache.archive_etag(current_user.id, archive_month)
+    if etag is None:
+        flash("There are no archived lists for that month.")
+        return redirect(url_for('lists'))
+    
+    def render():
+        month_lists = archive.archived_lists(current_user.id, archive_month)
+        items = grocery_list_fragments(fragments.PAST_LIST, month_lists, lambda list_ids: [grocery_list for grocery_list in month_lists if grocery_list.id in list_ids])
+        return render_template('archived_lists.html', month=archive_month, month_lists=month_lists, list_items=lambda grocery_list: items[grocery_list.id])
     
-    return render_template('lists.html', active_list=active_list, previous_lists=previous_lists)
+    return http_cache.conditional(etag, render)
 
 @app.route('/lists/add_ingredient', methods=["GET", "POST"])
 @login_required
 def add_ing_to_list():
-    active_list = GroceryList.query.filter_by(user=current_user, active=True).first()
+    active_list = GroceryList.query.filter_by(user_id=current_user.id, active=True).first()
     
     add_ing_form = AddIngredientForm()
-    add_ing_form.update_ingredients(Ingredient.query.all())
     
     if add_ing_form.validate_on_submit():
         ing_id = add_ing_form.ingredient.data
@@ -244,7 +425,7 @@ def add_ing_to_list():
             flash(f'Added {qty_to_add} of {existing_list_item.ingredient.name} to active list')
             return redirect(url_for('lists'))
         else:
-            new_list_item = GroceryIngredient.create(ing_to_add, active_list, qty_to_add)
+            new_list_item = GroceryIngredient(ingredient_id=ing_to_add.id, grocery_list_id=active_list.id, quantity=qty_to_add)
             db.session.add(new_list_item)
             db.session.commit()
             flash(f'Added {qty_to_add} of {ing_to_add.name} to active list')
@@ -261,27 +442,58 @@ def remove_from_list(grocery_ingredient_id):
     flash("Deleted from grocery list!")
     return redirect(url_for('lists'))
 
+@app.route('/lists/history/clear', methods=['GET', 'POST'])
+@login_required
+def clear_list_history():
+    '''Delete every purchased grocery list, keeping the active one, once the user confirms.'''
+    clear_form = ClearHistoryForm()
+    
+    if clear_form.validate_on_submit():
+        deleted = bulk_delete.delete_grocery_lists(current_user.id, purchased_only=True)
+        db.session.commit()
+        flash(f'Deleted {len(deleted)} past grocery lists.')
+        return redirect(url_for('lists'))
+    
+    return render_template('clear_history.html', clear_form=clear_form)
+
+@app.route('/api/delete', methods=['POST'])
+@login_required
+def api_bulk_delete():
+    '''Delete many of the user's things in one transaction.
+
+    Takes JSON {"recipes": [ids], "menus": [ids], "grocery_lists": [ids], "purchased_lists": true}, all optional;
+    purchased_lists deletes every purchased grocery list.
+    '''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='Expected a JSON object.'), 400
+    try:
+        ids = {key: [int(object_id) for object_id in body.get(key, [])] for key in ('recipes', 'menus', 'grocery_lists')}
+    except (TypeError, ValueError):
+        return jsonify(error='Ids must be lists of integers.'), 400
+    
+    deleted_recipes = bulk_delete.delete_recipes(current_user.id, ids['recipes']) if ids['recipes'] else []
+    deleted = {
+        'recipes': len(deleted_recipes),
+        'menus': len(bulk_delete.delete_menus(current_user.id, ids['menus'])) if ids['menus'] else 0,
+        'grocery_lists': len(bulk_delete.delete_grocery_lists(current_user.id, ids['grocery_lists'])) if ids['grocery_lists'] else 0,
+    }
+    if body.get('purchased_lists'):
+        deleted['grocery_lists'] += len(bulk_delete.delete_grocery_lists(current_user.id, purchased_only=True))
+    db.session.commit()
+    ranking.recipe_ranker.recipes_removed(current_user.id, [row.id for row in deleted_recipes])
+    return jsonify(deleted=deleted)
+
 @app.route('/lists/purchase')
 @login_required
 def purchase_list():
-    active_list = GroceryList.query.filter_by(user=current_user, active=True).first()
+    active_list_id = grocery.active_list_id(current_user.id)
     
-    for grocery_ingredient in active_list.grocery_ingredients:
-        ing_to_add = grocery_ingredient.ingredient
-        qty_to_add = grocery_ingredient.quantity
-        
-        ing_in_pantry = OnHand.query.filter_by(ingredient=ing_to_add, user=current_user).first()
-        
-        if ing_in_pantry:
-            ing_in_pantry.quantity = qty_to_add + ing_in_pantry.quantity
-            db.session.commit()
-        else:
-            new_pantry_item = OnHand.create(current_user, ing_to_add, qty_to_add)
-            db.session.add(new_pantry_item)
-            db.session.commit()
+    if not active_list_id:
+        flash("You don't have an active list to purchase.")
+        return redirect(url_for('lists'))
     
-    active_list.active = False
-    db.session.commit()
+    grocery.purchase_list(current_user.id, active_list_id)
     
     flash('Ingredients from list added to pantry!')
     return redirect(url_for('pantry'))
@@ -289,65 +501,134 @@ def purchase_list():
 @app.route('/lists/generate')
 @login_required
 def generate_list():
-    active_menu = Menu.query.filter_by(user_id=current_user.id, active=True).first()
-    
-    if not active_menu:
+    active_menu_id = grocery.active_menu_id(current_user.id)
+
+    if not active_menu_id:
         flash("Sorry, we need an active menu. Set one in your menu page!")
         return redirect(url_for('lists'))
+    elif grocery.active_list_id(current_user.id):
+        flash("You already have an active list. Mark it as purchased before creating a new one.")
+        return redirect(url_for('lists'))
     else:
-        today = date.today()
-        new_grocery_list = GroceryList.create(str(today), current_user)
-        new_grocery_list.active = True
-        
-        for day in active_menu.days:
-            for day_recipe in day.days_recipes:
-                for recipe_ingredient in day_recipe.recipe.recipe_ingredients:
-                    
-                    ingredient_in_pantry = OnHand.query.filter_by(ingredient_id=recipe_ingredient.ingredient.id, user_id=current_user.id).first()
-                    
-                    if ingredient_in_pantry:
-                        qty_in_pantry = ingredient_in_pantry.quantity
-                        qty_to_add = recipe_ingredient.quantity - qty_in_pantry
-                        if qty_to_add > 0:
-                            new_list_ingredient = GroceryIngredient.create(recipe_ingredient.ingredient, new_grocery_list, qty_to_add)
-                            db.session.add(new_list_ingredient)
-                    else:
-                        new_list_ingredient = GroceryIngredient.create(recipe_ingredient.ingredient, new_grocery_list, recipe_ingredient.quantity)
-                        db.session.add(new_list_ingredient)
-        
-        if not new_grocery_list.grocery_ingredients:
+        new_grocery_list = grocery.generate_list(current_user.id)
+
+        if not new_grocery_list:
             flash("Can't create new list; ingredients for your menu are all in your pantry.")
             return redirect(url_for('lists'))
-        db.session.add(new_grocery_list)
-        db.session.commit()
         flash('New grocery list created from menu!')
         return redirect(url_for('lists'))
 
+@app.route('/lists/consolidate', methods=['GET', 'POST'])
+@login_required
+def consolidate_lists():
+    '''Build one grocery list for several menus, each running for some number of weeks.'''
+    menu_names = {menu.id: menu.name for menu in queries.menu_summaries(current_user.id)}
+    consolidate_form = ConsolidateListForm()
+    
+    if not consolidate_form.is_submitted():
+        for menu_id in menu_names:
+            consolidate_form.menus.append_entry({'menu_id': menu_id, 'weeks': 0})
+    elif consolidate_form.validate():
+        if grocery.active_list_id(current_user.id):
+            flash("You already have an active list. Mark it as purchased before creating a new one.")
+            return redirect(url_for('lists'))
+        
+        weeks = {entry.menu_id.data: entry.weeks.data for entry in consolidate_form.menus if entry.weeks.data}
+        try:
+            new_grocery_list = consolidate.consolidate_lists(current_user.id, weeks, consolidate_form.name.data or None)
+        except ValueError as error:
+            flash(str(error))
+            return redirect(url_for('consolidate_lists'))
+        
+        if not new_grocery_list:
+            flash("Can't create new list; ingredients for those menus are all in your pantry.")
+        else:
+            flash('New grocery list created from your menus!')
+        return redirect(url_for('lists'))
+    
+    return render_template('consolidate.html', consolidate_form=consolidate_form, menu_names=menu_names)
+
+@app.route('/api/lists/consolidate', methods=['POST'])
+@login_required
+def api_consolidate_lists():
+    '''Build one grocery list from JSON {"menus": {menu id: weeks, ...}, "name": optional}.'''
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get('menus'), dict):
+        return jsonify(error='Expected {"menus": {menu id: weeks}}.'), 400
+    if grocery.active_list_id(current_user.id):
+        return jsonify(error='You already have an active list.'), 409
+    
+    try:
+        new_grocery_list = consolidate.consolidate_lists(current_user.id, body['menus'], body.get('name'))
+    except (TypeError, ValueError) as error:
+        return jsonify(error=str(error)), 400
+    
+    if not new_grocery_list:
+        return jsonify(grocery_list_id=None)
+    return jsonify(grocery_list_id=new_grocery_list.id, name=new_grocery_list.name), 201
+
+@app.route('/export')
+@login_required
+def export_data():
+    '''Download everything the user has as JSON Lines, streamed as it is read. Takes an optional comma separated ?sections=.'''
+    try:
+        sections = export.parse_sections(request.args.get('sections'))
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    
+    return Response(stream_with_context(export.iter_ndjson(current_user.id, sections)), mimetype='application/x-ndjson',
+                    headers={'Content-Disposition': 'attachment; filename=menu_master_export.jsonl', 'Cache-Control': 'no-store'})
+
+@app.route('/api/ingredients/search')
+@login_required
+def search_ingredients():
+    '''Typeahead search over ingredient names, returning the top matches as JSON.'''
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    results = ingredient_catalog.search(request.args.get('q', ''), limit)
+    
+    return jsonify(results=[{'id': ingredient_id, 'name': name} for (ingredient_id, name) in results])
+
 @app.route('/recipes')
 @login_required
 def recipes():
-    user_recipes = Recipe.query.filter_by(user=current_user).all()
+    user_recipes = queries.recipes_with_ingredients(current_user.id)
     
     return render_template('recipes.html', user_recipes=user_recipes)
 
-@app.route('/recipe/delete/<recipe_id>')
+@app.route('/recipes/cook')
+@login_required
+def cook_from_pantry():
+    '''Rank the user's recipes by how much of each is already in their pantry.'''
+    matches = ranking.recipe_ranker.rank(current_user.id)
+    
+    return render_template('cook.html', matches=matches)
+
+@app.route('/api/recipes/cook')
+@login_required
+def api_cook_from_pantry():
+    '''JSON version of cook_from_pantry. Takes an optional limit of up to 100 results.'''
+    limit = min(request.args.get('limit', ranking.RANK_LIMIT, type=int), 100)
+    matches = ranking.recipe_ranker.rank(current_user.id, limit)
+    
+    return jsonify(results=[match._asdict() for match in matches])
+
+@app.route('/recipe/delete/<int:recipe_id>')
 @login_required
 def delete_recipe(recipe_id):
-    recipe = Recipe.query.filter_by(id=recipe_id).first()
-    db.session.delete(recipe)
+    deleted = bulk_delete.delete_recipes(current_user.id, [recipe_id])
     db.session.commit()
-    flash(f'{recipe.name} deleted!')
+    ranking.recipe_ranker.recipes_removed(current_user.id, [row.id for row in deleted])
+    if deleted:
+        flash(f'{deleted[0].name} deleted!')
     return redirect(url_for('recipes'))
 
 @app.route('/recipe/add', methods=["GET", "POST"])
 @login_required
 def add_recipe():
     name_form = RecipeNameForm()
-    if 'recipe_ingredients' not in session:
-        session['recipe_ingredients'] = []
     
     if name_form.validate_on_submit():
-        session['recipe_name'] = name_form.name.data
+        session['recipe_draft_id'] = drafts.create_draft(current_user.id, name_form.name.data)
         
         return redirect(url_for('add_ing_to_recipe'))
 
@@ -356,13 +637,22 @@ def add_recipe():
 @app.route('/recipe/add/ingredient', methods=["GET", "POST"])
 @login_required
 def add_ing_to_recipe():
+    if 'recipe_draft_id' not in session:
+        return redirect(url_for('add_recipe'))
+    
     ingredient_form = RecipeIngredientForm()
-    ingredient_form.update_recipe_ingredients(Ingredient.query.all())
     
     if ingredient_form.validate_on_submit():
-        recipe_ingredient_list = session['recipe_ingredients']
-        recipe_ingredient_list.append((ingredient_form.ingredient.data, ingredient_form.quantity.data))
-        session['recipe_ingredients'] = recipe_ingredient_list
+        try:
+            drafts.add_ingredients(current_user.id, session['recipe_draft_id'], [(ingredient_form.ingredient.data, ingredient_form.quantity.data)])
+        except drafts.DraftExpired as error:
+            session.pop('recipe_draft_id', None)
+            flash(str(error))
+            return redirect(url_for('add_recipe'))
+        except ValueError as error:
+            #The draft is still good, so let the user pick another ingredient
+            flash(str(error))
+            return redirect(url_for('add_ing_to_recipe'))
         
         if ingredient_form.add_another.data == "Yes":
             return redirect(url_for('add_ing_to_recipe'))
@@ -371,27 +661,42 @@ def add_ing_to_recipe():
     
     return render_template('recipe_ingredient.html', ingredient_form=ingredient_form)
 
+@app.route('/recipe/add/ingredients', methods=["POST"])
+@login_required
+def add_ings_to_recipe():
+    '''Add many ingredients to the current recipe draft at once from JSON {"ingredients": [{"id": ..., "quantity": ...}]}.'''
+    if 'recipe_draft_id' not in session:
+        return jsonify(error='Start a recipe before adding ingredients.'), 400
+    
+    body = request.get_json(silent=True) or {}
+    try:
+        items = [(item['id'], item['quantity']) for item in body['ingredients']]
+        added = drafts.add_ingredients(current_user.id, session['recipe_draft_id'], items)
+    except (KeyError, TypeError):
+        return jsonify(error='Expected {"ingredients": [{"id": ..., "quantity": ...}]}.'), 400
+    except ValueError as error:
+        return jsonify(error=str(error)), 400
+    
+    return jsonify(added=added)
+
 @app.route('/recipe/add/instructions', methods=["GET", "POST"])
 @login_required
 def add_instructions():
+    if 'recipe_draft_id' not in session:
+        return redirect(url_for('add_recipe'))
+    
     instruction_form = RecipeInstructionForm()
     
     if instruction_form.validate_on_submit():
-        new_recipe = Recipe.create(session['recipe_name'], instruction_form.instructions.data, current_user)
-        db.session.add(new_recipe)
-        print(session['recipe_ingredients'])
-        for (ingredient_id, quantity) in session['recipe_ingredients']:
-            ing_to_add = Ingredient.query.filter_by(id=ingredient_id).first()
-            print(ing_to_add)
-            new_recipe_ingredient = RecipeIngredient.create(new_recipe, ing_to_add, quantity)
-            
-            db.session.add(new_recipe_ingredient)
-        
-        db.session.commit()
-        
-        session.pop('recipe_ingredients', default=None)
-        session.pop('recipe_name', default=None)
+        try:
+            recipe_id = drafts.commit_draft(current_user.id, session['recipe_draft_id'], instruction_form.instructions.data)
+        except ValueError as error:
+            flash(str(error))
+            return redirect(url_for('add_recipe'))
+        finally:
+            session.pop('recipe_draft_id', None)
         
+        ranking.recipe_ranker.recipe_added(current_user.id, recipe_id)
         flash("Recipe added!")
         return redirect(url_for('recipes'))
     
@@ -400,10 +705,28 @@ def add_instructions():
 @app.route('/recipe/view/<recipe_id>')
 @login_required
 def view_recipe(recipe_id):
-    recipe = Recipe.query.filter_by(id=recipe_id).first()
-    recipe_ingredients = RecipeIngredient.query.filter_by(recipe=recipe).all()
-    return render_template('view_recipe.html', recipe=recipe, recipe_ingredients=recipe_ingredients)
+    return http_cache.conditional(http_cache.recipe_etag(recipe_id),
+                                  lambda: render_template('view_recipe.html', recipe=queries.recipe_with_ingredients(recipe_id)))
+
+def create_app(push_context=False, warm=False):
+    '''Configure the app from the environment and connect it to the database.
+
+    Needs FLASK_SECRET_KEY and POSTGRES_URI. Pass warm=True to load the ingredient catalog and
+    compile every template up front, e.g. once in a pre-fork server's master process.
+    '''
+    app.secret_key = os.environ['FLASK_SECRET_KEY']
+    connect_to_db(app, push_context=push_context)
+    if warm:
+        warm_up(app)
+    return app
+
+def warm_up(app):
+    '''Prime the per-process caches so the first requests in each worker don't pay for them.'''
+    with app.app_context():
+        ingredient_catalog.snapshot()
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
 
 if __name__ == '__main__':
-    connect_to_db(app)
+    create_app(push_context=True)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,68 @@
+'''Incrementally maintained demand for each user's active menu, and the shortfall it implies.
+
+menu_demand holds how much of each ingredient a user's active menu needs for the week. Rather than
+being recomputed, it is adjusted by deltas when a menu is activated, deactivated or deleted and when
+a recipe on the active menu changes. Reading what a user is short on is then one indexed join against
+on_hand. Pantry changes need no bookkeeping because on_hand is read live.
+'''
+
+from sqlalchemy import select, delete, func, literal, and_
+from model import db, upsert, Menu, Day, DaysRecipe, RecipeIngredient, OnHand, Ingredient, MenuDemand
+
+
+def menu_demand(menu_id):
+    '''Subquery of the total quantity of each ingredient a menu needs for the week.'''
+    return (select(RecipeIngredient.ingredient_id, func.sum(RecipeIngredient.quantity).label('quantity'))
+            .join(DaysRecipe, DaysRecipe.recipe_id == RecipeIngredient.recipe_id)
+            .join(Day, Day.id == DaysRecipe.day_id)
+            .where(Day.menu_id == menu_id)
+            .group_by(RecipeIngredient.ingredient_id)
+            .subquery())
+
+def apply_deltas(deltas):
+    '''Add a select of (user_id, ingredient_id, quantity) deltas into menu_demand, dropping rows that reach zero.'''
+    merge = upsert(MenuDemand).from_select(['user_id', 'ingredient_id', 'quantity'], deltas)
+    merge = merge.on_conflict_do_update(index_elements=['user_id', 'ingredient_id'],
+                                        set_={'quantity': MenuDemand.quantity + merge.excluded.quantity})
+    db.session.execute(merge)
+    db.session.execute(delete(MenuDemand).where(MenuDemand.quantity <= 0))
+
+def clear(user_id):
+    '''Forget the user's demand, for when they no longer have an active menu.'''
+    db.session.execute(delete(MenuDemand).where(MenuDemand.user_id == user_id))
+
+def set_active_menu(user_id, menu_id):
+    '''Replace the user's demand with the needs of menu_id.'''
+    clear(user_id)
+    demand = menu_demand(menu_id)
+    apply_deltas(select(literal(user_id), demand.c.ingredient_id, demand.c.quantity)
+                 .where(demand.c.quantity != 0))
+
+def remove_recipes(recipe_ids):
+    '''Take recipes' ingredients, once per time they appear, out of the demand of every active menu that uses them.
+
+    recipe_ids can be a list or a select of ids.
+    '''
+    deltas = (select(Menu.user_id, RecipeIngredient.ingredient_id, -func.sum(RecipeIngredient.quantity))
+              .join(DaysRecipe, DaysRecipe.recipe_id == RecipeIngredient.recipe_id)
+              .join(Day, Day.id == DaysRecipe.day_id)
+              .join(Menu, Menu.id == Day.menu_id)
+              .where(RecipeIngredient.recipe_id.in_(recipe_ids), Menu.active == True)
+              .group_by(Menu.user_id, RecipeIngredient.ingredient_id))
+    apply_deltas(deltas)
+
+def shortfall_query(user_id):
+    '''Select (ingredient_id, quantity) for everything the active menu needs more of than the pantry holds.'''
+    short = MenuDemand.quantity - func.coalesce(OnHand.quantity, 0)
+
+    return (select(MenuDemand.ingredient_id, short.label('quantity'))
+            .outerjoin(OnHand, and_(OnHand.user_id == MenuDemand.user_id, OnHand.ingredient_id == MenuDemand.ingredient_id))
+            .where(MenuDemand.user_id == user_id, short > 0))
+
+def shortfalls(user_id):
+    '''{ingredient_id: (name, quantity short)} for the user's active menu, for the "you're short on" badges.'''
+    short = shortfall_query(user_id).subquery()
+    rows = db.session.execute(select(short.c.ingredient_id, Ingredient.name, short.c.quantity)
+                              .join(Ingredient, Ingredient.id == short.c.ingredient_id)
+                              .order_by(Ingredient.name)).all()
+    return {ingredient_id: (name, quantity) for (ingredient_id, name, quantity) in rows}
@@ -0,0 +1,27 @@
+// Typeahead for ingredient pickers. Fills the datalist from /api/ingredients/search as the user types
+// and copies the chosen ingredient's id into the hidden field named by data-target.
+document.querySelectorAll('.ingredient-search').forEach(function (input) {
+    var hidden = document.getElementById(input.dataset.target);
+    var options = document.getElementById(input.getAttribute('list'));
+    var ids = {};
+    var timer = null;
+
+    input.addEventListener('input', function () {
+        hidden.value = ids[input.value] || '';
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            fetch('/api/ingredients/search?q=' + encodeURIComponent(input.value))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    options.innerHTML = '';
+                    data.results.forEach(function (result) {
+                        ids[result.name] = result.id;
+                        var option = document.createElement('option');
+                        option.value = result.name;
+                        options.appendChild(option);
+                    });
+                    hidden.value = ids[input.value] || '';
+                });
+        }, 150);
+    });
+});
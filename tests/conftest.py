@@ -0,0 +1,62 @@
+'''Shared fixtures: the app against a throwaway SQLite database, rebuilt empty for every test.'''
+
+import os
+import sys
+import tempfile
+from argparse import Namespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('POSTGRES_URI', f'sqlite:///{os.path.join(tempfile.mkdtemp(), "menu_master_test.db")}')
+os.environ.setdefault('FLASK_SECRET_KEY', 'test')
+
+import random
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app():
+    import server
+    app = server.create_app()
+    app.config['TESTING'] = True
+    return app
+
+@pytest.fixture
+def database(app):
+    '''Empty tables and empty per-process caches, inside an app context.'''
+    from model import db
+    from auth import user_cache
+    from catalog import ingredient_catalog
+    from fragments import fragment_cache
+    from ranking import recipe_ranker
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for cache in (user_cache, fragment_cache, recipe_ranker):
+            cache.clear()
+        ingredient_catalog.invalidate()
+        yield db
+        db.session.remove()
+
+def dataset(**sizes):
+    '''benchmark.py arguments for one user's synthetic dataset of the given sizes.'''
+    args = {'users': 1, 'ingredients': 50, 'recipes': 20, 'ingredients_per_recipe': 5, 'pantry': 10,
+            'menus': 3, 'lists': 5, 'items_per_list': 5}
+    args.update(sizes)
+    return Namespace(**args)
+
+@pytest.fixture
+def generate(database):
+    '''Load a benchmark.py dataset, e.g. generate(recipes=500), and return its user ids.'''
+    import benchmark
+    return lambda **sizes: benchmark.generate(dataset(**sizes), random.Random(1))
+
+@pytest.fixture
+def login(app):
+    '''A test client signed in as the given user id.'''
+    def login(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['_user_id'] = str(user_id)
+            sess['_fresh'] = True
+        return client
+    return login
@@ -0,0 +1,72 @@
+'''Bulk deletes leave no child rows behind, and clearing list history needs a confirmed, CSRF-checked POST.'''
+
+import re
+from sqlalchemy import select, func
+from model import Recipe, RecipeIngredient, Menu, Day, DaysRecipe, GroceryList, GroceryIngredient
+import bulk_delete
+
+#(child table, its foreign key column, parent id column)
+CHILDREN = [
+    (RecipeIngredient, RecipeIngredient.recipe_id, Recipe.id),
+    (DaysRecipe, DaysRecipe.recipe_id, Recipe.id),
+    (Day, Day.menu_id, Menu.id),
+    (DaysRecipe, DaysRecipe.day_id, Day.id),
+    (GroceryIngredient, GroceryIngredient.grocery_list_id, GroceryList.id),
+]
+
+
+def orphans(session):
+    '''{foreign key: rows pointing at a parent that no longer exists}, for the keys that have any.'''
+    counts = {str(key): session.execute(select(func.count()).select_from(child).where(key.not_in(select(parent)))).scalar()
+              for (child, key, parent) in CHILDREN}
+    return {key: count for (key, count) in counts.items() if count}
+
+def ids(session, column, **filters):
+    return session.execute(select(column).filter_by(**filters)).scalars().all()
+
+
+def test_deleting_recipes_menus_and_lists_leaves_no_orphans(database, generate):
+    (user_id,) = generate(recipes=10, menus=4, lists=6)
+    session = database.session
+
+    recipe_ids = ids(session, Recipe.id, user_id=user_id)[:5]
+    assert len(bulk_delete.delete_recipes(user_id, recipe_ids)) == 5
+    session.commit()
+    assert orphans(session) == {}
+
+    menu_ids = ids(session, Menu.id, user_id=user_id)[:2]
+    assert len(bulk_delete.delete_menus(user_id, menu_ids)) == 2
+    session.commit()
+    assert orphans(session) == {}
+
+    list_ids = ids(session, GroceryList.id, user_id=user_id)[:3]
+    assert len(bulk_delete.delete_grocery_lists(user_id, list_ids)) == 3
+    session.commit()
+    assert orphans(session) == {}
+    assert not set(list_ids) & set(ids(session, GroceryList.id))
+
+def test_deletes_are_scoped_to_the_user(database, generate):
+    (owner, other) = generate(users=2, recipes=3, menus=1, lists=2)
+    session = database.session
+
+    assert bulk_delete.delete_recipes(other, ids(session, Recipe.id, user_id=owner)) == []
+    assert bulk_delete.delete_menus(other, ids(session, Menu.id, user_id=owner)) == []
+    assert bulk_delete.delete_grocery_lists(other, ids(session, GroceryList.id, user_id=owner)) == []
+    session.commit()
+    assert len(ids(session, Recipe.id, user_id=owner)) == 3
+
+def test_clearing_list_history_needs_a_confirmed_post(database, generate, login):
+    (user_id,) = generate(lists=4)
+    client = login(user_id)
+
+    page = client.get('/lists/history/clear')
+    assert page.status_code == 200
+    assert client.post('/lists/history/clear').status_code == 200
+    database.session.rollback()
+    assert len(ids(database.session, GroceryList.id, user_id=user_id)) == 4
+
+    token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page.get_data(as_text=True)).group(1)
+    assert client.post('/lists/history/clear', data={'csrf_token': token}).status_code == 302
+    database.session.rollback()
+    assert ids(database.session, GroceryList.id, user_id=user_id) == []
+    assert orphans(database.session) == {}
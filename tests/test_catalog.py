@@ -0,0 +1,20 @@
+'''The shared ingredient catalog version only moves when the catalog itself changes.'''
+
+import catalog
+from model import User, Ingredient, OnHand
+
+
+def test_adding_to_a_pantry_leaves_the_catalog_version_alone(database):
+    user = User.create('cook', 'cook@example.com', 'secret')
+    flour = Ingredient.create('Flour')
+    database.session.add_all([user, flour])
+    database.session.commit()
+    version = catalog.current_version()
+
+    database.session.add(OnHand.create(user, flour, 2))
+    database.session.commit()
+    assert catalog.current_version() == version
+
+    flour.name = 'Plain Flour'
+    database.session.commit()
+    assert catalog.current_version() == version + 1
@@ -0,0 +1,53 @@
+'''A recipe draft survives a bad ingredient and is only dropped once it has expired.'''
+
+import pytest
+from sqlalchemy import delete, select, func
+from catalog import ingredient_catalog
+from model import User, Ingredient, RecipeDraft, RecipeDraftIngredient
+import drafts
+
+
+@pytest.fixture
+def cook(app, database, login, monkeypatch):
+    '''(client, draft id) for a user part way through adding a recipe, with form CSRF checks off.'''
+    monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', False)
+    user = User.create('cook', 'cook@example.com', 'secret')
+    database.session.add_all([user, Ingredient.create('Flour'), Ingredient.create('Sugar')])
+    database.session.commit()
+
+    draft_id = drafts.create_draft(user.id, 'Cake')
+    client = login(user.id)
+    with client.session_transaction() as sess:
+        sess['recipe_draft_id'] = draft_id
+    return (client, draft_id)
+
+def add(client, ingredient_id):
+    return client.post('/recipe/add/ingredient', data={'ingredient': ingredient_id, 'quantity': 2, 'add_another': 'Yes'})
+
+def draft_in_session(client):
+    with client.session_transaction() as sess:
+        return sess.get('recipe_draft_id')
+
+
+def test_an_unknown_ingredient_keeps_the_draft(database, cook):
+    (client, draft_id) = cook
+    assert add(client, 1).headers['Location'].endswith('/recipe/add/ingredient')
+
+    #Delete an ingredient behind the cached catalog's back, so only add_ingredients notices it is gone
+    ingredient_catalog.snapshot()
+    database.session.execute(delete(Ingredient).where(Ingredient.id == 2))
+    database.session.commit()
+
+    response = add(client, 2)
+    assert response.headers['Location'].endswith('/recipe/add/ingredient')
+    assert draft_in_session(client) == draft_id
+    assert database.session.execute(select(func.count()).select_from(RecipeDraftIngredient).filter_by(draft_id=draft_id)).scalar() == 1
+
+def test_an_expired_draft_is_dropped(database, cook):
+    (client, draft_id) = cook
+    database.session.execute(delete(RecipeDraft).where(RecipeDraft.id == draft_id))
+    database.session.commit()
+
+    response = add(client, 1)
+    assert response.headers['Location'].endswith('/recipe/add')
+    assert draft_in_session(client) is None
@@ -0,0 +1,12 @@
+'''The lookups the routes make on every request must use an index, however big the tables get.'''
+
+import benchmark
+
+
+def test_hot_lookups_use_indexes(generate):
+    (user_id,) = generate(ingredients=500, recipes=200, pantry=100, menus=20, lists=50)
+    results = benchmark.explain(user_id)
+
+    assert set(results) == {name for (name, _, _) in benchmark.hot_lookups(user_id)}
+    full_scans = {name: check['plan'] for (name, check) in results.items() if check['full_scan']}
+    assert not full_scans
@@ -0,0 +1,69 @@
+'''Pantry imports, batch edits and cooking all remove an item that reaches 0, and leave every other item alone.'''
+
+import pytest
+from sqlalchemy import insert, select
+from model import User, Ingredient, Recipe, RecipeIngredient, OnHand
+import inventory
+import menu_builder
+
+
+@pytest.fixture
+def user_id(database):
+    user_id = database.session.execute(insert(User).values(username='cook', email='cook@example.com', password='x').returning(User.id)).scalar_one()
+    database.session.execute(insert(Ingredient), [{'name': name} for name in ('Flour', 'Sugar', 'Eggs', 'Salt')])
+    database.session.commit()
+    return user_id
+
+def pantry(session, user_id):
+    '''{ingredient name: quantity} for the user's pantry.'''
+    session.rollback()
+    return dict(session.execute(select(Ingredient.name, OnHand.quantity)
+                                .join(OnHand, OnHand.ingredient_id == Ingredient.id)
+                                .where(OnHand.user_id == user_id)).all())
+
+def stock(session, user_id, **quantities):
+    inventory.import_inventory(user_id, [{'name': name, 'qty': qty} for (name, qty) in quantities.items()], 'set')
+    return {name: ingredient_id for (name, ingredient_id) in session.execute(select(Ingredient.name, Ingredient.id))}
+
+
+def test_import(database, user_id):
+    stock(database.session, user_id, Flour=5, Sugar=2)
+    inventory.import_inventory(user_id, [{'name': 'Flour', 'qty': 1}, {'name': 'Flour', 'qty': 2}, {'name': 'Eggs', 'qty': 0}], 'add')
+    assert pantry(database.session, user_id) == {'Flour': 8, 'Sugar': 2}
+
+    records = [{'name': 'Flour', 'qty': 4}, {'name': 'Sugar', 'qty': 0}, {'name': 'Flour', 'qty': 3}, {'name': 'Butter', 'qty': 1}]
+    inventory.import_inventory(user_id, iter(records), 'set', batch_size=2)
+    assert pantry(database.session, user_id) == {'Flour': 3, 'Butter': 1}
+
+def test_import_rejects_a_bad_record_without_saving_anything(database, user_id):
+    stock(database.session, user_id, Flour=5)
+    with pytest.raises(ValueError):
+        inventory.import_inventory(user_id, [{'name': 'Flour', 'qty': 1}, {'name': 'Sugar', 'qty': -1}])
+    assert pantry(database.session, user_id) == {'Flour': 5}
+
+def test_batch_edit(database, user_id):
+    ids = stock(database.session, user_id, Flour=5, Sugar=2, Eggs=6)
+    assert inventory.batch_edit(user_id, [(ids['Flour'], 0), (ids['Salt'], 1)], 'set', remove=[ids['Eggs']]) == (2, 1)
+    assert pantry(database.session, user_id) == {'Sugar': 2, 'Salt': 1}
+
+    assert inventory.batch_edit(user_id, [(ids['Sugar'], 3), (ids['Flour'], 0)], 'add') == (2, 0)
+    assert pantry(database.session, user_id) == {'Sugar': 5, 'Salt': 1}
+
+    with pytest.raises(ValueError):
+        inventory.batch_edit(user_id, [(ids['Sugar'], 1)], 'set', remove=['Salt'])
+    assert pantry(database.session, user_id) == {'Sugar': 5, 'Salt': 1}
+
+def test_cook_day_only_removes_what_the_day_used_up(database, user_id):
+    ids = stock(database.session, user_id, Flour=5, Sugar=1, Eggs=6)
+    #An item already at 0 that the day doesn't use stays where it is
+    database.session.execute(insert(OnHand).values(user_id=user_id, ingredient_id=ids['Salt'], quantity=0))
+    recipe_id = database.session.execute(insert(Recipe).values(name='Cake', instructions='Bake.', user_id=user_id).returning(Recipe.id)).scalar_one()
+    database.session.execute(insert(RecipeIngredient), [{'recipe_id': recipe_id, 'ingredient_id': ids[name], 'quantity': quantity}
+                                                        for (name, quantity) in (('Flour', 2), ('Sugar', 3))])
+    database.session.commit()
+    menu_id = menu_builder.build_menu(user_id, 'Week', {1: [recipe_id]})
+
+    assert inventory.cook_day(user_id, menu_id, 1) == 2
+    assert pantry(database.session, user_id) == {'Flour': 3, 'Eggs': 6, 'Salt': 0}
+    with pytest.raises(ValueError):
+        inventory.cook_day(user_id, menu_id + 1, 1)
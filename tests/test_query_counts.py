@@ -0,0 +1,46 @@
+'''Each page costs a fixed number of queries, whether the user has one of everything or hundreds.'''
+
+import pytest
+from sqlalchemy import event, select
+from fragments import fragment_cache
+from model import Recipe
+
+#Queries per request with the user and catalog caches warm but no rendered fragments, so the page's loaders run
+QUERIES = {'/menus': 5, '/lists': 5, '/recipes': 2, '/recipe/view/<id>': 3, '/pantry': 2}
+
+DATASETS = {
+    'one of each': {'ingredients': 10, 'recipes': 1, 'ingredients_per_recipe': 1, 'pantry': 1, 'menus': 1, 'lists': 1, 'items_per_list': 1},
+    'many': {'ingredients': 500, 'recipes': 200, 'ingredients_per_recipe': 8, 'pantry': 100, 'menus': 20, 'lists': 60, 'items_per_list': 20},
+}
+
+
+def count_queries(engine, request):
+    '''How many statements request() sends to the database.'''
+    counter = {'queries': 0}
+    def count_query(*args):
+        counter['queries'] += 1
+
+    event.listen(engine, 'before_cursor_execute', count_query)
+    try:
+        request()
+    finally:
+        event.remove(engine, 'before_cursor_execute', count_query)
+    return counter['queries']
+
+@pytest.mark.parametrize('sizes', DATASETS.values(), ids=DATASETS.keys())
+def test_query_counts_do_not_grow_with_data(database, generate, login, sizes):
+    (user_id,) = generate(**sizes)
+    client = login(user_id)
+    recipe_id = database.session.execute(select(Recipe.id).filter_by(user_id=user_id).limit(1)).scalar()
+
+    counts = {}
+    for route in QUERIES:
+        url = route.replace('<id>', str(recipe_id))
+        assert client.get(url).status_code == 200
+        #Rendered menu weeks and lists are cached by revision; drop them so their rows are loaded again
+        fragment_cache.clear()
+        def request():
+            assert client.get(url).status_code == 200
+        counts[route] = count_queries(database.engine, request)
+
+    assert counts == QUERIES
@@ -0,0 +1,83 @@
+'''menu_demand, kept up to date by deltas, must always equal a recompute from the active menu.'''
+
+import pytest
+from sqlalchemy import select
+from model import Menu, Day, DaysRecipe, OnHand, MenuDemand
+import shortfall
+
+
+def recomputed_demand(session, user_id):
+    '''{ingredient_id: quantity} for the user's active menu, summed from scratch.'''
+    menu_id = session.execute(select(Menu.id).filter_by(user_id=user_id, active=True)).scalar()
+    if menu_id is None:
+        return {}
+    demand = shortfall.menu_demand(menu_id)
+    return {ingredient_id: quantity for (ingredient_id, quantity) in session.execute(select(demand)) if quantity != 0}
+
+def assert_matches_recompute(session, user_id):
+    #End this session's transaction so it sees what the requests committed
+    session.rollback()
+    demand = recomputed_demand(session, user_id)
+    assert dict(session.execute(select(MenuDemand.ingredient_id, MenuDemand.quantity).filter_by(user_id=user_id)).all()) == demand
+
+    pantry = dict(session.execute(select(OnHand.ingredient_id, OnHand.quantity).filter_by(user_id=user_id)).all())
+    short = {ingredient_id: quantity - pantry.get(ingredient_id, 0) for (ingredient_id, quantity) in demand.items()
+             if quantity > pantry.get(ingredient_id, 0)}
+    assert {ingredient_id: quantity for (ingredient_id, (_, quantity)) in shortfall.shortfalls(user_id).items()} == short
+
+def menu_ids(session, user_id):
+    '''(active menu id, [inactive menu ids]).'''
+    rows = session.execute(select(Menu.id, Menu.active).filter_by(user_id=user_id).order_by(Menu.id)).all()
+    return (next(row.id for row in rows if row.active), [row.id for row in rows if not row.active])
+
+def recipes_on(session, menu_id):
+    return session.execute(select(DaysRecipe.recipe_id).join(Day, Day.id == DaysRecipe.day_id).filter(Day.menu_id == menu_id)).scalars().all()
+
+@pytest.fixture
+def user(database, generate):
+    #Few recipes and ingredients, so menus share recipes and recipes share ingredients
+    (user_id,) = generate(ingredients=12, recipes=6, ingredients_per_recipe=3, pantry=6, menus=3, lists=0)
+    assert recomputed_demand(database.session, user_id)
+    return user_id
+
+
+def test_activate_deactivate_and_switch(database, login, user):
+    client = login(user)
+    (active, (other, _)) = menu_ids(database.session, user)
+    assert_matches_recompute(database.session, user)
+
+    client.get(f'/menus/deactivate/{other}')
+    assert_matches_recompute(database.session, user)
+    client.get(f'/menus/active/{other}')
+    assert_matches_recompute(database.session, user)
+    client.get(f'/menus/active/{active}')
+    assert_matches_recompute(database.session, user)
+    client.get(f'/menus/deactivate/{active}')
+    assert_matches_recompute(database.session, user)
+    assert recomputed_demand(database.session, user) == {}
+
+def test_delete_recipe_in_use(database, login, user):
+    client = login(user)
+    (active, _) = menu_ids(database.session, user)
+    for recipe_id in sorted(set(recipes_on(database.session, active)))[:2]:
+        client.get(f'/recipe/delete/{recipe_id}')
+        assert_matches_recompute(database.session, user)
+
+def test_delete_menus(database, login, user):
+    client = login(user)
+    (active, (other, _)) = menu_ids(database.session, user)
+    client.get(f'/menus/delete/{other}')
+    assert_matches_recompute(database.session, user)
+    client.get(f'/menus/delete/{active}')
+    assert_matches_recompute(database.session, user)
+
+def test_cook_and_purchase(database, login, user):
+    client = login(user)
+    (active, _) = menu_ids(database.session, user)
+    client.get(f'/menus/{active}/cooked/1')
+    assert_matches_recompute(database.session, user)
+
+    client.get('/lists/generate')
+    client.get('/lists/purchase')
+    assert_matches_recompute(database.session, user)
+    assert shortfall.shortfalls(user) == {}
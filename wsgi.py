@@ -0,0 +1,9 @@
+'''WSGI entry point for production servers, e.g. `gunicorn -c gunicorn.conf.py wsgi:app`.
+
+Set MENU_MASTER_WARM=0 to skip loading the ingredient catalog and templates at startup.
+'''
+
+import os
+from server import create_app
+
+app = create_app(warm=os.environ.get('MENU_MASTER_WARM', '1') != '0')